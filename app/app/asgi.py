@@ -0,0 +1,21 @@
+"""
+ASGI config for app project.
+
+It exposes the ASGI callable as a module-level variable named
+``application``. Recipe list/detail reads are served natively with asyncio,
+loading related collections concurrently; all other requests are handed to
+the WSGI application in a worker thread.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
+
+wsgi_application = get_wsgi_application()
+
+from core.asgi import AsgiHandler  # noqa: E402
+from recipe.asgi import async_views  # noqa: E402
+
+application = AsgiHandler(wsgi_application, async_views)
@@ -31,7 +31,9 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    # Admin modules are discovered when the URLconf loads (app/urls.py),
+    # not at start-up, so management commands don't import them
+    'django.contrib.admin.apps.SimpleAdminConfig',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -46,6 +48,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -74,6 +77,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'app.wsgi.application'
 
+# Threads (and therefore DB connections) per process used by app.asgi to
+# run ORM queries off the event loop.
+ASGI_DB_THREADS = int(os.environ.get('ASGI_DB_THREADS', 16))
+
 
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
@@ -88,6 +95,130 @@ DATABASES = {
     }
 }
 
+# Read replicas, e.g. DB_REPLICA_HOSTS=replica1,replica2. Safe requests of
+# the recipe API read from them unless the client wrote in the last
+# REPLICA_PIN_SECONDS.
+DATABASE_REPLICAS = []
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dict(
+        DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    DATABASE_REPLICAS.append(alias)
+
+# Per-user shards, e.g. DB_SHARD_HOSTS=shard1,shard2. Tags, ingredients
+# and recipes of each user live on one shard; users, auth tokens and the
+# core.UserShard directory stay on the default database.
+SHARD_DATABASES = []
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_SHARD_HOSTS', '').split(',')), 1):
+    alias = f'shard_{index}'
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host)
+    SHARD_DATABASES.append(alias)
+
+# Second database of the test suite, standing in for a shard or a replica
+# in tests that need rows on two databases, with DB_TEST_SECONDARY=1 (set
+# by CI). Only ever created by tests; those tests are skipped without it.
+if os.environ.get('DB_TEST_SECONDARY') == '1':
+    DATABASES['secondary'] = dict(
+        DATABASES['default'], TEST={'NAME': 'test_secondary'})
+
+SHARD_DIRECTORY_CACHE_SECONDS = 30
+SHARD_ID_RANGE = 10 ** 12
+
+# "Similar recipes": neighbours kept per recipe, 'jaccard' or 'cosine'
+# similarity of tag and ingredient sets, neighbour lists written per
+# transaction, and seconds a queued update waits for more changes
+RECIPE_SIMILARITY_TOP_K = 10
+RECIPE_SIMILARITY_METRIC = 'jaccard'
+RECIPE_SIMILARITY_BATCH_SIZE = 512
+RECIPE_SIMILARITY_DELAY = 2
+
+# Make recipe updates and deletes without an If-Match header fail with
+# 428 instead of overwriting concurrent changes
+RECIPE_REQUIRE_IF_MATCH = False
+
+# Recipe sync (core.changelog): log entries per response, age under which
+# entries wait for a later sync because their transaction may not have
+# committed yet, and age after which compact_change_log drops tombstones
+# (older cursors make clients sync from scratch)
+SYNC_PAGE_SIZE = 500
+SYNC_SETTLE_SECONDS = 2
+SYNC_TOMBSTONE_MAX_AGE = 60 * 60 * 24 * 30
+
+# Server-sent recipe events (core.events): change log polling interval,
+# events buffered per connection before the client is told to resync,
+# keep-alive interval and the reconnect delay advertised to clients
+SSE_POLL_INTERVAL = 1.0
+SSE_BUFFER_SIZE = 100
+SSE_KEEPALIVE_SECONDS = 15
+SSE_RETRY_MILLISECONDS = 5000
+
+# Recipe image derivatives (recipe.images): widths and formats clients may
+# request, formats in order of preference (JPEG is the fallback and must
+# stay), encoder quality, and the on-disk cache under MEDIA_ROOT, trimmed
+# least recently used first to LOW_WATER of its size once it outgrows it
+RECIPE_IMAGE_WIDTHS = (160, 320, 640, 1280)
+RECIPE_IMAGE_FORMATS = ('avif', 'webp', 'jpeg')
+RECIPE_IMAGE_QUALITY = 80
+RECIPE_IMAGE_CACHE_DIR = 'cache/recipe'
+RECIPE_IMAGE_CACHE_BYTES = 512 * 1024 * 1024
+RECIPE_IMAGE_CACHE_LOW_WATER = 0.9
+
+# Soft delete (core.models.SoftDeleteModel): how long deleted recipes, tags
+# and ingredients are kept, and the off-peak hours (server time, end hour
+# exclusive) in which purge_deleted removes them, in batches of this size
+SOFT_DELETE_RETENTION = 60 * 60 * 24
+SOFT_DELETE_PURGE_HOURS = (2, 5)
+SOFT_DELETE_BATCH_SIZE = 1000
+
+# Background jobs (core.jobs): attempts per job, base delay of the
+# exponential retry backoff, seconds after which a running job is assumed
+# lost with its worker, and worker polling interval
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 10
+JOB_TIMEOUT = 600
+JOB_POLL_INTERVAL = 1.0
+
+# API throttling (core.throttling): token buckets per user and scope, as
+# '<burst>/<period>' refilled evenly over the period. Views pick a scope
+# with `throttle_scope`, else 'read' or 'write' by method. Set
+# THROTTLE_STORE to core.throttling.LocalMemoryBucketStore or
+# DatabaseBucketStore to keep buckets elsewhere than the cache. The default
+# cache is process-local unless CACHES configures a shared backend, so
+# with several worker processes each applies the rates on its own
+# (`check --deploy` warns about it).
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_CLASSES': ('core.throttling.TokenBucketThrottle',),
+}
+THROTTLE_RATES = {
+    'read': '1200/min',
+    'write': '300/min',
+    'upload': '60/min',
+    'token': '30/min',
+}
+THROTTLE_STORE = 'core.throttling.CacheBucketStore'
+
+# Concurrent image uploads per user, and seconds after which the slot of
+# an upload that never finished is reclaimed
+UPLOAD_CONCURRENCY_LIMIT = 3
+UPLOAD_SLOT_TIMEOUT = 300
+
+# Rows per DELETE statement when purging a deleted account
+ACCOUNT_DELETE_BATCH_SIZE = 1000
+
+# Number of hash partitions of the recipe and recipe link tables, applied by
+# migration core 0011 on PostgreSQL 11 or later; older servers and 0 keep
+# plain tables.
+RECIPE_TABLE_PARTITIONS = int(os.environ.get('RECIPE_TABLE_PARTITIONS', 0))
+
+DATABASE_ROUTERS = [
+    'core.sharding.ShardRouter',
+    'core.db_routers.ReplicaRouter',
+]
+
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -122,6 +253,15 @@ USE_L10N = True
 USE_TZ = True
 
 
+# Response compression
+# Brotli is used when the optional `brotli` package is installed,
+# gzip otherwise.
+
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_QUALITY = 4
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.1/howto/static-files/
 
@@ -131,4 +271,18 @@ MEDIA_URL = '/medi/'
 STATIC_ROOT = '/vol/web/static'
 MEDIA_ROOT = '/vol/web/media'
 
+# Uploaded recipe images are never rewritten in place, so clients may cache
+# them for as long as they like.
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
 AUTH_USER_MODEL = 'core.User'
+
+# Admin changelists of tables larger than this use the planner's estimate
+# instead of an exact COUNT(*) (PostgreSQL only).
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Signed auth tokens are verified without a DB lookup of the token itself
+# and expire after AUTH_TOKEN_MAX_AGE seconds. Set AUTH_TOKEN_SIGNED=0 to
+# keep issuing legacy rest_framework.authtoken tokens.
+AUTH_TOKEN_SIGNED = os.environ.get('AUTH_TOKEN_SIGNED', '1') == '1'
+AUTH_TOKEN_MAX_AGE = int(os.environ.get('AUTH_TOKEN_MAX_AGE', 60 * 60 * 24 * 7))
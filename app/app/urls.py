@@ -18,8 +18,17 @@ from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
+from core.views import serve_media
+
+admin.autodiscover()
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
-    path('api/recipe/', include('recipe.urls'))
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path('api/recipe/', include('recipe.urls')),
+    path('api/jobs/', include('core.urls'))
+] + static(
+    settings.MEDIA_URL,
+    view=serve_media,
+    document_root=settings.MEDIA_ROOT
+)
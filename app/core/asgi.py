@@ -0,0 +1,256 @@
+import asyncio
+import contextvars
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.http.response import HttpResponseBase
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+
+from core.middleware import CompressionMiddleware
+
+
+_executor = None
+
+# Marks the threads of the pool returned by get_executor()
+_pool_thread = threading.local()
+
+
+def _init_pool_thread():
+    _pool_thread.active = True
+
+
+def get_executor():
+    """Return the thread pool that runs blocking ORM calls"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.ASGI_DB_THREADS,
+            thread_name_prefix='asgi-db',
+            initializer=_init_pool_thread
+        )
+    return _executor
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking (ORM) callable in the DB thread pool
+
+    Each pool thread keeps its own Django connection, so awaiting several
+    run_db() calls with asyncio.gather() runs their queries concurrently.
+    The call sees the context variables (e.g. DB routing) of the caller.
+    Like a WSGI request, a call on a pool thread first drops the thread's
+    connections that are broken or past CONN_MAX_AGE; a call run on any
+    other thread (e.g. by an inline executor in tests) leaves the
+    connections of that thread, and any transaction open on them, alone.
+    """
+    def call():
+        if getattr(_pool_thread, 'active', False):
+            close_old_connections()
+        return func(*args, **kwargs)
+
+    context = contextvars.copy_context()
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executor(), context.run, call)
+
+
+async def read_body(receive):
+    """Return the full request body of an ASGI http connection"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+def build_environ(scope, body):
+    """Return a WSGI environ equivalent to an ASGI http scope"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        value = value.decode('latin1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        if name in environ:
+            value = f'{environ[name]},{value}'
+        environ[name] = value
+    return environ
+
+
+def response_headers(response):
+    """Return the ASGI header list of a Django response"""
+    headers = [
+        (name.encode('latin1'), str(value).encode('latin1'))
+        for name, value in response.items()
+    ]
+    for cookie in response.cookies.values():
+        headers.append(
+            (b'Set-Cookie', cookie.output(header='').strip().encode()))
+    return headers
+
+
+class EventStreamResponse(HttpResponseBase):
+    """Response sending the chunks of an async iterator as they come
+
+    Only AsgiHandler can serve it; used for server-sent events.
+    """
+    streaming = True
+
+    def __init__(self, stream, **kwargs):
+        kwargs.setdefault('content_type', 'text/event-stream')
+        super().__init__(**kwargs)
+        self.stream = stream
+        self['Cache-Control'] = 'no-cache'
+        # Keep proxies such as nginx from buffering events
+        self['X-Accel-Buffering'] = 'no'
+
+
+class AsgiHandler:
+    """ASGI application serving selected views natively with asyncio
+
+    `async_views` maps URL names (as resolved from the path) to coroutines
+    taking a Django request and the URL kwargs, and returning a response.
+    Every other request is passed to the WSGI application in a worker
+    thread.
+    """
+    response_middleware = (CompressionMiddleware(),)
+
+    def __init__(self, wsgi_application, async_views):
+        self.wsgi_application = wsgi_application
+        self.async_views = async_views
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        body = await read_body(receive)
+        environ = build_environ(scope, body)
+        view = self.resolve_async_view(scope)
+        if view is None:
+            return await self.call_wsgi(environ, send)
+
+        view, kwargs = view
+        request = WSGIRequest(environ)
+        response = await view(request, **kwargs)
+        if isinstance(response, EventStreamResponse):
+            return await self.send_stream(response, receive, send)
+        for middleware in self.response_middleware:
+            response = middleware.process_response(request, response)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers(response),
+        })
+        await send({'type': 'http.response.body', 'body': response.content})
+
+    async def send_stream(self, response, receive, send):
+        """Send an EventStreamResponse until it ends or the client
+        disconnects"""
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers(response),
+        })
+
+        async def pump():
+            async for chunk in response.stream:
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                })
+
+        async def disconnected():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [
+            asyncio.ensure_future(pump()),
+            asyncio.ensure_future(disconnected()),
+        ]
+        try:
+            done, pending = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await response.stream.aclose()
+
+        if tasks[0] in done:
+            tasks[0].result()
+            await send({'type': 'http.response.body', 'body': b''})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def resolve_async_view(self, scope):
+        """Return (coroutine, kwargs) serving the request, or None"""
+        if scope['method'] != 'GET':
+            return None
+        try:
+            match = resolve(scope['path'])
+        except Resolver404:
+            return None
+        view = self.async_views.get(match.view_name)
+        return (view, match.kwargs) if view else None
+
+    async def call_wsgi(self, environ, send):
+        status, headers, body = await asyncio.get_event_loop().\
+            run_in_executor(get_executor(), self.run_wsgi, environ)
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (name.encode('latin1'), value.encode('latin1'))
+                for name, value in headers
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    def run_wsgi(self, environ):
+        """Call the WSGI application and return status, headers and body"""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+        return started['status'], started['headers'], body
@@ -0,0 +1,138 @@
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from core.models import ChangeLog
+
+
+# Kind of the entries telling clients their cursors may have skipped
+# changes; see changes_since
+RESYNC_KIND = 'resync'
+
+
+def record(user_id, model, object_ids, deleted=False, using=None,
+           apps=None):
+    """Append log entries for objects of model saved, relinked or deleted
+
+    Migrations pass the app registry of their historical models.
+    """
+    log = apps.get_model('core', 'ChangeLog') if apps else ChangeLog
+    recorded_at = timezone.now()
+    log.objects.using(using).bulk_create([
+        log(
+            user_id=user_id,
+            kind=model._meta.model_name,
+            object_id=pk,
+            deleted=deleted
+        )
+        for pk in object_ids
+    ])
+    if log is ChangeLog:
+        transaction.on_commit(
+            lambda: _check_settled(user_id, recorded_at, using), using=using)
+
+
+def _check_settled(user_id, recorded_at, using):
+    """Log a resync marker if entries committed after the settle window,
+    when cursors may already have moved past them"""
+    if timezone.now() - recorded_at > timedelta(
+            seconds=settings.SYNC_SETTLE_SECONDS):
+        ChangeLog.objects.using(using).create(
+            user_id=user_id, kind=RESYNC_KIND, object_id=0)
+
+
+def make_cursor(change_id, alias):
+    """Return the sync cursor for a position in the log on alias
+
+    Cursors also carry when they were issued; see read_cursor.
+    """
+    return f'{change_id}.{int(time.time())}.{alias}'
+
+
+def read_cursor(cursor, alias, user_id):
+    """Return the change id a user's cursor points to, or None if the
+    client must sync from scratch
+
+    That is when tombstones it never saw may have been compacted away,
+    the user has moved to another database since, or a resync marker was
+    logged after the cursor was issued. Raises ValueError for malformed
+    cursors.
+    """
+    change_id, issued, cursor_alias = cursor.split('.', 2)
+    change_id, issued = int(change_id), int(issued)
+    if cursor_alias != alias or \
+            issued < time.time() - settings.SYNC_TOMBSTONE_MAX_AGE:
+        return None
+    if ChangeLog.objects.using(alias).filter(
+            user_id=user_id,
+            kind=RESYNC_KIND,
+            created_at__gte=datetime.fromtimestamp(issued, timezone.utc)
+    ).exists():
+        return None
+    return change_id
+
+
+def changes_since(user_id, change_id, limit, using=None):
+    """Return (entries, more) for up to limit entries after change_id
+
+    Ids are allocated in insert order but transactions may commit out of
+    order, and a cursor moving past an entry that isn't visible yet would
+    skip it for good. Entries younger than SYNC_SETTLE_SECONDS are left for
+    a later sync, which is best effort: a transaction committing later
+    than that logs a resync marker, and read_cursor sends the clients
+    holding older cursors back to a full sync.
+    """
+    settled = timezone.now() - timedelta(
+        seconds=settings.SYNC_SETTLE_SECONDS)
+    entries = list(
+        ChangeLog.objects.using(using).
+        filter(user_id=user_id, id__gt=change_id).
+        order_by('id')[:limit + 1]
+    )
+    for index, entry in enumerate(entries):
+        if entry.created_at > settled:
+            return entries[:index], False
+    return entries[:limit], len(entries) > limit
+
+
+def compact(using=None, batch_size=10000):
+    """Delete superseded entries and tombstones older than
+    SYNC_TOMBSTONE_MAX_AGE, returning how many were deleted
+
+    Only the latest entry of an object matters to clients, so the log
+    shrinks to about one entry per live object. The table is scanned
+    batch_size ids at a time.
+    """
+    entries = ChangeLog.objects.using(using)
+    newer = entries.filter(
+        user_id=OuterRef('user_id'),
+        kind=OuterRef('kind'),
+        object_id=OuterRef('object_id'),
+        id__gt=OuterRef('id')
+    )
+    cutoff = timezone.now() - timedelta(
+        seconds=settings.SYNC_TOMBSTONE_MAX_AGE)
+
+    deleted, last = 0, 0
+    while True:
+        ids = list(
+            entries.filter(id__gt=last).
+            order_by('id').
+            values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        last = ids[-1]
+
+        obsolete = entries.\
+            filter(id__gte=ids[0], id__lte=last).\
+            annotate(superseded=Exists(newer)).\
+            filter(Q(superseded=True) |
+                   Q(deleted=True, created_at__lt=cutoff)).\
+            values_list('id', flat=True)
+        deleted += entries.filter(id__in=list(obsolete)).\
+            _raw_delete(entries.db)
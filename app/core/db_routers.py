@@ -0,0 +1,55 @@
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+PIN_COOKIE = 'replica_pin'
+
+_read_replica = ContextVar('read_replica', default=False)
+
+
+def set_read_replica(enabled):
+    """Send the reads of the current request to replicas (or not)"""
+    _read_replica.set(enabled)
+
+
+def choose_replica():
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+class ReplicaRouter:
+    """Route reads to DATABASE_REPLICAS while set_read_replica() is on
+
+    Everything else, including all writes, goes to the primary database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _read_replica.get() and settings.DATABASE_REPLICAS:
+            return choose_replica()
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+def is_pinned(request):
+    """Return whether the client wrote recently and must read the primary"""
+    return bool(request.COOKIES.get(PIN_COOKIE))
+
+
+def pin(request, response):
+    """Pin the client to the primary for REPLICA_PIN_SECONDS after a write
+
+    The pin is a cookie, so it holds whichever worker serves the next
+    request; clients that drop cookies may not see their writes at once.
+    """
+    response.set_cookie(
+        PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True)
@@ -0,0 +1,153 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import ChangeLog, Ingredient, Recipe, RecipeSimilarity, \
+    RecipeStats, Tag
+from core.sharding import data_databases
+
+
+def _raw_delete_in_chunks(queryset, batch_size):
+    """Delete the rows of a queryset with plain DELETEs of at most
+    batch_size rows, skipping the collector and signals"""
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += queryset.model._base_manager.using(queryset.db).\
+            filter(pk__in=pks)._raw_delete(queryset.db)
+
+
+def delete_unreferenced_images(names):
+    """Delete the stored images no recipe on any shard references"""
+    names = set(names)
+    for alias in data_databases():
+        names.difference_update(
+            Recipe.objects.using(alias).filter(image__in=names).
+            values_list('image', flat=True)
+        )
+    storage = Recipe._meta.get_field('image').storage
+    for name in names:
+        storage.delete(name)
+    return len(names)
+
+
+def _past(until):
+    return until is not None and timezone.now() >= until
+
+
+def _delete_recipes(recipes, batch_size, progress, until=None):
+    """Delete recipes a batch at a time with their links, neighbours and
+    unreferenced images; no batch is started after until"""
+    using = recipes.db
+    through_models = (
+        Recipe.tags.through, Recipe.ingredients.through)
+    while not _past(until):
+        chunk = list(recipes.values_list('pk', 'image')[:batch_size])
+        if not chunk:
+            return
+        pks = [pk for pk, _ in chunk]
+
+        with transaction.atomic(using=using):
+            for queryset in (
+                RecipeSimilarity.objects.filter(recipe__in=pks),
+                RecipeSimilarity.objects.filter(similar__in=pks),
+                *(model.objects.filter(recipe__in=pks)
+                  for model in through_models),
+            ):
+                _raw_delete_in_chunks(queryset.using(using), batch_size)
+            Recipe.all_objects.using(using).filter(pk__in=pks).\
+                _raw_delete(using)
+
+        images = delete_unreferenced_images(
+            image for _, image in chunk if image)
+        progress(recipes=len(pks), images=images)
+
+
+def _delete_attributes(queryset, batch_size, progress, until=None):
+    """Delete tags or ingredients a batch at a time with their recipe
+    links; no batch is started after until"""
+    using = queryset.db
+    column = queryset.model._meta.model_name
+    name = f'{column}s'
+    through = getattr(Recipe, name).through
+    while not _past(until):
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+
+        with transaction.atomic(using=using):
+            _raw_delete_in_chunks(
+                through.objects.using(using).filter(**{f'{column}__in': pks}),
+                batch_size
+            )
+            queryset.model.all_objects.using(using).filter(pk__in=pks).\
+                _raw_delete(using)
+        progress(**{name: len(pks)})
+
+
+def purge_user(user_id, batch_size=None, progress=None):
+    """Delete a user and everything they own on every database
+
+    Recipes go first, a batch at a time together with their links and
+    images, then tags, ingredients, rollups, the change log and finally
+    the user row on every database, so Django's collector never has to
+    load the account into memory. Safe to rerun after a failure.
+    progress(**counts) is called with the number of rows deleted as the
+    purge advances.
+    """
+    batch_size = batch_size or settings.ACCOUNT_DELETE_BATCH_SIZE
+    progress = progress or (lambda **counts: None)
+
+    for alias in data_databases():
+        _delete_recipes(
+            Recipe.all_objects.using(alias).filter(user_id=user_id),
+            batch_size,
+            progress
+        )
+        for model in (Tag, Ingredient):
+            _delete_attributes(
+                model.all_objects.using(alias).filter(user_id=user_id),
+                batch_size,
+                progress
+            )
+        RecipeStats.objects.using(alias).filter(user_id=user_id).\
+            _raw_delete(alias)
+        _raw_delete_in_chunks(
+            ChangeLog.objects.using(alias).filter(user_id=user_id),
+            batch_size)
+
+    # copy_user leaves copies of the user row on shards; the one on the
+    # default database goes last so a failed purge can be found and rerun
+    for alias in reversed(data_databases()):
+        get_user_model().objects.using(alias).filter(pk=user_id).delete()
+
+
+def purge_deleted(before, batch_size=None, until=None, progress=None):
+    """Delete for good the recipes, tags and ingredients soft-deleted
+    before a given time, on every database
+
+    Rows go a batch at a time together with their links, the way
+    purge_user deletes an account. No batch is started after until.
+    Returns whether every due row was deleted.
+    """
+    batch_size = batch_size or settings.SOFT_DELETE_BATCH_SIZE
+    progress = progress or (lambda **counts: None)
+
+    for alias in data_databases():
+        _delete_recipes(
+            Recipe.all_objects.using(alias).filter(deleted_at__lt=before),
+            batch_size,
+            progress,
+            until
+        )
+        for model in (Tag, Ingredient):
+            _delete_attributes(
+                model.all_objects.using(alias).filter(deleted_at__lt=before),
+                batch_size,
+                progress,
+                until
+            )
+    return not _past(until)
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.asgi import run_db
+from core.changelog import RESYNC_KIND, changes_since, make_cursor, \
+    read_cursor
+from core.models import ChangeLog
+from core.sharding import data_databases
+
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE = b': keepalive\n\n'
+# Tells clients to catch up through the sync endpoint
+RESYNC = b'event: resync\ndata: {}\n\n'
+
+
+def format_event(entry, alias):
+    """Return a change log entry as a server-sent event
+
+    Event ids are sync cursors, so a reconnecting client's Last-Event-ID
+    says where to resume, and clients can switch to the sync endpoint.
+    Resync markers become resync events.
+    """
+    if entry.kind == RESYNC_KIND:
+        return RESYNC
+    data = json.dumps({
+        'kind': entry.kind,
+        'id': entry.object_id,
+        'deleted': entry.deleted,
+    })
+    return (
+        f'id: {make_cursor(entry.id, alias)}\n'
+        f'event: change\n'
+        f'data: {data}\n\n'
+    ).encode()
+
+
+def settled():
+    """Return when entries logged before are taken as committed"""
+    return timezone.now() - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+
+
+def latest_settled_id(alias, user_id=None):
+    """Return the id of the newest settled change log entry on alias, of
+    one user or of anyone"""
+    entries = ChangeLog.objects.using(alias).filter(created_at__lte=settled())
+    if user_id is not None:
+        entries = entries.filter(user_id=user_id)
+    return entries.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def replay(user_id, alias, last_event_id=None):
+    """Return the events a client resuming from last_event_id missed
+
+    A new client gets a `ready` event carrying the current position, which
+    stays behind entries younger than SYNC_SETTLE_SECONDS as the sync
+    endpoint's cursors do. Clients that can't be caught up from the change
+    log are sent a resync event.
+    """
+    if not last_event_id:
+        latest = latest_settled_id(alias, user_id)
+        return [(
+            f'id: {make_cursor(latest, alias)}\n'
+            f'event: ready\n'
+            f'data: {{}}\n\n'
+        ).encode()]
+
+    try:
+        change_id = read_cursor(last_event_id, alias, user_id)
+    except ValueError:
+        change_id = None
+    if change_id is None:
+        return [RESYNC]
+
+    entries, more = changes_since(
+        user_id, change_id, settings.SSE_BUFFER_SIZE, alias)
+    events = [format_event(entry, alias) for entry in entries]
+    if more:
+        events.append(RESYNC)
+    return events
+
+
+class Subscription:
+    """Bounded buffer of the events of one connection
+
+    When the client falls SSE_BUFFER_SIZE events behind, the buffer is
+    replaced by a single resync event and the subscription ends.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=settings.SSE_BUFFER_SIZE)
+        self.closed = False
+
+    def put(self, event):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+            self.closed = True
+
+
+class ChangeFeed:
+    """Per-process fan-out of change log entries to SSE subscriptions
+
+    While anyone is subscribed, one task polls the change log of every
+    data database each SSE_POLL_INTERVAL seconds for new entries of the
+    subscribed users, however many connections there are. Entries younger
+    than SYNC_SETTLE_SECONDS wait, as for the sync endpoint.
+    """
+
+    def __init__(self):
+        self.subscriptions = defaultdict(set)
+        self.last_ids = {}
+        self.task = None
+
+    def _running(self):
+        return self.task is not None and not self.task.done() and \
+            self.task.get_loop() is asyncio.get_event_loop()
+
+    async def subscribe(self, user_id):
+        if not self._running():
+            self.last_ids = {}
+            await self.poll()
+            self.task = asyncio.ensure_future(self.run())
+
+        subscription = Subscription(user_id)
+        self.subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self.subscriptions[subscription.user_id]
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self.subscriptions[subscription.user_id]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(settings.SSE_POLL_INTERVAL)
+            if not self.subscriptions:
+                return
+            try:
+                await self.poll()
+            except Exception:
+                logger.exception('Polling the change log failed')
+
+    async def poll(self):
+        for alias in data_databases():
+            if alias not in self.last_ids:
+                self.last_ids[alias] = await run_db(self.latest_id, alias)
+                continue
+
+            entries = await run_db(
+                self.read, alias, self.last_ids[alias],
+                list(self.subscriptions))
+            for entry in entries:
+                self.last_ids[alias] = entry.id
+                event = format_event(entry, alias)
+                for subscription in self.subscriptions.get(
+                        entry.user_id, ()):
+                    subscription.put(event)
+
+    def latest_id(self, alias):
+        return latest_settled_id(alias)
+
+    def read(self, alias, after, user_ids):
+        if not user_ids:
+            return []
+        cutoff = settled()
+        entries = []
+        for entry in ChangeLog.objects.using(alias).\
+                filter(id__gt=after, user_id__in=user_ids).\
+                order_by('id')[:1000]:
+            if entry.created_at > cutoff:
+                break
+            entries.append(entry)
+        return entries
+
+
+feed = ChangeFeed()
+
+
+async def event_stream(user_id, alias, last_event_id=None):
+    """Yield the server-sent events of a user's changes until the client
+    disconnects or falls too far behind"""
+    subscription = await feed.subscribe(user_id)
+    try:
+        yield f'retry: {settings.SSE_RETRY_MILLISECONDS}\n\n'.encode()
+        for event in await run_db(replay, user_id, alias, last_event_id):
+            yield event
+
+        while not (subscription.closed and subscription.queue.empty()):
+            try:
+                yield await asyncio.wait_for(
+                    subscription.queue.get(), settings.SSE_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield KEEPALIVE
+    finally:
+        feed.unsubscribe(subscription)
@@ -0,0 +1,121 @@
+import json
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from core.models import Job
+from core.sharding import set_current_shard, shard_for_user, \
+    sharding_enabled
+
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler for failures that retrying won't fix"""
+
+
+def register(kind):
+    """Register the decorated function as the handler of a job kind
+
+    Handlers live in the `jobs` module of an app, take the Job and return
+    a JSON-serializable result.
+    """
+    def decorator(handler):
+        _handlers[kind] = handler
+        return handler
+    return decorator
+
+
+def get_handler(kind):
+    if kind not in _handlers:
+        autodiscover_modules('jobs')
+    return _handlers[kind]
+
+
+def enqueue(kind, payload=None, user=None, delay=0, max_attempts=None):
+    """Queue a job; it becomes visible to workers when the current
+    transaction commits"""
+    return Job.objects.create(
+        kind=kind,
+        user=user,
+        payload_json=json.dumps(payload or {}),
+        run_after=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS
+    )
+
+
+def claim(worker):
+    """Lock and return the next due job, or None
+
+    Concurrent workers skip rows locked by each other instead of waiting.
+    """
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).\
+            filter(status=Job.QUEUED, run_after__lte=timezone.now()).\
+            order_by('run_after', 'id').\
+            first()
+        if job is None:
+            return None
+
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.locked_at = timezone.now()
+        job.locked_by = worker
+        job.save(update_fields=[
+            'status', 'attempts', 'locked_at', 'locked_by', 'updated_at'])
+    return job
+
+
+def set_result(job, **result):
+    """Store (partial) results of a running job, e.g. its progress"""
+    job.result_json = json.dumps(dict(job.result, **result))
+    job.save(update_fields=['result_json', 'updated_at'])
+
+
+def run(job):
+    """Run a claimed job, then record its outcome or schedule a retry
+
+    Retries back off exponentially from JOB_RETRY_DELAY seconds.
+    """
+    if job.user_id and sharding_enabled():
+        set_current_shard(shard_for_user(job.user_id))
+    try:
+        result = get_handler(job.kind)(job)
+    except Exception as exc:
+        logger.exception('Job %s failed', job)
+        job.error = traceback.format_exc()
+        job.locked_at = None
+        if isinstance(exc, PermanentJobError) or \
+                job.attempts >= job.max_attempts:
+            job.status = Job.FAILED
+        else:
+            job.status = Job.QUEUED
+            job.run_after = timezone.now() + timedelta(
+                seconds=settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1))
+    else:
+        if result is not None:
+            job.result_json = json.dumps(dict(job.result, **result))
+        job.status = Job.SUCCEEDED
+        job.error = ''
+    finally:
+        set_current_shard(None)
+
+    job.save()
+    return job
+
+
+def requeue_stale():
+    """Requeue running jobs whose worker died, i.e. locked for longer
+    than JOB_TIMEOUT seconds"""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT)
+    return Job.objects.\
+        filter(status=Job.RUNNING, locked_at__lt=cutoff).\
+        update(status=Job.QUEUED, locked_at=None, locked_by='')
@@ -0,0 +1,82 @@
+import random
+import time
+import zlib
+
+from django.core.management.base import BaseCommand
+
+from rest_framework.renderers import JSONRenderer
+
+from core.middleware import get_brotli
+
+
+WORDS = (
+    'chicken', 'rice', 'saffron', 'lemon', 'garlic', 'stew', 'grilled',
+    'roasted', 'spicy', 'sweet', 'cake', 'soup', 'salad', 'with', 'and',
+)
+
+
+def sample_recipe_list(count, seed=0):
+    """Return a recipe list payload shaped like RecipeSerializer output"""
+    rnd = random.Random(seed)
+    return [
+        {
+            'id': recipe_id,
+            'title': ' '.join(rnd.choice(WORDS) for _ in range(4)),
+            'tags': rnd.sample(range(1, 200), rnd.randint(0, 5)),
+            'ingredients': rnd.sample(range(1, 500), rnd.randint(2, 12)),
+            'time_minutes': rnd.randint(5, 180),
+            'price': f'{rnd.uniform(1, 100):.2f}',
+            'link': f'https://example.com/recipes/{recipe_id}',
+        }
+        for recipe_id in range(1, count + 1)
+    ]
+
+
+class Command(BaseCommand):
+    """Django command: measure CPU cost against bytes saved when
+    compressing typical recipe list payloads"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='10,100,1000',
+            help='Comma separated numbers of recipes per payload',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Compressions per measurement',
+        )
+
+    def handle(self, *args, **options):
+        codecs = [
+            (f'gzip-{level}', lambda data, level=level: zlib.compress(
+                data, level))
+            for level in (1, 6, 9)
+        ]
+        brotli = get_brotli()
+        if brotli is not None:
+            codecs += [
+                (f'br-{quality}', lambda data, quality=quality:
+                    brotli.compress(data, quality=quality))
+                for quality in (1, 4, 11)
+            ]
+        else:
+            self.stderr.write('brotli is not installed, skipping it')
+
+        self.stdout.write(
+            f'{"recipes":>8} {"codec":>8} {"bytes":>10} {"saved":>7} '
+            f'{"ms/op":>8} {"MB/s":>8}'
+        )
+        for size in map(int, options['sizes'].split(',')):
+            payload = JSONRenderer().render(sample_recipe_list(size))
+            for name, compress in codecs:
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    compressed = compress(payload)
+                elapsed = (time.perf_counter() - start) / options['repeat']
+
+                self.stdout.write(
+                    f'{size:>8} {name:>8} {len(compressed):>10} '
+                    f'{1 - len(compressed) / len(payload):>7.1%} '
+                    f'{elapsed * 1000:>8.3f} '
+                    f'{len(payload) / elapsed / 1e6:>8.1f}'
+                )
@@ -0,0 +1,166 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from core.models import Ingredient, Recipe, Tag
+from core.partitioning import PARTITIONED_TABLES, is_partitioned
+
+
+EMAIL_PREFIX = 'partition-benchmark-'
+
+
+class Command(BaseCommand):
+    """Django command: time per-user recipe list and filter queries, to
+    compare plain and hash-partitioned recipe tables
+
+    Seed and measure, migrate back to core 0010, migrate forward with
+    RECIPE_TABLE_PARTITIONS set and measure again with --skip-seed. The
+    defaults seed 50M link rows; PostgreSQL only.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--recipes', type=int, default=500,
+                            help='Recipes per user')
+        parser.add_argument('--vocabulary', type=int, default=20,
+                            help='Tags and ingredients per user')
+        parser.add_argument('--relations', type=int, default=5,
+                            help='Tags and ingredients per recipe')
+        parser.add_argument('--samples', type=int, default=200,
+                            help='Users queried per measurement')
+        parser.add_argument('--skip-seed', action='store_true')
+        parser.add_argument('--cleanup', action='store_true',
+                            help='Delete the seeded data and exit')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('This benchmark needs PostgreSQL')
+
+        users = get_user_model().objects.filter(
+            email__startswith=EMAIL_PREFIX)
+        if options['cleanup']:
+            return self.cleanup(users)
+        if not options['skip_seed']:
+            self.seed(options)
+
+        for table, key in PARTITIONED_TABLES:
+            state = 'partitioned' if is_partitioned(connection, table) \
+                else 'plain'
+            self.stdout.write(f'{table}: {state}')
+
+        user_ids = list(users.values_list('id', flat=True))
+        if not user_ids:
+            raise CommandError('No seeded users, run without --skip-seed')
+        sample = random.sample(user_ids, min(options['samples'],
+                                             len(user_ids)))
+        for name, query in self.queries():
+            self.report(name, [self.measure(query, user_id)
+                               for user_id in sample])
+
+    @transaction.atomic
+    def seed(self, options):
+        """Create users with recipes linked to tags and ingredients"""
+        User = get_user_model()
+        start = time.perf_counter()
+        User.objects.bulk_create(
+            [
+                User(email=f'{EMAIL_PREFIX}{i}@example.com', password='!')
+                for i in range(options['users'])
+            ],
+            batch_size=1000
+        )
+        step = max(options['vocabulary'] // options['relations'], 1)
+        params = {
+            'prefix': f'{EMAIL_PREFIX}%',
+            'vocabulary': options['vocabulary'],
+            'recipes': options['recipes'],
+            'step': step,
+        }
+        with connection.cursor() as cursor:
+            for model in (Tag, Ingredient):
+                cursor.execute(
+                    f'INSERT INTO {model._meta.db_table} '
+                    '(user_id, name, updated_at) '
+                    "SELECT u.id, 'name ' || g, now() FROM core_user u "
+                    'CROSS JOIN generate_series(1, %(vocabulary)s) g '
+                    'WHERE u.email LIKE %(prefix)s',
+                    params
+                )
+            cursor.execute(
+                'INSERT INTO core_recipe (user_id, title, time_minutes, '
+                "price, link, updated_at) SELECT u.id, 'recipe ' || g, "
+                "g %% 120, g %% 50, '', now() FROM core_user u "
+                'CROSS JOIN generate_series(1, %(recipes)s) g '
+                'WHERE u.email LIKE %(prefix)s',
+                params
+            )
+            for field in Recipe._meta.many_to_many:
+                related = field.related_model._meta.db_table
+                cursor.execute(
+                    f'INSERT INTO {field.remote_field.through._meta.db_table}'
+                    f' (recipe_id, {field.m2m_reverse_name()}) '
+                    'SELECT r.id, t.id FROM core_recipe r '
+                    f'JOIN {related} t ON t.user_id = r.user_id '
+                    'JOIN core_user u ON u.id = r.user_id '
+                    'WHERE u.email LIKE %(prefix)s '
+                    'AND (r.id + t.id) %% %(step)s = 0',
+                    params
+                )
+            for table, key in PARTITIONED_TABLES:
+                cursor.execute(f'ANALYZE {table}')
+
+        self.stdout.write(f'Seeded in {time.perf_counter() - start:.0f}s')
+
+    def queries(self):
+        """Return (name, callable(user_id)) pairs mirroring the API"""
+        def recipes(user_id):
+            return Recipe.objects.filter(user_id=user_id).order_by('-id')
+
+        def first_tag(user_id):
+            return Tag.objects.filter(user_id=user_id).values('id')[:1]
+
+        def first_ingredient(user_id):
+            return Ingredient.objects.filter(user_id=user_id).\
+                values('id')[:1]
+
+        return (
+            ('list', lambda user_id: list(
+                recipes(user_id).prefetch_related('tags', 'ingredients'))),
+            ('filter by tag', lambda user_id: list(
+                recipes(user_id).filter(tags__in=first_tag(user_id)).
+                distinct())),
+            ('filter by ingredient', lambda user_id: list(
+                recipes(user_id).filter(
+                    ingredients__in=first_ingredient(user_id)).distinct())),
+        )
+
+    def measure(self, query, user_id):
+        start = time.perf_counter()
+        query(user_id)
+        return time.perf_counter() - start
+
+    def report(self, name, latencies):
+        latencies.sort()
+        p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)]
+        self.stdout.write(
+            f'{name:>20}: p50 {statistics.median(latencies) * 1000:8.2f} ms'
+            f'  p99 {p99 * 1000:8.2f} ms'
+        )
+
+    def cleanup(self, users):
+        """Delete the seeded rows with raw deletes, links first"""
+        user_ids = users.values('id')
+        recipe_ids = Recipe.objects.filter(user__in=user_ids).values('id')
+        for field in Recipe._meta.many_to_many:
+            through = field.remote_field.through
+            through.objects.filter(recipe__in=recipe_ids).\
+                _raw_delete(connection.alias)
+        for model in (Recipe, Tag, Ingredient):
+            model.objects.filter(user__in=user_ids).\
+                _raw_delete(connection.alias)
+        users.delete()
+        self.stdout.write(self.style.SUCCESS('Deleted the benchmark data'))
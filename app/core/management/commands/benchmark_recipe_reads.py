@@ -0,0 +1,134 @@
+import asyncio
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.urls import reverse
+
+from core.asgi import AsgiHandler, build_environ
+from core.models import Ingredient, Recipe, Tag
+from recipe.asgi import async_views
+from user.authentication import create_signed_token
+
+
+class Command(BaseCommand):
+    """Django command: compare recipe read latency and throughput of the
+    WSGI path and the async ASGI path under concurrent load
+
+    Data is committed to the configured database for the duration of the
+    run (a throwaway user is created and deleted), so point it at a
+    disposable database.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=50)
+        parser.add_argument('--relations', type=int, default=5,
+                            help='Tags and ingredients per recipe')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--wsgi-threads', type=int, default=16,
+                            help='Worker threads of the WSGI run')
+
+    def handle(self, *args, **options):
+        user = self.seed(options['recipes'], options['relations'])
+        try:
+            token = create_signed_token(user)
+            recipe_ids = list(Recipe.objects.filter(user=user).
+                              values_list('id', flat=True))
+            paths = [
+                reverse('recipe:recipe-detail', args=[recipe_ids[
+                    i % len(recipe_ids)]])
+                for i in range(options['requests'])
+            ]
+            scopes = [self.scope(path, token) for path in paths]
+            self.report('wsgi', self.run_wsgi(scopes, options))
+            self.report('asgi', self.run_asgi(scopes, options))
+        finally:
+            user.delete()
+
+    def seed(self, recipes, relations):
+        """Create a throwaway user with recipes, tags and ingredients"""
+        user = get_user_model().objects.create_user(
+            f'benchmark-{uuid.uuid4().hex}@example.com', uuid.uuid4().hex)
+        tags = [
+            Tag.objects.create(user=user, name=f'tag {i}')
+            for i in range(relations)
+        ]
+        ingredients = [
+            Ingredient.objects.create(user=user, name=f'ingredient {i}')
+            for i in range(relations)
+        ]
+        for i in range(recipes):
+            recipe = Recipe.objects.create(
+                user=user, title=f'recipe {i}', time_minutes=10, price=5)
+            recipe.tags.set(tags)
+            recipe.ingredients.set(ingredients)
+        return user
+
+    def scope(self, path, token):
+        return {
+            'type': 'http',
+            'method': 'GET',
+            'path': path,
+            'query_string': b'',
+            'headers': [
+                (b'host', b'localhost'),
+                (b'authorization', f'Token {token}'.encode()),
+            ],
+        }
+
+    def run_wsgi(self, scopes, options):
+        """Serve requests with a fixed pool of sync worker threads"""
+        handler = AsgiHandler(get_wsgi_application(), {})
+
+        def call(scope):
+            start = time.perf_counter()
+            status = handler.run_wsgi(build_environ(scope, b''))[0]
+            return status, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['wsgi_threads']) as executor:
+            results = list(executor.map(call, scopes))
+        return results, time.perf_counter() - start
+
+    def run_asgi(self, scopes, options):
+        """Serve requests through the ASGI application"""
+        handler = AsgiHandler(get_wsgi_application(), async_views)
+
+        async def call(scope, semaphore):
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b''}
+
+            async def send(message):
+                messages.append(message)
+
+            async with semaphore:
+                start = time.perf_counter()
+                await handler(scope, receive, send)
+                return messages[0]['status'], time.perf_counter() - start
+
+        async def run_all():
+            semaphore = asyncio.Semaphore(options['concurrency'])
+            return await asyncio.gather(
+                *(call(scope, semaphore) for scope in scopes))
+
+        start = time.perf_counter()
+        results = asyncio.run(run_all())
+        return results, time.perf_counter() - start
+
+    def report(self, name, outcome):
+        results, elapsed = outcome
+        errors = sum(1 for status, _ in results if status != 200)
+        latencies = sorted(latency for _, latency in results)
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        self.stdout.write(
+            f'{name}: {len(results) / elapsed:8.1f} req/s  '
+            f'p50 {statistics.median(latencies) * 1000:7.2f} ms  '
+            f'p99 {p99 * 1000:7.2f} ms  errors {errors}'
+        )
@@ -0,0 +1,351 @@
+import json
+import re
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test.utils import override_settings
+from django.urls import URLResolver, get_resolver, resolve, reverse
+
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core.models import Ingredient, Job, Recipe, Tag
+from core.sharding import data_databases
+from core.similarity import rebuild_user
+
+
+# URL namespaces whose GET endpoints are checked
+NAMESPACES = ('recipe', 'core', 'user')
+
+# Query parameters endpoints are run with besides none at all; {tags},
+# {ingredients} and {recipes} stand for ids of seeded rows
+VARIANTS = {
+    'recipe:recipe-list': [
+        {'fields': 'id,title'},
+        {'expand': 'tags,ingredients'},
+        {'tags': '{tags}'},
+        {'ingredients': '{ingredients}'},
+        {'ids': '{recipes}'},
+    ],
+    'recipe:recipe-pantry': [{'ingredients': '{ingredients}'}],
+    'recipe:tag-list': [{'assigned_only': '1'}],
+    'recipe:ingredient-list': [{'assigned_only': '1'}],
+}
+# Endpoints that are meaningless without parameters
+PARAMETERS_REQUIRED = {'recipe:recipe-pantry'}
+
+re_placeholders = re.compile(r'%s(?:, %s)+')
+re_join = re.compile(r'\bJOIN\s+"?(\w+)"?')
+re_sqlite_scan = re.compile(r'SCAN (?:TABLE )?(\w+)(.*)')
+
+
+def query_shape(sql):
+    """Return sql with IN lists collapsed, so one statement run for
+    different rows has one shape"""
+    return re_placeholders.sub('%s, ...', sql)
+
+
+def duplicate_joins(sql):
+    """Return the tables a statement joins more than once"""
+    joins = Counter(re_join.findall(sql))
+    return sorted(table for table, count in joins.items() if count > 1)
+
+
+def walk_plan(node):
+    yield node
+    for child in node.get('Plans', ()):
+        yield from walk_plan(child)
+
+
+def postgresql_plan(plan):
+    """Return (plan lines, flags) of an EXPLAIN (FORMAT JSON) plan"""
+    lines, flags = [], []
+    for node in walk_plan(plan):
+        line = node['Node Type']
+        if 'Relation Name' in node:
+            line += f' on {node["Relation Name"]}'
+        if 'Index Name' in node:
+            line += f' using {node["Index Name"]}'
+        lines.append(line)
+        if node['Node Type'] == 'Seq Scan':
+            flags.append(f'seq_scan {node["Relation Name"]}')
+        if node.get('Sort Space Type') == 'Disk':
+            flags.append('sort_spill')
+    return lines, flags
+
+
+def sqlite_plan(details):
+    """Return (plan lines, flags) of EXPLAIN QUERY PLAN details"""
+    flags = []
+    for detail in details:
+        match = re_sqlite_scan.match(detail)
+        if match and match.group(1) not in ('CONSTANT', 'SUBQUERY') and \
+                'USING' not in match.group(2):
+            flags.append(f'seq_scan {match.group(1)}')
+        if detail.startswith('USE TEMP B-TREE'):
+            flags.append('temp_sort')
+    return list(details), flags
+
+
+def explain(connection, sql, params):
+    """Return (plan lines, flags) of a SELECT, or None on other databases
+
+    On PostgreSQL the statement runs under EXPLAIN ANALYZE with
+    sequential scans disabled, so a remaining one means no index fits,
+    however little data was seeded.
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            savepoint = transaction.savepoint(using=connection.alias)
+            try:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(
+                    f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}', params)
+                result = cursor.fetchone()[0]
+            finally:
+                transaction.savepoint_rollback(
+                    savepoint, using=connection.alias)
+            if isinstance(result, str):
+                result = json.loads(result)
+            return postgresql_plan(result[0]['Plan'])
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return sqlite_plan([row[-1] for row in cursor.fetchall()])
+    return None
+
+
+def duplicate_rows(data):
+    """Return whether a response lists an object twice"""
+    if isinstance(data, list):
+        lists = [data]
+    elif isinstance(data, dict):
+        lists = [value for value in data.values() if isinstance(value, list)]
+    else:
+        lists = []
+    for rows in lists:
+        ids = [row['id'] for row in rows
+               if isinstance(row, dict) and 'id' in row]
+        if len(ids) != len(set(ids)):
+            return True
+    return False
+
+
+def endpoints(resolver=None, namespace=None):
+    """Yield (url name, pattern) of the named GET endpoints of NAMESPACES"""
+    resolver = resolver or get_resolver()
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            yield from endpoints(pattern, pattern.namespace or namespace)
+            continue
+        if namespace not in NAMESPACES or \
+                pattern.name in (None, 'api-root'):
+            continue
+
+        callback = pattern.callback
+        actions = getattr(callback, 'actions', None)
+        if actions is not None:
+            readable = 'get' in actions
+        else:
+            readable = hasattr(getattr(callback, 'cls', None), 'get')
+        if readable:
+            yield f'{namespace}:{pattern.name}', pattern
+
+
+class Recorder:
+    """Database execute wrapper keeping the statements run"""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().split(None, 1)[0].upper() in (
+                'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+            self.statements.append((self.alias, sql, params))
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    """Django command: run the GET endpoints of the API against seeded
+    data, EXPLAIN the SQL they issue and write a JSON report of sequential
+    scans, sorts that spill or aren't served by an index, tables joined
+    twice, responses listing an object twice and statements run once per
+    row
+
+    The report has no timings and is ordered, so reports of two revisions
+    can be diffed. Seeded rows are rolled back; still, point it at a local
+    database, ideally PostgreSQL.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=20)
+        parser.add_argument('--relations', type=int, default=3,
+                            help='Tags and ingredients per recipe')
+        parser.add_argument('--repeat-threshold', type=int, default=3,
+                            help='Runs of one statement per request that '
+                                 'count as a per-row query')
+        parser.add_argument('--output', help='Write the report here')
+        parser.add_argument('--strict', action='store_true',
+                            help='Fail when anything is flagged')
+
+    def handle(self, *args, **options):
+        aliases = data_databases()
+        with ExitStack() as stack:
+            for alias in aliases:
+                stack.enter_context(transaction.atomic(using=alias))
+            # Seeded rows are uncommitted, so everything reads the primary
+            stack.enter_context(override_settings(
+                DATABASE_REPLICAS=[], ALLOWED_HOSTS=['testserver']))
+
+            user, seeded = self.seed(options['recipes'], options['relations'])
+            report = {
+                'vendor': connections[aliases[0]].vendor,
+                'endpoints': self.check_endpoints(
+                    user, seeded, aliases, options),
+            }
+            for alias in aliases:
+                transaction.set_rollback(True, using=alias)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        flagged = [
+            endpoint['name'] for endpoint in report['endpoints']
+            if endpoint['flags']
+        ]
+        if flagged and options['strict']:
+            raise CommandError(
+                f'Flagged endpoints: {", ".join(sorted(set(flagged)))}')
+
+    def seed(self, recipes, relations):
+        """Create a user with recipes, tags, ingredients and a job, and
+        return (user, {placeholder or model: ids})"""
+        user = get_user_model().objects.create_user(
+            f'check-queries-{uuid.uuid4().hex}@example.com',
+            uuid.uuid4().hex)
+        tags = [
+            Tag.objects.create(user=user, name=f'tag {i}')
+            for i in range(relations * 2)
+        ]
+        ingredients = [
+            Ingredient.objects.create(user=user, name=f'ingredient {i}')
+            for i in range(relations * 2)
+        ]
+        recipe_ids = []
+        for i in range(recipes):
+            recipe = Recipe.objects.create(
+                user=user, title=f'recipe {i}', time_minutes=10, price=5)
+            recipe.tags.set(tags[i % 2::2][:relations])
+            recipe.ingredients.set(ingredients[i % 2::2][:relations])
+            recipe_ids.append(recipe.pk)
+        rebuild_user(user.pk)
+        job = Job.objects.create(kind='check_queries', user=user)
+
+        return user, {
+            'tags': [tag.pk for tag in tags],
+            'ingredients': [ingredient.pk for ingredient in ingredients],
+            'recipes': recipe_ids,
+            Tag: tags[0].pk,
+            Ingredient: ingredients[0].pk,
+            Recipe: recipe_ids[0],
+            Job: job.pk,
+        }
+
+    def check_endpoints(self, user, seeded, aliases, options):
+        placeholders = {
+            name: ','.join(map(str, seeded[name]))
+            for name in ('tags', 'ingredients', 'recipes')
+        }
+        factory = APIRequestFactory()
+        results = []
+        seen = set()
+        for name, pattern in endpoints():
+            if name in seen:
+                # The format suffix variant of a router route
+                continue
+            seen.add(name)
+
+            kwargs = {}
+            if 'pk' in pattern.pattern.regex.groupindex:
+                model = pattern.callback.cls.queryset.model
+                kwargs['pk'] = seeded[model]
+            path = reverse(name, kwargs=kwargs)
+
+            variants = VARIANTS.get(name, [])
+            if name not in PARAMETERS_REQUIRED:
+                variants = [{}] + variants
+            for variant in variants:
+                params = {
+                    key: value.format(**placeholders)
+                    for key, value in variant.items()
+                }
+                request = factory.get(path, params)
+                force_authenticate(request, user=user)
+                result = self.run(request, path, aliases, options)
+                result.update(name=name, params=variant)
+                results.append(result)
+
+        return sorted(
+            results,
+            key=lambda result: (
+                result['name'], json.dumps(result['params'], sort_keys=True))
+        )
+
+    def run(self, request, path, aliases, options):
+        """Serve a request and return its statements, plans and flags"""
+        recorders = [Recorder(alias) for alias in aliases]
+        with ExitStack() as stack:
+            for recorder in recorders:
+                stack.enter_context(
+                    connections[recorder.alias].execute_wrapper(recorder))
+            match = resolve(path)
+            response = match.func(request, *match.args, **match.kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+
+        shapes = Counter()
+        examples = {}
+        for recorder in recorders:
+            for alias, sql, params in recorder.statements:
+                key = (alias, query_shape(sql))
+                shapes[key] += 1
+                examples.setdefault(key, (sql, params))
+
+        statements, flags = [], set()
+        for (alias, shape), count in sorted(shapes.items()):
+            sql, params = examples[alias, shape]
+            statement = {
+                'database': alias,
+                'sql': shape,
+                'count': count,
+                'flags': [
+                    f'duplicate_join {table}'
+                    for table in duplicate_joins(sql)
+                ],
+            }
+            if count >= options['repeat_threshold']:
+                statement['flags'].append('per_row_query')
+            if sql.lstrip().upper().startswith('SELECT'):
+                explained = explain(connections[alias], sql, params)
+                if explained is not None:
+                    statement['plan'], plan_flags = explained
+                    statement['flags'].extend(plan_flags)
+            statement['flags'] = sorted(set(statement['flags']))
+            flags.update(statement['flags'])
+            statements.append(statement)
+
+        if duplicate_rows(getattr(response, 'data', None)):
+            flags.add('duplicate_rows')
+        return {
+            'status': response.status_code,
+            'queries': sum(shapes.values()),
+            'statements': statements,
+            'flags': sorted(flags),
+        }
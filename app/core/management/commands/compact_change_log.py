@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.changelog import compact
+from core.sharding import data_databases
+
+
+class Command(BaseCommand):
+    """Django command: drop superseded change log entries and expired
+    tombstones, so syncs cost what changed rather than what exists"""
+
+    def handle(self, *args, **options):
+        for alias in data_databases():
+            deleted = compact(using=alias)
+            self.stdout.write(f'{alias}: deleted {deleted} log entries')
@@ -0,0 +1,110 @@
+import os
+
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe, recipe_image_digest_path
+from core.sharding import data_databases
+from core.signals import delete_unreferenced_image
+from core.storage import file_digest
+
+
+IMAGE_DIRECTORY = 'uploads/recipe'
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """Django command: move recipe images to content-addressed names and
+    delete image files no recipe references"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would change without touching anything',
+        )
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.storage = Recipe._meta.get_field('image').storage
+
+        renamed = self.rename_images()
+        deleted, freed = self.delete_orphans()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Renamed {renamed} images, deleted {deleted} orphaned files '
+            f'({freed} bytes)'
+        ))
+
+    def rename_images(self):
+        """Point recipes at content-addressed copies of their images"""
+        renamed = 0
+        for alias in data_databases():
+            renamed += self.rename_images_on(alias)
+        return renamed
+
+    def rename_images_on(self, alias):
+        recipes = Recipe.objects.using(alias)
+        names = recipes.exclude(image__isnull=True).exclude(image='').\
+            values_list('image', flat=True).distinct().iterator()
+        renamed = 0
+        for name in names:
+            if not self.storage.exists(name):
+                self.stderr.write(f'Missing image file: {name}')
+                continue
+
+            with self.storage.open(name) as f:
+                digest = file_digest(File(f))
+            target = recipe_image_digest_path(digest, name.split('.')[-1])
+            if target == name:
+                continue
+
+            renamed += 1
+            if self.dry_run:
+                continue
+            if not self.storage.exists(target):
+                with self.storage.open(name) as f:
+                    target = self.storage.save(target, File(f))
+            recipes.filter(image=name).update(image=target)
+
+        return renamed
+
+    def delete_orphans(self):
+        """Delete image files that are not referenced by any recipe"""
+        deleted = freed = 0
+        for batch in self.stored_names():
+            referenced = set()
+            for alias in data_databases():
+                referenced.update(
+                    Recipe.objects.using(alias).filter(image__in=batch).
+                    values_list('image', flat=True))
+            for name in batch:
+                if name in referenced:
+                    continue
+                size = self.storage.size(name)
+                # Checked again under the image's lock, as a recipe may
+                # have taken the file on since
+                if not self.dry_run and not delete_unreferenced_image(name):
+                    continue
+                deleted += 1
+                freed += size
+
+        return deleted, freed
+
+    def stored_names(self):
+        """Yield batches of image file names found in the storage"""
+        batch = []
+        pending = [IMAGE_DIRECTORY]
+        while pending:
+            directory = pending.pop()
+            if not self.storage.exists(directory):
+                continue
+            directories, files = self.storage.listdir(directory)
+            pending.extend(os.path.join(directory, d) for d in directories)
+            for file_name in files:
+                batch.append(os.path.join(directory, file_name))
+                if len(batch) >= BATCH_SIZE:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
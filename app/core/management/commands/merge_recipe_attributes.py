@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Ingredient, Tag
+from core.normalization import merge_all_duplicates
+from core.sharding import data_databases
+from core.stats import rebuild_usage
+
+
+class Command(BaseCommand):
+    """Django command: merge tags and ingredients whose names normalize to
+    the same key, e.g. after normalize_name() changed
+
+    Recipe links are rewritten in bulk, bypassing m2m_changed signals, so
+    the recipe counts of merged rows are recomputed afterwards.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Users processed per batch')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        for model in (Tag, Ingredient):
+            merged = 0
+            for alias in data_databases():
+                count = merge_all_duplicates(
+                    model,
+                    using=alias,
+                    batch_size=options['batch_size'],
+                    dry_run=options['dry_run']
+                )
+                if count and not options['dry_run']:
+                    rebuild_usage(model, using=alias)
+                merged += count
+            self.stdout.write(
+                f'{model._meta.verbose_name_plural}: {merged} duplicates '
+                f'{"found" if options["dry_run"] else "merged"}'
+            )
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core.sharding import move_user, reserve_id_ranges, shard_for_user
+
+
+class Command(BaseCommand):
+    """Django command: move a user's data to another shard while the API
+    stays available (writes of that user get 503 during the move)"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_id', type=int, nargs='?')
+        parser.add_argument('target', nargs='?',
+                            help='Alias of the destination shard')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--settle', type=float, default=None,
+            help='Seconds to wait for workers to see directory changes '
+                 '(defaults to SHARD_DIRECTORY_CACHE_SECONDS)',
+        )
+        parser.add_argument(
+            '--reserve-id-ranges', action='store_true',
+            help='Give each shard a disjoint id range and exit',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.SHARD_DATABASES:
+            raise CommandError('Sharding is disabled (no SHARD_DATABASES)')
+        if options['reserve_id_ranges']:
+            return reserve_id_ranges(log=self.stdout.write)
+
+        user_id, target = options['user_id'], options['target']
+        if user_id is None or target is None:
+            raise CommandError('user_id and target are required')
+        if target not in settings.SHARD_DATABASES:
+            raise CommandError(f'Unknown shard: {target}')
+        if not get_user_model().objects.filter(pk=user_id).exists():
+            raise CommandError(f'Unknown user: {user_id}')
+
+        source = shard_for_user(user_id)
+        move_user(
+            user_id,
+            target,
+            batch_size=options['batch_size'],
+            settle=options['settle'],
+            log=self.stdout.write
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved user {user_id} from {source} to {target}'))
@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.deletion import purge_deleted
+
+
+def purge_window_end(now):
+    """Return when the SOFT_DELETE_PURGE_HOURS window now falls in ends,
+    or None outside of it"""
+    start, end = settings.SOFT_DELETE_PURGE_HOURS
+    if start <= end:
+        inside = start <= now.hour < end
+    else:
+        inside = now.hour >= start or now.hour < end
+    if not inside:
+        return None
+
+    until = now.replace(hour=end, minute=0, second=0, microsecond=0)
+    if until <= now:
+        until += timedelta(days=1)
+    return until
+
+
+class Command(BaseCommand):
+    """Django command: delete soft-deleted recipes, tags and ingredients
+    for good, in batches, during the off-peak purge window
+
+    Meant to be run every hour; outside the window it does nothing, and
+    it stops starting batches once the window ends.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--now',
+            action='store_true',
+            help='Run regardless of the purge window, to completion',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Rows deleted per transaction',
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.localtime()
+        until = None
+        if not options['now']:
+            until = purge_window_end(now)
+            if until is None:
+                self.stdout.write('Outside the purge window, nothing to do')
+                return
+
+        deleted = dict.fromkeys(('recipes', 'tags', 'ingredients'), 0)
+
+        def progress(**counts):
+            for name, count in counts.items():
+                if name in deleted:
+                    deleted[name] += count
+
+        finished = purge_deleted(
+            now - timedelta(seconds=settings.SOFT_DELETE_RETENTION),
+            batch_size=options['batch_size'],
+            until=until,
+            progress=progress
+        )
+        summary = ', '.join(
+            f'{count} {name}' for name, count in deleted.items())
+        if finished:
+            self.stdout.write(self.style.SUCCESS(f'Purged {summary}'))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f'Purged {summary}; the window ended before the rest'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe
+from core.sharding import data_databases
+from core.similarity import rebuild_user
+
+
+class Command(BaseCommand):
+    """Django command: recompute the "similar recipes" neighbour table,
+    e.g. after changing RECIPE_SIMILARITY_METRIC or RECIPE_SIMILARITY_TOP_K
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            help='Only rebuild these user ids')
+
+    def handle(self, *args, **options):
+        for alias in data_databases():
+            user_ids = Recipe.objects.using(alias).\
+                order_by('user_id').\
+                values_list('user_id', flat=True).\
+                distinct()
+            if options['user']:
+                user_ids = user_ids.filter(user_id__in=options['user'])
+
+            count = 0
+            for user_id in list(user_ids):
+                rebuild_user(user_id, using=alias)
+                count += 1
+            self.stdout.write(f'{alias}: rebuilt {count} users')
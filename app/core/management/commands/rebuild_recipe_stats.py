@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.sharding import data_databases
+from core.stats import rebuild_all
+
+
+class Command(BaseCommand):
+    """Django command: recompute the recipe statistics rollups and the
+    recipe counts of tags and ingredients from scratch"""
+
+    def handle(self, *args, **options):
+        for alias in data_databases():
+            users = rebuild_all(using=alias)
+            self.stdout.write(f'{alias}: rebuilt statistics of {users} users')
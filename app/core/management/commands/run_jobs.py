@@ -0,0 +1,75 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils.module_loading import autodiscover_modules
+
+from core.jobs import claim, requeue_stale, run
+
+
+class Command(BaseCommand):
+    """Django command: run queued background jobs in worker processes
+
+    Each process claims one job at a time; SIGTERM and SIGINT let running
+    jobs finish before exiting.
+    """
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when no job is due')
+        parser.add_argument('--poll', type=float,
+                            default=settings.JOB_POLL_INTERVAL,
+                            help='Seconds to sleep while the queue is empty')
+
+    def handle(self, *args, **options):
+        autodiscover_modules('jobs')
+        requeue_stale()
+        if options['processes'] <= 1:
+            return self.work(0, options)
+
+        # Children must open their own database connections
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(target=self.work, args=(i, options))
+            for i in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+
+        def stop(*args):
+            for worker in workers:
+                worker.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        for worker in workers:
+            worker.join()
+
+    def work(self, number, options):
+        name = f'{socket.gethostname()}:{os.getpid()}:{number}'
+        stopping = []
+        previous = {
+            signum: signal.signal(
+                signum, lambda *args: stopping.append(True))
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        try:
+            while not stopping:
+                job = claim(name)
+                if job is None:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll'])
+                    continue
+
+                run(job)
+                self.stdout.write(f'{name}: {job} {job.status}')
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
@@ -0,0 +1,87 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+re_importtime = re.compile(
+    r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+# Run in a fresh interpreter so nothing is imported yet
+STARTUP_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+import django
+django.setup()
+timings = {'setup': time.perf_counter() - start}
+if %(wsgi)r:
+    from django.core.wsgi import get_wsgi_application
+    from django.urls import get_resolver
+    get_wsgi_application()
+    get_resolver().url_patterns
+    timings['wsgi'] = time.perf_counter() - start
+print(json.dumps(timings))
+'''
+
+
+def parse_importtime(lines):
+    """Return [(module, self us, cumulative us, depth)] from the output of
+    python -X importtime"""
+    modules = []
+    for line in lines:
+        match = re_importtime.match(line.rstrip())
+        if match:
+            own, cumulative, indent, module = match.groups()
+            modules.append(
+                (module, int(own), int(cumulative), len(indent) // 2))
+    return modules
+
+
+class Command(BaseCommand):
+    """Django command: report where start-up time goes, i.e. the time to
+    set Django up (and build the WSGI application) in a new process and
+    the slowest imports"""
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15)
+        parser.add_argument('--wsgi', action='store_true',
+                            help='Also load middleware and the URLconf')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             STARTUP_SCRIPT % {'wsgi': options['wsgi']}],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        if result.returncode:
+            raise CommandError(result.stderr)
+
+        for phase, seconds in json.loads(result.stdout).items():
+            self.stdout.write(f'{phase}: {seconds * 1000:.0f} ms')
+
+        modules = parse_importtime(result.stderr.splitlines())
+        self.write_table(
+            'Slowest top-level imports (cumulative)',
+            sorted((m for m in modules if m[3] == 0),
+                   key=lambda m: -m[2])[:options['top']],
+            2
+        )
+        self.write_table(
+            'Slowest modules (self)',
+            sorted(modules, key=lambda m: -m[1])[:options['top']],
+            1
+        )
+
+    def write_table(self, title, modules, column):
+        self.stdout.write(f'\n{title}:')
+        for module in modules:
+            self.stdout.write(f'{module[column] / 1000:9.1f} ms  {module[0]}')
@@ -7,6 +7,7 @@ from django.core.management.base import BaseCommand
 
 class Command(BaseCommand):
     """Django command: pauses the execution until database is available"""
+    requires_system_checks = False
 
     def handle(self, *args, **optoins):
         self.stdout.write('Waiting for database...')
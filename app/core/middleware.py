@@ -0,0 +1,144 @@
+import re
+import zlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+re_accept_encoding = re.compile(
+    r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*(?:,|$)')
+
+# Media types that are already compressed and don't shrink any further
+re_incompressible_type = re.compile(
+    r'^(image/(?!svg)|video/|audio/|font/woff'
+    r'|application/(zip|gzip|x-gzip|x-bzip2|x-xz|x-7z-compressed|pdf))'
+)
+
+
+class GzipEncoder:
+    name = 'gzip'
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(
+            settings.COMPRESSION_GZIP_LEVEL,
+            zlib.DEFLATED,
+            16 + zlib.MAX_WBITS
+        )
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+@lru_cache(maxsize=None)
+def get_brotli():
+    """Return the brotli module, or None if it isn't installed
+
+    Imported on first use to keep it out of process start-up.
+    """
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+class BrotliEncoder:
+    name = 'br'
+
+    def __init__(self):
+        self._compressor = get_brotli().Compressor(
+            quality=settings.COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def available_encoders():
+    """Return the supported encoders, most preferred first"""
+    if get_brotli() is None:
+        return (GzipEncoder,)
+    return (BrotliEncoder, GzipEncoder)
+
+
+def accepted_encodings(header):
+    """Return {coding: qvalue} parsed from an Accept-Encoding header"""
+    encodings = {}
+    for coding, qvalue in re_accept_encoding.findall(header):
+        try:
+            encodings[coding.lower()] = float(qvalue) if qvalue else 1.0
+        except ValueError:
+            continue
+    return encodings
+
+
+def choose_encoder(header):
+    """Return the preferred encoder the client accepts, or None"""
+    accepted = accepted_encodings(header)
+    best, best_qvalue = None, 0
+    for encoder in available_encoders():
+        qvalue = accepted.get(encoder.name, accepted.get('*', 0))
+        if qvalue > best_qvalue:
+            best, best_qvalue = encoder, qvalue
+    return best
+
+
+def compress_sequence(encoder, sequence):
+    """Compress the chunks of a streaming response as they are produced"""
+    for item in sequence:
+        data = encoder.compress(item)
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """Compress responses with Brotli (if installed) or gzip
+
+    Responses shorter than COMPRESSION_MIN_SIZE, responses that already
+    have a Content-Encoding and already-compressed media are left alone.
+    """
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and \
+                len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        if re_incompressible_type.match(response.get('Content-Type', '')):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoder = choose_encoder(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoder is None:
+            return response
+
+        if response.streaming:
+            # The compressed size is unknown until the stream is exhausted
+            response.streaming_content = compress_sequence(
+                encoder(), response.streaming_content)
+            del response['Content-Length']
+        else:
+            compressor = encoder()
+            content = compressor.compress(response.content) + \
+                compressor.finish()
+            if len(content) >= len(response.content):
+                return response
+            response.content = content
+            response['Content-Length'] = str(len(content))
+
+        # A compressed body is no longer byte-identical to the original, so
+        # a strong ETag has to become weak (RFC 7232 section 2.1).
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoder.name
+
+        return response
@@ -0,0 +1,16 @@
+import core.partitioning
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_usershard'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            core.partitioning.partition_tables,
+            core.partitioning.unpartition_tables,
+        ),
+    ]
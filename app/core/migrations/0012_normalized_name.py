@@ -0,0 +1,36 @@
+# Generated by Django 2.2.28 on 2026-10-18 22:40
+
+from django.db import migrations, models
+
+import core.normalization
+
+
+def merge_duplicates(apps, schema_editor):
+    for name in ('Tag', 'Ingredient'):
+        core.normalization.merge_all_duplicates(
+            apps.get_model('core', name),
+            using=schema_editor.connection.alias
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_partition_recipe_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='normalized_name',
+            field=models.CharField(default='', editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='normalized_name',
+            field=models.CharField(default='', editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 2.2.28 on 2026-10-18 22:19
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_rollups(apps, schema_editor):
+    using = schema_editor.connection.alias
+    Recipe = apps.get_model('core', 'Recipe')
+    RecipeStats = apps.get_model('core', 'RecipeStats')
+
+    totals = Recipe.objects.using(using).\
+        order_by().\
+        values('user_id').\
+        annotate(
+            recipe_count=Count('id'),
+            time_minutes_sum=Sum('time_minutes'),
+            price_sum=Sum('price'),
+        )
+    RecipeStats.objects.using(using).bulk_create(
+        [RecipeStats(**row) for row in totals], batch_size=1000)
+
+    for relation in ('tags', 'ingredients'):
+        field = Recipe._meta.get_field(relation)
+        column = field.m2m_reverse_field_name()
+        counts = field.remote_field.through.objects.\
+            filter(**{column: OuterRef('pk')}).\
+            order_by().\
+            values(column).\
+            annotate(count=Count('id')).\
+            values('count')
+        field.related_model.objects.using(using).update(
+            recipe_count=Coalesce(
+                Subquery(counts, output_field=models.IntegerField()), 0)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_recipesimilarity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('recipe_count', models.IntegerField(default=0)),
+                ('time_minutes_sum', models.BigIntegerField(default=0)),
+                ('price_sum', models.DecimalField(decimal_places=2, default=0, max_digits=17)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
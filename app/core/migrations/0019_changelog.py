@@ -0,0 +1,57 @@
+# Generated by Django 2.2.28 on 2026-10-18 22:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def log_existing_objects(apps, schema_editor):
+    """Give every existing object a log entry, so syncing from scratch
+    lists it"""
+    using = schema_editor.connection.alias
+    ChangeLog = apps.get_model('core', 'ChangeLog')
+    for name in ('Tag', 'Ingredient', 'Recipe'):
+        model = apps.get_model('core', name)
+        rows = model.objects.using(using).\
+            order_by('id').\
+            values_list('id', 'user_id').\
+            iterator()
+        ChangeLog.objects.using(using).bulk_create(
+            (
+                ChangeLog(
+                    user_id=user_id, kind=name.lower(), object_id=pk)
+                for pk, user_id in rows
+            ),
+            batch_size=1000
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_recipe_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(max_length=16)),
+                ('object_id', models.IntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['user', 'id'], name='core_change_user_id_ee010b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changelog',
+            index=models.Index(fields=['user', 'kind', 'object_id'], name='core_change_user_id_2eee94_idx'),
+        ),
+        migrations.RunPython(log_existing_objects, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+
+# Upper-case expression indexes serving the admin's case-insensitive
+# searches, which compile to UPPER(column::text) LIKE/=. Django 2.2 can't
+# declare expression indexes on models, so they're PostgreSQL-only SQL.
+INDEXES = (
+    ('core_tag_name_upper_idx', 'core_tag',
+     'UPPER(name::text) text_pattern_ops', 'deleted_at IS NULL'),
+    ('core_ingredient_name_upper_idx', 'core_ingredient',
+     'UPPER(name::text) text_pattern_ops', 'deleted_at IS NULL'),
+    ('core_recipe_title_upper_idx', 'core_recipe',
+     'UPPER(title::text) text_pattern_ops', 'deleted_at IS NULL'),
+    ('core_user_email_upper_idx', 'core_user', 'UPPER(email::text)', None),
+)
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, table, expression, condition in INDEXES:
+        where = f' WHERE {condition}' if condition else ''
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+            f'({expression}){where}'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _, _, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_soft_delete'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
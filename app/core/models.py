@@ -1,15 +1,36 @@
+import json
 import uuid
 import os
 
-from django.db import models
+from django.db import models, router
+from django.db.models import Q
+from django.db.models.signals import post_delete, pre_delete
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
     PermissionsMixin
 from django.conf import settings
 
+from core.normalization import normalize_name
+from core.storage import ContentAddressedStorage, file_digest
+
+
+def recipe_image_digest_path(digest, extension):
+    """Return the content-addressed path for a digest and extension"""
+    return os.path.join(
+        'uploads/recipe/', digest[:2], f'{digest}.{extension.lower()}')
+
 
 def recipe_image_file_path(instance, file_name):
-    """Generate file path for the given file name"""
+    """Generate file path for the given file name
+
+    Uploads are named after a hash of their content so identical images
+    share one file; a random name is used when the content is unavailable.
+    """
     extension = file_name.split('.')[-1]
+    image = getattr(instance, 'image', None)
+    if image and not image._committed:
+        return recipe_image_digest_path(file_digest(image.file), extension)
+
     file_name = f'{uuid.uuid4()}.{extension}'
 
     return os.path.join('uploads/recipe/', file_name)
@@ -43,35 +64,146 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    token_version = models.PositiveIntegerField(default=0)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
 
-class Tag(models.Model):
+class UserShard(models.Model):
+    """Directory entry mapping a user to the database holding their data"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    alias = models.CharField(max_length=64)
+    moving = models.BooleanField(default=False)
+
+
+class AliveManager(models.Manager):
+    """Manager hiding soft-deleted rows"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+# Indexes of soft-deletable tables cover only the live rows the API reads,
+# or only the deleted rows awaiting purge
+ALIVE = Q(deleted_at__isnull=True)
+
+
+class SoftDeleteModel(models.Model):
+    """Model whose rows are marked deleted first and removed for good
+    later, in batches, by the purge_deleted command
+
+    The default manager hides deleted rows; all_objects includes them.
+    """
+    deleted_at = models.DateTimeField(null=True, editable=False)
+
+    objects = AliveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        abstract = True
+
+    def soft_delete(self, using=None):
+        """Mark the row deleted
+
+        To the rest of the app the row is gone, so pre_delete and
+        post_delete are sent as for a delete; cascades and links are left
+        to the purge, which sends no signals. updated_at moves with
+        deleted_at, so the Last-Modified and ETag of recipes that listed a
+        deleted tag or ingredient change.
+        """
+        using = using or router.db_for_write(type(self), instance=self)
+        pre_delete.send(sender=type(self), instance=self, using=using)
+        self.deleted_at = self.updated_at = timezone.now()
+        type(self).all_objects.using(using).filter(pk=self.pk).\
+            update(deleted_at=self.deleted_at, updated_at=self.updated_at)
+        post_delete.send(sender=type(self), instance=self, using=using)
+
+
+class NormalizedNameMixin:
+    """Keep normalized_name in step with name"""
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super().save(*args, **kwargs)
+
+
+class Tag(NormalizedNameMixin, SoftDeleteModel):
     name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, editable=False)
+    recipe_count = models.IntegerField(default=0, editable=False)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', 'name'],
+                condition=ALIVE,
+                name='tag_user_name_alive_idx'
+            ),
+            models.Index(
+                fields=['deleted_at'],
+                condition=Q(deleted_at__isnull=False),
+                name='tag_deleted_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'normalized_name'],
+                condition=ALIVE,
+                name='unique_tag_name_per_user'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Ingredient(models.Model):
+class Ingredient(NormalizedNameMixin, SoftDeleteModel):
     name = models.CharField(max_length=255)
+    normalized_name = models.CharField(max_length=255, editable=False)
+    recipe_count = models.IntegerField(default=0, editable=False)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', 'name'],
+                condition=ALIVE,
+                name='ingredient_user_name_alive_idx'
+            ),
+            models.Index(
+                fields=['deleted_at'],
+                condition=Q(deleted_at__isnull=False),
+                name='ingredient_deleted_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'normalized_name'],
+                condition=ALIVE,
+                name='unique_ingredient_name_per_user'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+class Recipe(SoftDeleteModel):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
@@ -82,7 +214,166 @@ class Recipe(models.Model):
     link = models.CharField(max_length=255, blank=True)
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField("Tag")
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    image = models.ImageField(
+        null=True,
+        db_index=True,
+        upload_to=recipe_image_file_path,
+        storage=ContentAddressedStorage()
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+    # Bumped by every API update, see recipe.serializers.RecipeSerializer
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', 'id'],
+                condition=ALIVE,
+                name='recipe_user_alive_idx'
+            ),
+            models.Index(
+                fields=['user', 'title'],
+                condition=ALIVE,
+                name='recipe_user_title_alive_idx'
+            ),
+            models.Index(
+                fields=['deleted_at'],
+                condition=Q(deleted_at__isnull=False),
+                name='recipe_deleted_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class RecipeSimilarity(models.Model):
+    """Precomputed neighbour of a recipe, by shared tags and ingredients"""
+    # Recipe ids are not unique on their own once core_recipe is
+    # partitioned, so these can't be database-level foreign keys
+    recipe = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='similarities'
+    )
+    similar = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='+'
+    )
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('recipe', 'similar')
+
+
+class RecipeStats(models.Model):
+    """Running totals of a user's recipes, kept up to date by signals"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    recipe_count = models.IntegerField(default=0)
+    time_minutes_sum = models.BigIntegerField(default=0)
+    price_sum = models.DecimalField(
+        max_digits=17, decimal_places=2, default=0)
+
+
+class Job(models.Model):
+    """Unit of background work, claimed and run by the run_jobs workers"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    )
+
+    kind = models.CharField(max_length=64)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        on_delete=models.SET_NULL
+    )
+    payload_json = models.TextField(default='{}')
+    result_json = models.TextField(default='{}')
+    status = models.CharField(
+        max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True)
+    locked_by = models.CharField(max_length=64, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    @property
+    def payload(self):
+        return json.loads(self.payload_json)
+
+    @property
+    def result(self):
+        return json.loads(self.result_json)
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk}'
+
+
+class StoredImage(models.Model):
+    """Lock row of a content-addressed image file
+
+    Releasing an image and attaching an upload to a recipe lock the row of
+    its name, so a file isn't deleted while a recipe starts using it.
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+
+    def __str__(self):
+        return self.name
+
+
+class ThrottleBucket(models.Model):
+    """Token bucket or in-flight counter of core.throttling's database
+    store"""
+    key = models.CharField(max_length=255, primary_key=True)
+    value = models.FloatField()
+    updated = models.FloatField()
+
+    def __str__(self):
+        return self.key
+
+
+class ChangeLog(models.Model):
+    """Entry of a user's change log: a recipe, tag or ingredient was
+    saved, relinked or deleted. Read by the recipe sync endpoint."""
+    id = models.BigAutoField(primary_key=True)
+    # Deleting a user deletes their objects, logging them as the user row
+    # goes away
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        db_constraint=False
+    )
+    kind = models.CharField(max_length=16)
+    object_id = models.IntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['user', 'kind', 'object_id']),
+        ]
+
+    def __str__(self):
+        action = 'deleted' if self.deleted else 'changed'
+        return f'{self.kind} {self.object_id} {action}'
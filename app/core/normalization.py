@@ -0,0 +1,130 @@
+import unicodedata
+
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+
+def normalize_name(name):
+    """Return the key under which a user's tag or ingredient names are
+    considered equal, e.g. "Salt", "salt " and "SALT" share one key"""
+    name = unicodedata.normalize('NFKC', name)
+    return ' '.join(name.split()).casefold()[:255]
+
+
+def recipe_links(model):
+    """Return (through model, recipe column, attribute column) for each
+    many-to-many relation from recipes to model"""
+    return [
+        (
+            rel.through,
+            rel.field.m2m_column_name(),
+            rel.field.m2m_reverse_name(),
+        )
+        for rel in model._meta.related_objects if rel.many_to_many
+    ]
+
+
+def merge_duplicates(model, user_ids, using=DEFAULT_DB_ALIAS, dry_run=False):
+    """Merge the rows of model sharing a normalized name, per user
+
+    The row with the lowest id survives. Recipe links of the duplicates
+    are moved to it in bulk and the duplicates deleted; stale normalized
+    names are refreshed. The change log gets tombstones of the duplicates
+    and entries of the relinked recipes, so syncing clients see the merge.
+    Works with historical models, so migrations can use it. Returns the
+    number of duplicates merged.
+    """
+    from core.changelog import record
+
+    rows = model._default_manager.using(using).\
+        filter(user_id__in=user_ids).\
+        order_by('id').\
+        values_list('id', 'user_id', 'name', 'normalized_name')
+
+    survivors, renamed, duplicates, owners = {}, {}, {}, {}
+    for pk, user_id, name, normalized in rows:
+        key = (user_id, normalize_name(name))
+        if key not in survivors:
+            survivors[key] = pk
+            if normalized != key[1]:
+                renamed[pk] = key[1]
+        else:
+            duplicates[pk] = survivors[key]
+            owners[pk] = user_id
+
+    if dry_run or not (duplicates or renamed):
+        return len(duplicates)
+
+    affected = set()
+    for through, recipe_column, column in recipe_links(model):
+        links = through._default_manager.using(using).\
+            filter(**{f'{column}__in': duplicates})
+        pairs = set()
+        for recipe_id, attribute_id in links.values_list(
+                recipe_column, column):
+            pairs.add((recipe_id, duplicates[attribute_id]))
+            affected.add((owners[attribute_id], recipe_id))
+        links._raw_delete(using)
+        through._default_manager.using(using).bulk_create(
+            [
+                through(**{recipe_column: recipe_id, column: survivor})
+                for recipe_id, survivor in pairs
+            ],
+            ignore_conflicts=True
+        )
+
+    model._default_manager.using(using).\
+        filter(pk__in=duplicates)._raw_delete(using)
+
+    # Rename after deleting duplicates so the unique key stays satisfied
+    model._default_manager.using(using).bulk_update(
+        [
+            model(pk=pk, normalized_name=normalized)
+            for pk, normalized in renamed.items()
+        ],
+        ['normalized_name'],
+        batch_size=1000
+    )
+
+    recipe_model = model._meta.apps.get_model('core', 'Recipe')
+    if affected:
+        # Recipes lost their newest relation timestamps; make sure their
+        # Last-Modified moves forward
+        recipe_model._default_manager.using(using).\
+            filter(pk__in=[pk for _, pk in affected]).\
+            update(updated_at=timezone.now())
+
+    try:
+        model._meta.apps.get_model('core', 'ChangeLog')
+    except LookupError:
+        # A migration from before the change log
+        return len(duplicates)
+    for user_id in set(owners.values()):
+        record(
+            user_id, model,
+            [pk for pk, owner in owners.items() if owner == user_id],
+            deleted=True, using=using, apps=model._meta.apps)
+        record(
+            user_id, recipe_model,
+            sorted(pk for owner, pk in affected if owner == user_id),
+            using=using, apps=model._meta.apps)
+
+    return len(duplicates)
+
+
+def merge_all_duplicates(model, using=DEFAULT_DB_ALIAS, batch_size=1000,
+                         dry_run=False):
+    """Merge duplicates of model for every user, batch_size users at a
+    time, and return the number merged"""
+    user_ids = model._default_manager.using(using).\
+        order_by('user_id').\
+        values_list('user_id', flat=True).\
+        distinct()
+    merged = 0
+    last = 0
+    while True:
+        batch = list(user_ids.filter(user_id__gt=last)[:batch_size])
+        if not batch:
+            return merged
+        merged += merge_duplicates(model, batch, using, dry_run)
+        last = batch[-1]
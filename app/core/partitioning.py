@@ -0,0 +1,123 @@
+from django.conf import settings
+
+
+# Partitioned tables and their partition keys. The link tables have no
+# user_id column, so they are partitioned by recipe_id, which is what
+# their lookups filter and join on.
+PARTITIONED_TABLES = (
+    ('core_recipe', 'user_id'),
+    ('core_recipe_tags', 'recipe_id'),
+    ('core_recipe_ingredients', 'recipe_id'),
+)
+
+# Hash partitioning and primary keys on partitioned tables need
+# PostgreSQL 11
+MIN_SERVER_VERSION = 110000
+
+
+def is_partitioned(connection, table):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)',
+            [table]
+        )
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def rebuild_table(connection, table, key=None, partitions=0):
+    """Recreate a table, hash-partitioned by key when partitions is set
+
+    Rows, the id sequence, check constraints, indexes, unique constraints
+    and outgoing foreign keys are carried over. The primary key of a
+    partitioned table has to include the partition key, so it becomes
+    (id, key), and foreign keys referencing the table are dropped.
+    """
+    quote = connection.ops.quote_name
+    old = f'{table}_unpartitioned'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT conname, contype, pg_get_constraintdef(oid) '
+            'FROM pg_constraint '
+            "WHERE conrelid = to_regclass(%s) AND contype IN ('p', 'u', 'f')",
+            [table]
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(
+            'SELECT indexdef FROM pg_indexes WHERE tablename = %s '
+            'AND indexname NOT IN (SELECT conname FROM pg_constraint '
+            'WHERE conrelid = to_regclass(%s))',
+            [table, table]
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+        sequence = cursor.fetchone()[0]
+
+        partition_by = f' PARTITION BY HASH ({quote(key)})' \
+            if partitions else ''
+        cursor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(old)}')
+        cursor.execute(
+            f'CREATE TABLE {quote(table)} (LIKE {quote(old)} '
+            f'INCLUDING DEFAULTS INCLUDING CONSTRAINTS){partition_by}'
+        )
+        for remainder in range(partitions):
+            cursor.execute(
+                f'CREATE TABLE {quote(f"{table}_p{remainder}")} '
+                f'PARTITION OF {quote(table)} FOR VALUES WITH '
+                f'(MODULUS {partitions}, REMAINDER {remainder})'
+            )
+        cursor.execute(
+            f'INSERT INTO {quote(table)} SELECT * FROM {quote(old)}')
+        cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {quote(table)}.id')
+        cursor.execute(f'DROP TABLE {quote(old)} CASCADE')
+
+        for name, kind, definition in constraints:
+            if kind == 'p':
+                columns = ['id', key] if partitions else ['id']
+                definition = 'PRIMARY KEY ({})'.format(
+                    ', '.join(quote(column) for column in columns))
+            cursor.execute(
+                f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} '
+                f'{definition}'
+            )
+        for definition in indexes:
+            cursor.execute(definition)
+
+
+def partition_tables(apps, schema_editor):
+    """Hash-partition the recipe tables into RECIPE_TABLE_PARTITIONS
+
+    Leaves the tables alone on other databases and on PostgreSQL servers
+    older than 11.
+    """
+    connection = schema_editor.connection
+    partitions = settings.RECIPE_TABLE_PARTITIONS
+    if connection.vendor != 'postgresql' or not partitions or \
+            connection.pg_version < MIN_SERVER_VERSION:
+        return
+
+    for table, key in PARTITIONED_TABLES:
+        if not is_partitioned(connection, table):
+            rebuild_table(connection, table, key, partitions)
+
+
+def unpartition_tables(apps, schema_editor):
+    """Turn the recipe tables back into plain tables"""
+    connection = schema_editor.connection
+    if not is_partitioned(connection, 'core_recipe'):
+        return
+
+    for table, key in PARTITIONED_TABLES:
+        if is_partitioned(connection, table):
+            rebuild_table(connection, table)
+
+    Recipe = apps.get_model('core', 'Recipe')
+    for field in Recipe._meta.many_to_many:
+        through = field.remote_field.through
+        schema_editor.execute(schema_editor._create_fk_sql(
+            through,
+            through._meta.get_field('recipe'),
+            '_fk_%(to_table)s_%(to_column)s'
+        ))
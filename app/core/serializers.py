@@ -0,0 +1,14 @@
+from rest_framework import serializers
+
+from core.models import Job
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """Serializer for the status of background jobs"""
+    result = serializers.JSONField(read_only=True)
+
+    class Meta:
+        model = Job
+        fields = ('id', 'kind', 'status', 'attempts', 'result',
+                  'created_at', 'updated_at')
+        read_only_fields = fields
@@ -0,0 +1,251 @@
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+# Per-user models living on the user's shard, by model label. M2M tables
+# go with the model declaring the relation.
+SHARDED_MODELS = {
+    'core.tag', 'core.ingredient', 'core.recipe', 'core.recipesimilarity',
+    'core.recipestats', 'core.changelog',
+}
+
+_current_shard = ContextVar('current_shard', default=None)
+
+
+def sharding_enabled():
+    return bool(settings.SHARD_DATABASES)
+
+
+def data_databases():
+    """Return every database that may hold per-user data"""
+    return [DEFAULT_DB_ALIAS] + [
+        alias for alias in settings.SHARD_DATABASES
+        if alias != DEFAULT_DB_ALIAS
+    ]
+
+
+def set_current_shard(alias):
+    """Route the per-user models of the current request to a shard"""
+    _current_shard.set(alias)
+
+
+def is_sharded(model):
+    if model._meta.auto_created:
+        model = model._meta.auto_created
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+def _cache_key(user_id):
+    return f'user-shard:{user_id}'
+
+
+def invalidate_shard(user_id):
+    cache.delete(_cache_key(user_id))
+
+
+def copy_user(user_id, alias):
+    """Make sure the user row referenced by per-user data exists on alias"""
+    User = get_user_model()
+    if User.objects.using(alias).filter(pk=user_id).exists():
+        return
+    user = User.objects.using(DEFAULT_DB_ALIAS).get(pk=user_id)
+    user.save(using=alias, force_insert=True)
+
+
+def _alias_holding_data(user_id):
+    """Return the first data database holding rows of a user, or None"""
+    from core.models import Ingredient, Recipe, Tag
+
+    for alias in data_databases():
+        for model in (Recipe, Tag, Ingredient):
+            if model._base_manager.using(alias).\
+                    filter(user_id=user_id).exists():
+                return alias
+    return None
+
+
+def shard_entry(user_id):
+    """Return (alias, moving) for a user, assigning a shard if needed
+
+    Users who already have rows, e.g. from before sharding was turned on,
+    are assigned the database holding them and can be moved later with
+    move_user. Entries are cached for SHARD_DIRECTORY_CACHE_SECONDS, which
+    is how long a worker may keep acting on a stale entry during a move.
+    """
+    from core.models import UserShard
+
+    entry = cache.get(_cache_key(user_id))
+    if entry is not None:
+        return entry
+
+    shard = UserShard.objects.using(DEFAULT_DB_ALIAS).\
+        filter(user_id=user_id).first()
+    if shard is None:
+        alias = _alias_holding_data(user_id) or settings.SHARD_DATABASES[
+            user_id % len(settings.SHARD_DATABASES)]
+        copy_user(user_id, alias)
+        shard, _ = UserShard.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+            user_id=user_id, defaults={'alias': alias})
+
+    entry = (shard.alias, shard.moving)
+    cache.set(
+        _cache_key(user_id), entry, settings.SHARD_DIRECTORY_CACHE_SECONDS)
+    return entry
+
+
+def shard_for_user(user_id):
+    return shard_entry(user_id)[0]
+
+
+class ShardRouter:
+    """Route per-user models to the shard of the user owning the rows
+
+    The shard comes from the current request (see ShardRoutingMixin) or
+    from the instance hint. Other models, and every model while
+    SHARD_DATABASES is empty, are left to the next router.
+    """
+
+    def _db_for_model(self, model, **hints):
+        if not sharding_enabled() or not is_sharded(model):
+            return None
+
+        instance = hints.get('instance')
+        if isinstance(instance, get_user_model()):
+            return shard_for_user(instance.pk)
+        if instance is not None:
+            if instance._state.db:
+                return instance._state.db
+            user_id = getattr(instance, 'user_id', None)
+            if user_id is not None:
+                return shard_for_user(user_id)
+
+        return _current_shard.get()
+
+    db_for_read = _db_for_model
+    db_for_write = _db_for_model
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+def _copy_rows(queryset, target, batch_size):
+    """Copy rows to target keeping their primary keys, batch_size rows at
+    a time in primary key order, and return the keys copied"""
+    copied = []
+    queryset = queryset.order_by('pk')
+    while True:
+        batch = queryset.filter(pk__gt=copied[-1]) if copied else queryset
+        rows = list(batch[:batch_size])
+        if not rows:
+            return copied
+        queryset.model.objects.using(target).bulk_create(rows)
+        copied.extend(row.pk for row in rows)
+
+
+def _delete_rows(model, source, ids, batch_size):
+    for start in range(0, len(ids), batch_size):
+        model._base_manager.using(source).filter(
+            pk__in=ids[start:start + batch_size])._raw_delete(source)
+
+
+def move_user(user_id, target, batch_size=1000, settle=None, log=None):
+    """Move a user's tags, ingredients, recipes and their links to target
+
+    Writes are refused while the user is marked as moving; reads keep
+    using the old shard until the directory entry is flipped. Workers
+    cache entries, so the move waits for that cache to expire before
+    copying and again before deleting the old rows.
+    """
+    from core.models import ChangeLog, Ingredient, Recipe, \
+        RecipeSimilarity, RecipeStats, Tag, UserShard
+
+    log = log or (lambda message: None)
+    settle = settings.SHARD_DIRECTORY_CACHE_SECONDS if settle is None \
+        else settle
+    source = shard_for_user(user_id)
+    if source == target:
+        return
+
+    directory = UserShard.objects.using(DEFAULT_DB_ALIAS).\
+        filter(user_id=user_id)
+    directory.update(moving=True)
+    invalidate_shard(user_id)
+    log(f'Marked user {user_id} as moving, waiting {settle}s')
+    time.sleep(settle)
+
+    # Soft-deleted rows move too, their purge is still due
+    recipes = Recipe.all_objects.using(source).filter(user_id=user_id)
+    links = [
+        Recipe.tags.through, Recipe.ingredients.through, RecipeSimilarity]
+    copied = {}
+    try:
+        copy_user(user_id, target)
+        with transaction.atomic(using=target):
+            for model in (Tag, Ingredient, Recipe, RecipeStats, ChangeLog):
+                copied[model] = _copy_rows(
+                    model._base_manager.using(source).
+                    filter(user_id=user_id),
+                    target, batch_size)
+                log(f'Copied {len(copied[model])} '
+                    f'{model._meta.verbose_name_plural}')
+            for through in links:
+                copied[through] = _copy_rows(
+                    through.objects.using(source).filter(recipe__in=recipes),
+                    target, batch_size)
+                log(f'Copied {len(copied[through])} '
+                    f'{through._meta.db_table} rows')
+    except Exception:
+        directory.update(moving=False)
+        invalidate_shard(user_id)
+        raise
+
+    directory.update(alias=target, moving=False)
+    invalidate_shard(user_id)
+    log(f'User {user_id} now lives on {target}, waiting {settle}s')
+    time.sleep(settle)
+
+    with transaction.atomic(using=source):
+        for model in links + [
+                Recipe, Tag, Ingredient, RecipeStats, ChangeLog]:
+            _delete_rows(model, source, copied[model], batch_size)
+    log(f'Deleted the rows of user {user_id} from {source}')
+
+
+def reserve_id_ranges(log=None):
+    """Start the id sequences of each data database in a disjoint range
+
+    Rows keep their primary keys when moved between shards, so the shards
+    must never allocate the same ids. PostgreSQL only.
+    """
+    from django.apps import apps
+    from django.db import connections
+
+    log = log or (lambda message: None)
+    tables = [
+        model._meta.db_table
+        for model in apps.get_models(include_auto_created=True)
+        if is_sharded(model)
+    ]
+    for index, alias in enumerate(data_databases()):
+        connection = connections[alias]
+        if connection.vendor != 'postgresql':
+            log(f'{alias}: skipped, not PostgreSQL')
+            continue
+
+        start = index * settings.SHARD_ID_RANGE + 1
+        with connection.cursor() as cursor:
+            for table in tables:
+                table = connection.ops.quote_name(table)
+                cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+                next_id = max(start, cursor.fetchone()[0] + 1)
+                cursor.execute(
+                    "SELECT setval(pg_get_serial_sequence(%s, 'id'), %s, "
+                    "false)",
+                    [table, next_id]
+                )
+        log(f'{alias}: ids start at {start}')
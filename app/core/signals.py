@@ -0,0 +1,296 @@
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_init, pre_save, post_save, \
+    post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+
+from core.changelog import record
+from core.models import Ingredient, Recipe, RecipeSimilarity, StoredImage, \
+    Tag
+from core.sharding import data_databases
+from core.similarity import schedule_update
+from core.stats import bump_recipe_stats, bump_usage, to_decimal
+
+
+def _image_name(value):
+    """Return the stored name of an image field value, or None"""
+    return getattr(value, 'name', value) or None
+
+
+def _lock_image(name):
+    """Lock the StoredImage row of an image name until the current
+    transaction of the directory database ends"""
+    StoredImage.objects.using(DEFAULT_DB_ALIAS).select_for_update().\
+        get_or_create(name=name)
+
+
+def delete_unreferenced_image(name):
+    """Delete a stored image unless a recipe on any shard references it,
+    and return whether it was deleted
+
+    The check and the deletion hold the image's lock, which recipes taking
+    the image on take after they commit (see keep_image), so either this
+    sees the new reference or the uploader sees the file gone.
+    """
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        _lock_image(name)
+        for alias in data_databases():
+            if Recipe.objects.using(alias).filter(image=name).exists():
+                return False
+        Recipe._meta.get_field('image').storage.delete(name)
+        StoredImage.objects.using(DEFAULT_DB_ALIAS).\
+            filter(name=name).delete()
+    return True
+
+
+def release_image(name, using=None):
+    """Delete a stored image once no recipe references it"""
+    if name:
+        transaction.on_commit(
+            lambda: delete_unreferenced_image(name), using=using)
+
+
+def keep_image(name, content, using=None):
+    """Make sure a newly referenced image is stored once the recipe
+    commits
+
+    Content-addressed uploads reuse an existing file, which a concurrent
+    release_image may have deleted before the recipe committed; the file
+    is then stored again from the upload's content.
+    """
+    def store_if_missing():
+        if getattr(content, 'closed', False):
+            return
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            _lock_image(name)
+            storage = Recipe._meta.get_field('image').storage
+            if not storage.exists(name):
+                content.seek(0)
+                storage.save(name, content)
+
+    transaction.on_commit(store_if_missing, using=using)
+
+
+@receiver(post_init, sender=Recipe)
+def remember_loaded_image(sender, instance, **kwargs):
+    """Keep the image name a recipe was loaded with"""
+    if 'image' in instance.__dict__:
+        instance._loaded_image = _image_name(instance.__dict__['image'])
+
+
+@receiver(pre_save, sender=Recipe)
+def load_deferred_image(sender, instance, **kwargs):
+    """Look up the stored image name of recipes loaded with it deferred"""
+    if instance.pk and not hasattr(instance, '_loaded_image'):
+        instance._loaded_image = Recipe.objects.filter(pk=instance.pk).\
+            values_list('image', flat=True).first()
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_uploaded_image(sender, instance, **kwargs):
+    """Keep the content of an image about to be stored"""
+    image = instance.image
+    if image and not image._committed:
+        instance._uploaded_image = image.file
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, **kwargs):
+    """Release the previous image of a recipe when it was replaced"""
+    previous = getattr(instance, '_loaded_image', None)
+    current = _image_name(instance.image)
+    content = instance.__dict__.pop('_uploaded_image', None)
+    if previous != current:
+        release_image(previous, using=instance._state.db)
+        if current and content is not None:
+            keep_image(current, content, using=instance._state.db)
+    instance._loaded_image = current
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(sender, instance, **kwargs):
+    """Release the image of a deleted recipe"""
+    release_image(
+        _image_name(instance.__dict__.get('image')),
+        using=instance._state.db
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_similarity(sender, instance, action, reverse, pk_set, **kwargs):
+    """Refresh neighbours of recipes whose tags or ingredients changed"""
+    if action not in ('post_add', 'post_remove', 'post_clear',
+                      'pre_clear'):
+        return
+    if not reverse:
+        if action != 'pre_clear':
+            schedule_update(
+                instance.user_id, [instance.pk], instance._state.db)
+        return
+
+    # A tag or ingredient changed recipes; on clear, pk_set is empty so
+    # the affected recipes are collected before the links go away
+    if action == 'pre_clear':
+        instance._cleared_recipes = list(
+            instance.recipe_set.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_recipes', ())
+    if pk_set:
+        schedule_update(
+            instance.user_id, list(pk_set), instance._state.db)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remember_similar_recipes(sender, instance, **kwargs):
+    """Note the recipes listing a recipe about to be deleted"""
+    instance._listed_by = list(
+        RecipeSimilarity.objects.using(instance._state.db).
+        filter(similar=instance).
+        values_list('recipe_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def refill_similar_recipes(sender, instance, **kwargs):
+    """Refill the neighbour lists that lost a deleted recipe"""
+    listed_by = getattr(instance, '_listed_by', None)
+    if listed_by:
+        schedule_update(
+            instance.user_id, listed_by, instance._state.db)
+
+
+def _stats_values(recipe):
+    return recipe.time_minutes, to_decimal(recipe.price)
+
+
+@receiver(post_init, sender=Recipe)
+def remember_loaded_stats(sender, instance, **kwargs):
+    """Keep the rolled up values a recipe was loaded with"""
+    if 'time_minutes' in instance.__dict__ and \
+            'price' in instance.__dict__ and instance.pk:
+        instance._loaded_stats = _stats_values(instance)
+
+
+@receiver(pre_save, sender=Recipe)
+def load_deferred_stats(sender, instance, **kwargs):
+    """Look up the stored values of recipes loaded with them deferred"""
+    if instance.pk and not hasattr(instance, '_loaded_stats'):
+        instance._loaded_stats = Recipe.objects.filter(pk=instance.pk).\
+            values_list('time_minutes', 'price').first()
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_stats(sender, instance, created, **kwargs):
+    """Add a saved recipe, or its changes, to its user's rollup"""
+    current = _stats_values(instance)
+    previous = getattr(instance, '_loaded_stats', None)
+    if created:
+        bump_recipe_stats(
+            instance.user_id, instance._state.db, 1, *current)
+    elif previous is not None and previous != current:
+        bump_recipe_stats(
+            instance.user_id,
+            instance._state.db,
+            0,
+            current[0] - previous[0],
+            current[1] - to_decimal(previous[1])
+        )
+    instance._loaded_stats = current
+
+
+@receiver(pre_delete, sender=Recipe)
+def remember_recipe_links(sender, instance, **kwargs):
+    """Note the tags and ingredients of a recipe about to be deleted"""
+    instance._linked = {
+        field.related_model: list(
+            getattr(instance, field.name).values_list('id', flat=True))
+        for field in Recipe._meta.many_to_many
+    }
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_stats(sender, instance, **kwargs):
+    """Take a deleted recipe out of its user's rollup and usage counts"""
+    using = instance._state.db
+    time_minutes, price = _stats_values(instance)
+    bump_recipe_stats(instance.user_id, using, -1, -time_minutes, -price)
+    for model, ids in getattr(instance, '_linked', {}).items():
+        bump_usage(model, dict.fromkeys(ids, -1), using)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def update_usage_counts(sender, instance, action, reverse, model, pk_set,
+                        using, **kwargs):
+    """Keep the recipe counts of tags and ingredients up to date
+
+    pk_set of a remove lists the requested objects whether or not they
+    were linked, so the links actually removed are looked up first.
+    """
+    attribute = type(instance) if reverse else model
+    column = attribute._meta.model_name
+    own, other = (column, 'recipe') if reverse else ('recipe', column)
+
+    if action in ('pre_remove', 'pre_clear'):
+        links = sender.objects.using(using).filter(**{own: instance.pk})
+        if action == 'pre_remove':
+            links = links.filter(**{f'{other}__in': pk_set})
+        if reverse:
+            instance._usage_removed = {instance.pk: links.count()}
+        else:
+            instance._usage_removed = dict.fromkeys(
+                links.values_list(f'{other}_id', flat=True), 1)
+        return
+
+    if action == 'post_add':
+        changes = {instance.pk: len(pk_set)} if reverse else \
+            dict.fromkeys(pk_set, 1)
+    elif action in ('post_remove', 'post_clear'):
+        changes = {
+            pk: -delta for pk, delta in
+            instance.__dict__.pop('_usage_removed', {}).items()
+        }
+    else:
+        return
+    bump_usage(attribute, changes, using)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def log_saved(sender, instance, **kwargs):
+    """Log saved recipes, tags and ingredients for syncing clients"""
+    record(instance.user_id, sender, [instance.pk], using=instance._state.db)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def log_deleted(sender, instance, **kwargs):
+    """Log deleted recipes, tags and ingredients as tombstones"""
+    record(
+        instance.user_id,
+        sender,
+        [instance.pk],
+        deleted=True,
+        using=instance._state.db
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def log_relinked(sender, instance, action, reverse, pk_set, **kwargs):
+    """Log recipes whose tags or ingredients changed"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        recipe_ids = [instance.pk]
+    elif action == 'post_clear':
+        # Collected by update_similarity before the links went away
+        recipe_ids = getattr(instance, '_cleared_recipes', ())
+    else:
+        recipe_ids = pk_set
+    if recipe_ids:
+        record(
+            instance.user_id, Recipe, recipe_ids, using=instance._state.db)
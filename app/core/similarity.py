@@ -0,0 +1,204 @@
+import heapq
+import json
+from collections import defaultdict
+from math import sqrt
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Min
+
+from core.jobs import enqueue
+from core.models import Job, Recipe, RecipeSimilarity
+
+
+# Relations whose linked objects make up a recipe's feature set
+RELATIONS = (Recipe.tags.field, Recipe.ingredients.field)
+
+UPDATE_JOB = 'recipe.update_similarity'
+
+
+def feature_sets(user_id, using=None, recipes=None, features=None):
+    """Return {recipe id: features} of a user's live recipes
+
+    Features are (relation, id) pairs of the live tags and ingredients a
+    recipe links to, relation indexing RELATIONS; a set of them is the
+    sparse binary vector of the recipe. Only the given recipes, or the
+    recipes having one of the given features, are loaded.
+    """
+    vectors = defaultdict(set)
+    for relation, field in enumerate(RELATIONS):
+        through = field.remote_field.through
+        related = field.m2m_reverse_field_name()
+        links = through.objects.using(using).filter(
+            recipe__user_id=user_id,
+            recipe__deleted_at__isnull=True,
+            # Soft-deleted tags and ingredients keep their links until
+            # purged
+            **{f'{related}__deleted_at__isnull': True}
+        )
+        if recipes is not None:
+            links = links.filter(recipe__in=list(recipes))
+        if features is not None:
+            links = links.filter(**{f'{related}__in': [
+                related_id for feature_relation, related_id in features
+                if feature_relation == relation
+            ]})
+        for recipe_id, related_id in links.values_list(
+                'recipe_id', f'{related}_id'):
+            vectors[recipe_id].add((relation, related_id))
+    return dict(vectors)
+
+
+def similarity(features, other):
+    """Return the similarity of two feature sets, using
+    RECIPE_SIMILARITY_METRIC ('jaccard' or 'cosine')"""
+    shared = len(features & other)
+    if not shared:
+        return 0.0
+    if settings.RECIPE_SIMILARITY_METRIC == 'cosine':
+        return shared / sqrt(len(features) * len(other))
+    return shared / (len(features) + len(other) - shared)
+
+
+def nearest(vectors, recipe_ids):
+    """Yield (recipe id, [(similar id, score)]) for recipe_ids
+
+    vectors has to hold every recipe sharing a feature with one of
+    recipe_ids. Neighbours are the RECIPE_SIMILARITY_TOP_K most similar
+    recipes sharing at least one tag or ingredient, best first.
+    """
+    index = defaultdict(set)
+    for recipe_id, features in vectors.items():
+        for feature in features:
+            index[feature].add(recipe_id)
+
+    for recipe_id in recipe_ids:
+        features = vectors.get(recipe_id, set())
+        candidates = set()
+        for feature in features:
+            candidates.update(index[feature])
+        candidates.discard(recipe_id)
+        yield recipe_id, heapq.nsmallest(
+            settings.RECIPE_SIMILARITY_TOP_K,
+            (
+                (candidate, similarity(features, vectors[candidate]))
+                for candidate in candidates
+            ),
+            key=lambda neighbour: (-neighbour[1], neighbour[0])
+        )
+
+
+def _replace_neighbours(results, using):
+    """Store the neighbour lists of recipes, replacing their old ones"""
+    results = list(results)
+    with transaction.atomic(using=using):
+        RecipeSimilarity.objects.using(using).filter(
+            recipe__in=[recipe_id for recipe_id, _ in results]).delete()
+        RecipeSimilarity.objects.using(using).bulk_create(
+            [
+                RecipeSimilarity(
+                    recipe_id=recipe_id, similar_id=similar_id, score=score)
+                for recipe_id, neighbours in results
+                for similar_id, score in neighbours
+            ],
+            batch_size=1000
+        )
+
+
+def _store(results, using):
+    """Store neighbour lists RECIPE_SIMILARITY_BATCH_SIZE at a time"""
+    batch = []
+    for result in results:
+        batch.append(result)
+        if len(batch) >= settings.RECIPE_SIMILARITY_BATCH_SIZE:
+            _replace_neighbours(batch, using)
+            batch = []
+    if batch:
+        _replace_neighbours(batch, using)
+
+
+def rebuild_user(user_id, using=None):
+    """Recompute the neighbours of every recipe of a user"""
+    vectors = feature_sets(user_id, using)
+    recipe_ids = Recipe.objects.using(using).filter(user_id=user_id).\
+        order_by('id').values_list('id', flat=True)
+    _store(nearest(vectors, list(recipe_ids)), using)
+
+
+def update_recipes(user_id, changed_ids, using=None):
+    """Refresh neighbour lists after the vectors of changed_ids changed
+
+    Besides the changed recipes, only recipes that listed one of them or
+    now score one of them above their current last neighbour are
+    recomputed, and only the vectors of recipes sharing a feature with
+    those are loaded.
+    """
+    changed = feature_sets(user_id, using, recipes=changed_ids)
+    affected = set(
+        Recipe.objects.using(using).
+        filter(user_id=user_id, pk__in=changed_ids).
+        values_list('id', flat=True)
+    )
+    affected.update(
+        RecipeSimilarity.objects.using(using).
+        filter(similar__in=changed_ids).
+        values_list('recipe_id', flat=True)
+    )
+
+    features = set().union(*changed.values())
+    if features:
+        candidates = {}
+        neighbours = feature_sets(user_id, using, features=features)
+        for recipe_id, vector in neighbours.items():
+            if recipe_id not in changed:
+                candidates[recipe_id] = max(
+                    similarity(vector, other) for other in changed.values())
+        lists = RecipeSimilarity.objects.using(using).\
+            filter(recipe__in=list(candidates)).\
+            values('recipe_id').\
+            annotate(lowest=Min('score'), length=Count('id'))
+        full = {
+            entry['recipe_id']: entry['lowest'] for entry in lists
+            if entry['length'] >= settings.RECIPE_SIMILARITY_TOP_K
+        }
+        affected.update(
+            recipe_id for recipe_id, score in candidates.items()
+            if score > full.get(recipe_id, 0)
+        )
+
+    vectors = feature_sets(user_id, using, recipes=affected)
+    features = set().union(*vectors.values())
+    if features:
+        vectors.update(feature_sets(user_id, using, features=features))
+    _store(nearest(vectors, sorted(affected)), using)
+
+
+def _queue_update(user_id, recipe_ids):
+    with transaction.atomic():
+        job = Job.objects.select_for_update().filter(
+            kind=UPDATE_JOB, user_id=user_id, status=Job.QUEUED).first()
+        if job is not None:
+            recipe_ids = set(recipe_ids).union(job.payload['recipes'])
+            job.payload_json = json.dumps({'recipes': sorted(recipe_ids)})
+            job.save(update_fields=['payload_json', 'updated_at'])
+            return
+
+        enqueue(
+            UPDATE_JOB,
+            {'recipes': sorted(set(recipe_ids))},
+            user=get_user_model()(pk=user_id),
+            delay=settings.RECIPE_SIMILARITY_DELAY
+        )
+
+
+def schedule_update(user_id, recipe_ids, using=None):
+    """Queue a refresh of the neighbours of recipe_ids once the current
+    transaction commits
+
+    The recipes join the user's update still waiting in the queue, if
+    any, so the tags and ingredients set by one request, or a burst of
+    edits, are scored by one job RECIPE_SIMILARITY_DELAY seconds later.
+    """
+    transaction.on_commit(
+        lambda: _queue_update(user_id, recipe_ids), using=using)
@@ -0,0 +1,87 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, \
+    Sum
+from django.db.models.functions import Coalesce
+
+from core.models import Ingredient, Recipe, RecipeStats, Tag
+
+
+def to_decimal(value):
+    return value if isinstance(value, Decimal) else Decimal(str(value))
+
+
+def bump_recipe_stats(user_id, using, count=0, time_minutes=0, price=0):
+    """Add to a user's recipe rollup, creating it on first use"""
+    stats = RecipeStats.objects.using(using).filter(user_id=user_id)
+    changes = {
+        'recipe_count': count,
+        'time_minutes_sum': time_minutes,
+        'price_sum': to_decimal(price),
+    }
+    increments = {
+        field: F(field) + value for field, value in changes.items()}
+    if stats.update(**increments):
+        return
+
+    try:
+        with transaction.atomic(using=using):
+            RecipeStats.objects.using(using).create(user_id=user_id, **changes)
+    except IntegrityError:
+        # Created concurrently
+        stats.update(**increments)
+
+
+def bump_usage(model, changes, using):
+    """Apply {object id: delta} to the recipe counts of tags or
+    ingredients, with one UPDATE per distinct delta"""
+    by_delta = defaultdict(list)
+    for pk, delta in changes.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        model.objects.using(using).filter(pk__in=pks).\
+            update(recipe_count=F('recipe_count') + delta)
+
+
+def rebuild_user_stats(user_id, using=None):
+    """Recompute a user's recipe rollup from their recipes"""
+    totals = Recipe.objects.using(using).filter(user_id=user_id).aggregate(
+        recipe_count=Count('id'),
+        time_minutes_sum=Coalesce(Sum('time_minutes'), 0),
+        price_sum=Coalesce(Sum('price'), Decimal(0)),
+    )
+    RecipeStats.objects.using(using).update_or_create(
+        user_id=user_id, defaults=totals)
+
+
+def rebuild_usage(model, using=None, **filters):
+    """Recompute the recipe counts of tags or ingredients with one UPDATE"""
+    field = Recipe._meta.get_field(model._meta.model_name + 's')
+    through = field.remote_field.through
+    counts = through.objects.\
+        filter(**{field.m2m_reverse_field_name(): OuterRef('pk')}).\
+        filter(recipe__deleted_at__isnull=True).\
+        order_by().\
+        values(field.m2m_reverse_field_name()).\
+        annotate(count=Count('id')).\
+        values('count')
+    model.objects.using(using).filter(**filters).update(
+        recipe_count=Coalesce(
+            Subquery(counts, output_field=IntegerField()), 0)
+    )
+
+
+def rebuild_all(using=None):
+    """Recompute every rollup on a database"""
+    user_ids = set(Recipe.objects.using(using).
+                   values_list('user_id', flat=True).distinct())
+    user_ids.update(RecipeStats.objects.using(using).
+                    values_list('user_id', flat=True))
+    for user_id in user_ids:
+        rebuild_user_stats(user_id, using)
+    for model in (Tag, Ingredient):
+        rebuild_usage(model, using)
+    return len(user_ids)
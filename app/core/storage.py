@@ -0,0 +1,28 @@
+import hashlib
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+def file_digest(file):
+    """Return the hex SHA-256 digest of a django File's content"""
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage for files named after a hash of their content
+
+    Two files with the same name are known to have the same content, so
+    saving a name that already exists reuses the stored file.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is not None and self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
@@ -0,0 +1,11 @@
+from unittest import skipUnless
+
+from django.conf import settings
+
+
+# Tests keeping rows on two databases use the `secondary` test database,
+# defined when DB_TEST_SECONDARY=1
+requires_secondary_db = skipUnless(
+    'secondary' in settings.DATABASES,
+    'needs the secondary test database (DB_TEST_SECONDARY=1)'
+)
@@ -1,7 +1,12 @@
-from django.test import TestCase, Client
+from unittest.mock import patch
+
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
+from core.admin import EstimatedCountPaginator
+from core.models import Recipe, Tag
+
 
 class AdminSiteTest(TestCase):
 
@@ -39,3 +44,86 @@ class AdminSiteTest(TestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, 200)
+
+    def create_recipes(self, count):
+        for i in range(count):
+            recipe = Recipe.objects.create(
+                user=self.user,
+                title=f'recipe {i}',
+                time_minutes=10,
+                price=5.00
+            )
+            recipe.tags.add(
+                Tag.objects.get_or_create(user=self.user, name=f'{i}')[0])
+
+    def test_recipe_changelist_constant_queries(self):
+        """Test that the recipe changelist doesn't query users per row"""
+        url = reverse('admin:core_recipe_changelist')
+        self.create_recipes(2)
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+        self.create_recipes(10)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+
+        self.assertContains(response, self.user.email)
+
+    def test_recipe_change_page(self):
+        """Test that the recipe edit page uses autocomplete widgets"""
+        self.create_recipes(1)
+        url = reverse(
+            'admin:core_recipe_change', args=[Recipe.objects.get().id])
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'admin-autocomplete')
+
+    def test_tag_search(self):
+        """Test that tags can be searched by name prefix"""
+        self.create_recipes(2)
+        url = reverse('admin:core_tag_changelist')
+        response = self.client.get(url, {'q': '1'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_recipe_search(self):
+        """Test that recipes are searched by title prefix or owner email"""
+        self.create_recipes(2)
+        Recipe.objects.create(
+            user=self.admin_user, title='soup', time_minutes=5, price=1)
+        url = reverse('admin:core_recipe_changelist')
+
+        for term, count in (('RECIPE', 2), ('ecipe', 0), ('soup', 1),
+                            ('Regular@Example.com', 2)):
+            response = self.client.get(url, {'q': term})
+            self.assertEqual(response.context['cl'].result_count, count)
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=1000)
+    def test_paginator_uses_estimate_for_large_tables(self):
+        """Test that unfiltered counts of huge tables are estimated"""
+        recipes = Recipe.objects.order_by('id')
+        with patch.object(EstimatedCountPaginator, '_estimated_count',
+                          return_value=5000000):
+            paginator = EstimatedCountPaginator(recipes, 100)
+            self.assertEqual(paginator.count, 5000000)
+
+        with patch.object(EstimatedCountPaginator, '_estimated_count',
+                          return_value=10):
+            paginator = EstimatedCountPaginator(recipes, 100)
+            self.assertEqual(paginator.count, 0)
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=1000)
+    @patch('core.admin.estimated_rows', return_value=5000000)
+    def test_changelist_uses_estimate_unfiltered(self, estimated_rows):
+        """Test that only unfiltered changelists show the estimate"""
+        self.create_recipes(2)
+        url = reverse('admin:core_recipe_changelist')
+
+        response = self.client.get(url, {'o': '1', 'p': '0'})
+        self.assertEqual(response.context['cl'].result_count, 5000000)
+
+        for params in ({'q': 'recipe 1'}, {'has_image': 'no'}):
+            response = self.client.get(url, params)
+            self.assertLess(response.context['cl'].result_count, 3)
@@ -1,9 +1,24 @@
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
 from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
 from django.core.management import call_command
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.db.utils import OperationalError
 
+from core.management.commands.check_queries import duplicate_joins, \
+    duplicate_rows, postgresql_plan, query_shape, sqlite_plan
+from core.management.commands.purge_deleted import purge_window_end
+from core.management.commands.startup_report import parse_importtime
+from core.models import Recipe, RecipeStats, Tag
+from core.tests import requires_secondary_db
+
 
 class CommandTests(TestCase):
 
@@ -21,3 +36,234 @@ class CommandTests(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+
+class CompactMediaCommandTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.storage = Recipe._meta.get_field('image').storage
+        self.recipe = Recipe.objects.create(
+            user=get_user_model().objects.create_user(
+                'testemail@example.com', 'testpass'),
+            title='sample title',
+            time_minutes=10,
+            price=10.00
+        )
+
+    def test_compact_media_renames_and_deletes_orphans(self):
+        """Test that legacy names are hashed and orphans removed"""
+        legacy = self.storage.save(
+            'uploads/recipe/legacy.jpg', ContentFile(b'content'))
+        orphan = self.storage.save(
+            'uploads/recipe/orphan.jpg', ContentFile(b'orphan'))
+        Recipe.objects.filter(pk=self.recipe.pk).update(image=legacy)
+
+        call_command('compact_media', stdout=StringIO())
+
+        self.recipe.refresh_from_db()
+        self.assertNotEqual(self.recipe.image.name, legacy)
+        self.assertTrue(self.storage.exists(self.recipe.image.name))
+        self.assertFalse(self.storage.exists(legacy))
+        self.assertFalse(self.storage.exists(orphan))
+
+    def test_compact_media_dry_run(self):
+        """Test that a dry run leaves files and recipes untouched"""
+        orphan = self.storage.save(
+            'uploads/recipe/orphan.jpg', ContentFile(b'orphan'))
+
+        call_command(
+            'compact_media', dry_run=True, stdout=StringIO())
+
+        self.assertTrue(self.storage.exists(orphan))
+
+
+class MergeRecipeAttributesCommandTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+
+    def test_merge_moves_links_and_deletes_duplicates(self):
+        """Test that duplicates are merged into the oldest tag"""
+        salt = Tag.objects.create(user=self.user, name='Salt')
+        duplicate = Tag.objects.create(user=self.user, name='SALT!')
+        # Stored under a key from an older normalization
+        Tag.objects.filter(pk=duplicate.pk).update(
+            name='SALT ', normalized_name='SALT ')
+        recipe1 = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=3)
+        recipe2 = Recipe.objects.create(
+            user=self.user, title='Stew', time_minutes=5, price=3)
+        recipe1.tags.add(salt, duplicate)
+        recipe2.tags.add(duplicate)
+
+        call_command('merge_recipe_attributes', stdout=StringIO())
+
+        self.assertEqual(list(Tag.objects.all()), [salt])
+        self.assertEqual(list(recipe1.tags.all()), [salt])
+        self.assertEqual(list(recipe2.tags.all()), [salt])
+
+    def test_merge_dry_run(self):
+        """Test that a dry run changes nothing"""
+        Tag.objects.create(user=self.user, name='Salt')
+        duplicate = Tag.objects.create(user=self.user, name='salt!')
+        Tag.objects.filter(pk=duplicate.pk).update(name='salt')
+
+        out = StringIO()
+        call_command('merge_recipe_attributes', '--dry-run', stdout=out)
+
+        self.assertEqual(Tag.objects.count(), 2)
+        self.assertIn('tags: 1 duplicates found', out.getvalue())
+
+
+class RebuildRecipeStatsCommandTests(TestCase):
+
+    def test_rebuild_recipe_stats(self):
+        """Test that drifted rollups are recomputed"""
+        user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+        tag = Tag.objects.create(user=user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=3)
+        recipe.tags.add(tag)
+        RecipeStats.objects.filter(user=user).update(recipe_count=7)
+        Tag.objects.update(recipe_count=7)
+
+        call_command('rebuild_recipe_stats', stdout=StringIO())
+
+        stats = RecipeStats.objects.get(user=user)
+        self.assertEqual(
+            (stats.recipe_count, stats.time_minutes_sum, stats.price_sum),
+            (1, 5, 3)
+        )
+        tag.refresh_from_db()
+        self.assertEqual(tag.recipe_count, 1)
+
+
+class PurgeDeletedCommandTests(TestCase):
+
+    @override_settings(SOFT_DELETE_PURGE_HOURS=(23, 3))
+    def test_purge_window_end(self):
+        """Test the end of purge windows, also across midnight"""
+        now = timezone.localtime().replace(
+            hour=23, minute=30, second=0, microsecond=0)
+
+        self.assertEqual(
+            purge_window_end(now),
+            now.replace(hour=3, minute=0) + timedelta(days=1))
+        self.assertEqual(
+            purge_window_end(now.replace(hour=1)),
+            now.replace(hour=3, minute=0))
+        self.assertIsNone(purge_window_end(now.replace(hour=3)))
+
+    @override_settings(SOFT_DELETE_RETENTION=0)
+    def test_purge_deleted(self):
+        """Test that --now purges regardless of the window"""
+        user = get_user_model().objects.create_user(
+            'test@example.com', 'testpass')
+        Tag.objects.create(user=user, name='Vegan').soft_delete()
+
+        call_command('purge_deleted', now=True, stdout=StringIO())
+
+        self.assertFalse(Tag.all_objects.exists())
+
+
+class CheckQueriesCommandTests(TestCase):
+
+    def test_check_queries(self):
+        """Test that the API's GET endpoints are reported unflagged and
+        the seeded rows rolled back"""
+        out = StringIO()
+        call_command('check_queries', recipes=4, relations=2, stdout=out)
+
+        report = json.loads(out.getvalue())
+        names = {endpoint['name'] for endpoint in report['endpoints']}
+        self.assertTrue(
+            {'recipe:recipe-list', 'recipe:tag-list', 'core:job-detail'} <=
+            names)
+        for endpoint in report['endpoints']:
+            self.assertLess(endpoint['status'], 500, endpoint['name'])
+            self.assertNotIn('duplicate_rows', endpoint['flags'])
+            self.assertNotIn('per_row_query', endpoint['flags'])
+        self.assertFalse(get_user_model().objects.exists())
+
+    def test_flags(self):
+        """Test the detection of plan and statement problems"""
+        self.assertEqual(
+            query_shape('SELECT 1 WHERE id IN (%s, %s, %s)'),
+            'SELECT 1 WHERE id IN (%s, ...)')
+        self.assertEqual(
+            duplicate_joins(
+                'SELECT 1 FROM "a" INNER JOIN "b" ON x LEFT OUTER JOIN '
+                '"b" T3 ON y'),
+            ['b'])
+        self.assertTrue(duplicate_rows([{'id': 1}, {'id': 1}]))
+        self.assertFalse(duplicate_rows({'recipes': [{'id': 1}]}))
+        self.assertEqual(
+            sqlite_plan([
+                'SCAN core_tag',
+                'SCAN core_recipe USING INDEX recipe_user_alive_idx',
+                'USE TEMP B-TREE FOR ORDER BY',
+            ])[1],
+            ['seq_scan core_tag', 'temp_sort'])
+        self.assertEqual(
+            postgresql_plan({
+                'Node Type': 'Sort',
+                'Sort Space Type': 'Disk',
+                'Plans': [
+                    {'Node Type': 'Seq Scan', 'Relation Name': 'core_tag'},
+                ],
+            }),
+            (['Sort', 'Seq Scan on core_tag'],
+             ['sort_spill', 'seq_scan core_tag'])
+        )
+
+
+class StartupCommandTests(TestCase):
+
+    @patch('core.management.commands.migrate_if_needed.call_command')
+    def test_migrate_if_needed_skips_applied(self, call):
+        """Test that migrate isn't run when every migration is applied"""
+        out = StringIO()
+        call_command('migrate_if_needed', stdout=out)
+
+        call.assert_not_called()
+        self.assertIn('default: no migrations to apply', out.getvalue())
+
+    def test_parse_importtime(self):
+        """Test parsing the output of python -X importtime"""
+        lines = [
+            'import time: self [us] | cumulative | imported package',
+            'import time:       120 |        120 |   core.storage',
+            'import time:       300 |        420 | core.models',
+        ]
+
+        self.assertEqual(parse_importtime(lines), [
+            ('core.storage', 120, 120, 1),
+            ('core.models', 300, 420, 0),
+        ])
+
+
+@requires_secondary_db
+class MigrateShardsCommandTests(TestCase):
+    databases = {'default', 'secondary'}
+
+    @patch('core.management.commands.migrate_if_needed.call_command')
+    @patch('django.db.migrations.recorder.MigrationRecorder.'
+           'applied_migrations', return_value=set())
+    def test_migrate_if_needed_runs_migrate(self, applied, call):
+        """Test that migrate runs when a migration isn't applied"""
+        with self.settings(SHARD_DATABASES=['secondary']):
+            call_command('migrate_if_needed', stdout=StringIO())
+
+        self.assertEqual(
+            [(args, kwargs['database'])
+             for args, kwargs in call.call_args_list],
+            [(('migrate',), 'default'), (('migrate',), 'secondary')]
+        )
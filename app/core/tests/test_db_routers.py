@@ -0,0 +1,89 @@
+from django.contrib.auth import get_user_model
+from django.db import router
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.db_routers import set_read_replica
+from core.models import Recipe
+from core.tests import requires_secondary_db
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def create_recipe(user, title, using='default'):
+    return Recipe.objects.using(using).create(
+        user=user, title=title, time_minutes=5, price=1)
+
+
+@requires_secondary_db
+@override_settings(DATABASE_REPLICAS=['secondary'])
+class ReplicaTestCase(TestCase):
+    """The secondary test database plays a replica lagging behind: rows
+    written to the primary never reach it"""
+    databases = {'default', 'secondary'}
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+        self.user.save(using='secondary')
+        create_recipe(self.user, 'primary')
+        create_recipe(self.user, 'replica', using='secondary')
+
+    def tearDown(self):
+        set_read_replica(False)
+
+
+class ReplicaRouterTests(ReplicaTestCase):
+
+    def titles(self):
+        return list(Recipe.objects.values_list('title', flat=True))
+
+    def test_reads_use_primary_by_default(self):
+        """Test that reads go to the primary outside replica requests"""
+        self.assertEqual(self.titles(), ['primary'])
+
+    def test_reads_use_replica_when_enabled(self):
+        """Test that reads go to a replica when enabled"""
+        set_read_replica(True)
+
+        self.assertEqual(self.titles(), ['replica'])
+
+    def test_writes_use_primary(self):
+        """Test that writes always go to the primary"""
+        set_read_replica(True)
+
+        recipe = create_recipe(self.user, 'new', using=None)
+
+        self.assertEqual(router.db_for_write(Recipe), 'default')
+        self.assertTrue(Recipe.objects.using('default').filter(
+            pk=recipe.pk).exists())
+
+
+class ReplicaReadViewTests(ReplicaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def titles(self):
+        response = self.client.get(RECIPES_URL)
+        return sorted(recipe['title'] for recipe in response.data)
+
+    def test_safe_request_reads_replica(self):
+        """Test that a list is read from a replica"""
+        self.assertEqual(self.titles(), ['replica'])
+
+    def test_write_pins_client_to_primary(self):
+        """Test that a list following a create reads the primary"""
+        response = self.client.post(
+            RECIPES_URL, {'title': 'new', 'time_minutes': 5, 'price': 1})
+        self.assertIn('replica_pin', response.cookies)
+
+        self.assertEqual(self.titles(), ['new', 'primary'])
+
+        self.client.cookies.clear()
+        self.assertEqual(self.titles(), ['replica'])
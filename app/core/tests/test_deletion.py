@@ -0,0 +1,152 @@
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.deletion import purge_deleted, purge_user
+from core.models import ChangeLog, Ingredient, Recipe, RecipeSimilarity, \
+    RecipeStats, Tag
+from core.sharding import copy_user
+from core.similarity import rebuild_user
+from core.tests import requires_secondary_db
+
+
+def create_recipe(user, title, image=''):
+    recipe = Recipe.objects.create(
+        user=user, title=title, time_minutes=5, price=1.00, image=image)
+    recipe.tags.add(Tag.objects.get_or_create(user=user, name='Vegan')[0])
+    recipe.ingredients.add(
+        Ingredient.objects.get_or_create(user=user, name='Salt')[0])
+    return recipe
+
+
+class PurgeUserTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.storage = Recipe._meta.get_field('image').storage
+
+        self.user = get_user_model().objects.create_user(
+            'test@example.com', 'testpass')
+        self.other = get_user_model().objects.create_user(
+            'other@example.com', 'testpass')
+
+    def test_purge_user(self):
+        """Test that the user, their rows and unshared images are deleted"""
+        own = self.storage.save('uploads/recipe/own.jpg', ContentFile(b'a'))
+        shared = self.storage.save(
+            'uploads/recipe/shared.jpg', ContentFile(b'b'))
+        for i in range(5):
+            create_recipe(self.user, f'recipe {i}', own)
+        create_recipe(self.user, 'shared', shared)
+        kept = create_recipe(self.other, 'kept', shared)
+        rebuild_user(self.user.pk)
+        self.assertTrue(RecipeSimilarity.objects.exists())
+
+        counts = []
+        purge_user(
+            self.user.pk,
+            batch_size=2,
+            progress=lambda **changes: counts.append(changes)
+        )
+
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists())
+        for model in (Recipe, Tag, Ingredient, RecipeStats, ChangeLog):
+            self.assertFalse(
+                model.objects.filter(user=self.user.pk).exists())
+        self.assertFalse(RecipeSimilarity.objects.exists())
+        self.assertFalse(self.storage.exists(own))
+        self.assertTrue(self.storage.exists(shared))
+        self.assertEqual(list(kept.tags.all()), [Tag.objects.get()])
+        self.assertEqual(
+            sum(change.get('recipes', 0) for change in counts), 6)
+        self.assertEqual(
+            sum(change.get('images', 0) for change in counts), 1)
+
+    def test_purge_user_soft_deleted(self):
+        """Test that soft-deleted rows go with the account"""
+        create_recipe(self.user, 'deleted').soft_delete()
+        Tag.objects.get().soft_delete()
+
+        purge_user(self.user.pk)
+
+        for model in (Recipe, Tag, Ingredient):
+            self.assertFalse(model.all_objects.exists())
+
+
+@requires_secondary_db
+@override_settings(SHARD_DATABASES=['secondary'])
+class PurgeShardedUserTests(TestCase):
+    databases = {'default', 'secondary'}
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@example.com', 'testpass')
+
+    def test_purge_user_on_shard(self):
+        """Test that the rows and user copy on a shard are deleted"""
+        copy_user(self.user.pk, 'secondary')
+        Tag.objects.using('secondary').create(user=self.user, name='Vegan')
+
+        purge_user(self.user.pk)
+
+        for alias in ('default', 'secondary'):
+            self.assertFalse(get_user_model().objects.using(alias).filter(
+                pk=self.user.pk).exists())
+        self.assertFalse(Tag.all_objects.using('secondary').exists())
+
+
+class PurgeDeletedTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@example.com', 'testpass')
+
+    def test_purge_deleted(self):
+        """Test that rows soft-deleted before the cutoff are deleted for
+        good with their links"""
+        deleted = create_recipe(self.user, 'deleted')
+        recent = create_recipe(self.user, 'recent')
+        kept = create_recipe(self.user, 'kept')
+        rebuild_user(self.user.pk)
+        deleted.soft_delete()
+        tag = Tag.objects.get()
+        tag.soft_delete()
+        cutoff = timezone.now()
+        recent.soft_delete()
+
+        counts = []
+        self.assertTrue(purge_deleted(
+            cutoff,
+            batch_size=1,
+            progress=lambda **changes: counts.append(changes)
+        ))
+
+        self.assertEqual(
+            set(Recipe.all_objects.values_list('title', flat=True)),
+            {'recent', 'kept'}
+        )
+        self.assertFalse(Tag.all_objects.exists())
+        self.assertFalse(
+            Recipe.tags.through.objects.filter(recipe=deleted.pk).exists())
+        self.assertFalse(kept.tags.exists())
+        self.assertFalse(
+            RecipeSimilarity.objects.filter(similar=deleted.pk).exists())
+        self.assertEqual(
+            sum(change.get('recipes', 0) for change in counts), 1)
+
+    def test_purge_deleted_stops_at_until(self):
+        """Test that no batch is started once until has passed"""
+        create_recipe(self.user, 'deleted').soft_delete()
+
+        self.assertFalse(purge_deleted(
+            timezone.now(), until=timezone.now()))
+        self.assertTrue(Recipe.all_objects.exists())
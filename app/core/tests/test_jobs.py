@@ -0,0 +1,145 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import jobs
+from core.models import Job
+
+
+calls = []
+
+
+@jobs.register('test.echo')
+def echo(job):
+    calls.append(job.payload)
+    return {'echo': job.payload['value']}
+
+
+@jobs.register('test.flaky')
+def flaky(job):
+    if job.attempts < 2:
+        raise RuntimeError('try again')
+    return {'attempts': job.attempts}
+
+
+@jobs.register('test.broken')
+def broken(job):
+    raise jobs.PermanentJobError('never works')
+
+
+def run_jobs():
+    call_command('run_jobs', once=True, stdout=StringIO())
+
+
+def make_due(job):
+    Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+
+
+class JobTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_run_queued_job(self):
+        """Test that workers run due jobs and store their results"""
+        job = jobs.enqueue('test.echo', {'value': 1})
+        later = jobs.enqueue('test.echo', {'value': 2}, delay=60)
+        run_jobs()
+
+        job.refresh_from_db()
+        later.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, {'echo': 1})
+        self.assertEqual(later.status, Job.QUEUED)
+        self.assertEqual(calls, [{'value': 1}])
+
+    @override_settings(JOB_RETRY_DELAY=10)
+    def test_retry_with_backoff(self):
+        """Test that failed jobs are retried later until they succeed"""
+        job = jobs.enqueue('test.flaky')
+        run_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('try again', job.error)
+        self.assertGreater(
+            job.run_after, timezone.now() + timedelta(seconds=5))
+
+        make_due(job)
+        run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, {'attempts': 2})
+
+    def test_give_up_after_max_attempts(self):
+        """Test that jobs fail for good after their last attempt"""
+        job = jobs.enqueue('test.flaky', max_attempts=1)
+        run_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+
+    def test_permanent_error_not_retried(self):
+        """Test that permanent errors fail a job on its first attempt"""
+        job = jobs.enqueue('test.broken')
+        run_jobs()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 1)
+
+    @override_settings(JOB_TIMEOUT=60)
+    def test_requeue_stale(self):
+        """Test that jobs of dead workers are queued again"""
+        job = jobs.enqueue('test.echo', {'value': 1})
+        Job.objects.filter(pk=job.pk).update(
+            status=Job.RUNNING,
+            locked_at=timezone.now() - timedelta(minutes=5)
+        )
+        self.assertEqual(jobs.requeue_stale(), 1)
+
+        run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+
+
+class JobApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@example.com', 'testpass')
+
+    def test_login_required(self):
+        """Test that job status requires authentication"""
+        job = jobs.enqueue('test.echo', {'value': 1}, user=self.user)
+        response = self.client.get(reverse('core:job-detail', args=[job.pk]))
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_job_status(self):
+        """Test retrieving the status of the user's own jobs only"""
+        job = jobs.enqueue('test.echo', {'value': 1}, user=self.user)
+        other = get_user_model().objects.create_user(
+            'other@example.com', 'testpass')
+        other_job = jobs.enqueue('test.echo', {'value': 2}, user=other)
+        self.client.force_authenticate(self.user)
+        run_jobs()
+
+        response = self.client.get(reverse('core:job-detail', args=[job.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], Job.SUCCEEDED)
+        self.assertEqual(response.data['result'], {'echo': 1})
+
+        response = self.client.get(
+            reverse('core:job-detail', args=[other_job.pk]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
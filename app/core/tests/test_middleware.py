@@ -0,0 +1,77 @@
+import gzip
+import json
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+
+from core.middleware import CompressionMiddleware, accepted_encodings
+
+
+LARGE_JSON = json.dumps([{'title': 'recipe title'}] * 200).encode()
+
+
+@override_settings(COMPRESSION_MIN_SIZE=1024)
+class CompressionMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = CompressionMiddleware()
+
+    def process(self, response, accept_encoding='gzip'):
+        request = self.factory.get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return self.middleware.process_response(request, response)
+
+    def test_large_json_compressed(self):
+        """Test that large JSON responses are gzipped"""
+        response = self.process(
+            HttpResponse(LARGE_JSON, content_type='application/json'))
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), LARGE_JSON)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_small_response_not_compressed(self):
+        """Test that responses below the threshold are left alone"""
+        response = self.process(HttpResponse(b'{}'))
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_image_not_compressed(self):
+        """Test that already compressed media is left alone"""
+        response = self.process(
+            HttpResponse(LARGE_JSON, content_type='image/jpeg'))
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_encoding_not_accepted(self):
+        """Test that nothing is compressed when gzip is refused"""
+        response = self.process(
+            HttpResponse(LARGE_JSON), accept_encoding='gzip;q=0, identity')
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_streaming_response_compressed(self):
+        """Test that streaming responses are compressed chunk by chunk"""
+        chunks = [LARGE_JSON[:100], LARGE_JSON[100:]]
+        response = self.process(StreamingHttpResponse(iter(chunks)))
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = b''.join(response.streaming_content)
+        self.assertEqual(gzip.decompress(content), LARGE_JSON)
+
+    def test_strong_etag_weakened(self):
+        """Test that the ETag of a compressed response becomes weak"""
+        response = HttpResponse(LARGE_JSON)
+        response['ETag'] = '"abc"'
+
+        response = self.process(response)
+
+        self.assertEqual(response['ETag'], 'W/"abc"')
+
+    def test_accepted_encodings(self):
+        """Test parsing of Accept-Encoding qvalues"""
+        self.assertEqual(
+            accepted_encodings('br;q=0.5, gzip, *;q=0'),
+            {'br': 0.5, 'gzip': 1.0, '*': 0.0}
+        )
@@ -1,5 +1,7 @@
+import hashlib
 from unittest.mock import patch
 
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 
@@ -83,3 +85,25 @@ class ModelTests(TestCase):
 
         expected_path = f'uploads/recipe/{uuid}.jpg'
         self.assertEqual(file_path, expected_path)
+
+    def test_recipe_file_name_content_hash(self):
+        """Test that uploaded images are named after their content"""
+        content = b'image content'
+        recipe = models.Recipe(image=SimpleUploadedFile('img.JPG', content))
+        file_path = models.recipe_image_file_path(recipe, 'img.JPG')
+
+        digest = hashlib.sha256(content).hexdigest()
+        expected_path = f'uploads/recipe/{digest[:2]}/{digest}.jpg'
+        self.assertEqual(file_path, expected_path)
+
+    def test_soft_delete_frees_name(self):
+        """Test that soft-deleted tags are hidden and their name reusable"""
+        user = sample_user()
+        tag = models.Tag.objects.create(user=user, name='Vegan')
+
+        tag.soft_delete()
+        models.Tag.objects.create(user=user, name='vegan')
+
+        self.assertEqual(models.Tag.objects.get().name, 'vegan')
+        self.assertIsNotNone(
+            models.Tag.all_objects.get(pk=tag.pk).deleted_at)
@@ -0,0 +1,34 @@
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+
+from core.models import Recipe, Tag
+from core.partitioning import PARTITIONED_TABLES, is_partitioned, \
+    rebuild_table
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQL only')
+class PartitioningTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+
+    def test_partitioned_tables_keep_rows(self):
+        """Test that partitioning keeps rows and the ORM still works"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Salad', time_minutes=5, price=3)
+        recipe.tags.add(tag)
+
+        for table, key in PARTITIONED_TABLES:
+            rebuild_table(connection, table, key, 4)
+
+        self.assertTrue(is_partitioned(connection, 'core_recipe'))
+        self.assertEqual(list(Recipe.objects.get(pk=recipe.pk).tags.all()),
+                         [tag])
+        created = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=3)
+        self.assertGreater(created.pk, recipe.pk)
@@ -0,0 +1,149 @@
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, UserShard
+from core.sharding import move_user, set_current_shard, shard_for_user
+from core.tests import requires_secondary_db
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+@override_settings(SHARD_DATABASES=['shard_a', 'shard_b'])
+class ShardRouterTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+
+    def tearDown(self):
+        set_current_shard(None)
+
+    def test_per_user_models_use_current_shard(self):
+        """Test that per-user models follow the request's shard"""
+        set_current_shard('shard_b')
+
+        self.assertEqual(router.db_for_read(Recipe), 'shard_b')
+        self.assertEqual(router.db_for_write(Tag), 'shard_b')
+        self.assertEqual(router.db_for_write(Recipe.tags.through), 'shard_b')
+
+    def test_users_stay_on_default(self):
+        """Test that the user table isn't sharded"""
+        set_current_shard('shard_b')
+
+        self.assertEqual(router.db_for_read(get_user_model()), 'default')
+
+    @patch('core.sharding.shard_entry', return_value=('shard_a', False))
+    def test_instance_hint_uses_owner_shard(self, shard_entry):
+        """Test that unsaved rows are written to their owner's shard"""
+        tag = Tag(user=self.user, name='Vegan')
+
+        self.assertEqual(router.db_for_write(Tag, instance=tag), 'shard_a')
+        shard_entry.assert_called_once_with(self.user.pk)
+
+
+@override_settings(SHARD_DATABASES=['default'])
+class ShardRoutingViewTests(TestCase):
+    """Test routing of API requests; the only shard is the default
+    database so the queries can run"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+        self.client.force_authenticate(self.user)
+
+    def test_first_request_assigns_shard(self):
+        """Test that a user is given a shard on first use"""
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(UserShard.objects.get(user=self.user).alias,
+                         'default')
+
+    def test_writes_refused_while_moving(self):
+        """Test that writes get 503 while the user's data moves"""
+        UserShard.objects.create(user=self.user, alias='default', moving=True)
+
+        res = self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(Tag.objects.exists())
+
+    def test_reads_allowed_while_moving(self):
+        """Test that reads are still served while the user's data moves"""
+        UserShard.objects.create(user=self.user, alias='default', moving=True)
+
+        res = self.client.get(TAGS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+
+@requires_secondary_db
+@override_settings(SHARD_DATABASES=['default', 'secondary'])
+class MoveUserTests(TestCase):
+    databases = {'default', 'secondary'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+
+    def tearDown(self):
+        set_current_shard(None)
+
+    def test_move_user(self):
+        """Test that a user's rows are moved with their links"""
+        source = shard_for_user(self.user.pk)
+        target = next(
+            alias for alias in settings.SHARD_DATABASES if alias != source)
+        set_current_shard(source)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Salad', time_minutes=5, price=3)
+        recipe.tags.add(tag)
+
+        move_user(self.user.pk, target, batch_size=1, settle=0)
+
+        self.assertEqual(shard_for_user(self.user.pk), target)
+        self.assertFalse(Recipe.objects.using(source).exists())
+        moved = Recipe.objects.using(target).get(pk=recipe.pk)
+        self.assertEqual(list(moved.tags.all()), [tag])
+
+
+@requires_secondary_db
+@override_settings(SHARD_DATABASES=['secondary'])
+class ShardAssignmentTests(TestCase):
+    databases = {'default', 'secondary'}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_existing_data_keeps_its_database(self):
+        """Test that users with rows from before sharding stay with them"""
+        user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+        with override_settings(SHARD_DATABASES=[]):
+            Tag.objects.create(user=user, name='Vegan')
+
+        self.assertEqual(shard_for_user(user.pk), 'default')
+
+    def test_new_user_assigned_shard(self):
+        """Test that users without rows are assigned a shard"""
+        user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+
+        self.assertEqual(shard_for_user(user.pk), 'secondary')
+        self.assertTrue(get_user_model().objects.using('secondary').filter(
+            pk=user.pk).exists())
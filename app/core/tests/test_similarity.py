@@ -0,0 +1,118 @@
+from math import sqrt
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TransactionTestCase, \
+    override_settings
+
+from core.jobs import claim, run
+from core.models import Ingredient, Job, Recipe, RecipeSimilarity, Tag
+from core.similarity import UPDATE_JOB, nearest
+
+
+class NearestTests(SimpleTestCase):
+
+    def setUp(self):
+        self.vectors = {
+            10: {0, 1},
+            11: {0, 1, 2},
+            12: {0},
+            13: {3},
+        }
+
+    def test_jaccard(self):
+        """Test that neighbours are ranked by Jaccard similarity"""
+        result = dict(nearest(self.vectors, [10, 13, 14]))
+
+        self.assertEqual([pk for pk, _ in result[10]], [11, 12])
+        self.assertAlmostEqual(result[10][0][1], 2 / 3)
+        self.assertAlmostEqual(result[10][1][1], 1 / 2)
+        self.assertEqual(result[13], [])
+        self.assertEqual(result[14], [])
+
+    @override_settings(RECIPE_SIMILARITY_METRIC='cosine',
+                       RECIPE_SIMILARITY_TOP_K=1)
+    def test_cosine_top_k(self):
+        """Test cosine similarity and the neighbour limit"""
+        result = dict(nearest(self.vectors, [12]))
+
+        self.assertEqual(len(result[12]), 1)
+        self.assertEqual(result[12][0][0], 10)
+        self.assertAlmostEqual(result[12][0][1], 1 / sqrt(2))
+
+
+@override_settings(RECIPE_SIMILARITY_DELAY=0)
+class SimilarityUpdateTests(TransactionTestCase):
+    """Updates are queued after commit, so these tests commit"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+        self.tags = [
+            Tag.objects.create(user=self.user, name=name)
+            for name in ('vegan', 'quick', 'soup')
+        ]
+
+    def create_recipe(self, title, tags):
+        recipe = Recipe.objects.create(
+            user=self.user, title=title, time_minutes=5, price=3)
+        recipe.tags.set(tags)
+        return recipe
+
+    def neighbours(self, recipe):
+        job = claim('test')
+        while job is not None:
+            run(job)
+            job = claim('test')
+        return list(
+            RecipeSimilarity.objects.filter(recipe=recipe).
+            order_by('-score').
+            values_list('similar_id', flat=True)
+        )
+
+    def test_adding_tags_updates_neighbours(self):
+        """Test that both recipes sharing a tag list each other"""
+        recipe1 = self.create_recipe('Salad', self.tags[:2])
+        recipe2 = self.create_recipe('Soup', self.tags[2:])
+
+        self.assertEqual(self.neighbours(recipe1), [])
+
+        recipe2.tags.add(self.tags[0])
+
+        self.assertEqual(self.neighbours(recipe1), [recipe2.id])
+        self.assertEqual(self.neighbours(recipe2), [recipe1.id])
+
+    def test_removing_tag_from_recipes(self):
+        """Test that changes made from the tag side are picked up"""
+        recipe1 = self.create_recipe('Salad', self.tags[:1])
+        recipe2 = self.create_recipe('Soup', self.tags[:1])
+
+        self.tags[0].recipe_set.clear()
+
+        self.assertEqual(self.neighbours(recipe1), [])
+        self.assertEqual(self.neighbours(recipe2), [])
+
+    @override_settings(RECIPE_SIMILARITY_TOP_K=1)
+    def test_deleting_recipe_refills_neighbours(self):
+        """Test that a list losing a deleted recipe gets the next best"""
+        recipe1 = self.create_recipe('Salad', self.tags[:2])
+        recipe2 = self.create_recipe('Wrap', self.tags[:2])
+        recipe3 = self.create_recipe('Soup', self.tags[:1])
+
+        self.assertEqual(self.neighbours(recipe1), [recipe2.id])
+
+        recipe2.delete()
+
+        self.assertEqual(self.neighbours(recipe1), [recipe3.id])
+
+    def test_one_job_per_change(self):
+        """Test that setting tags and ingredients queues one update"""
+        salt = Ingredient.objects.create(user=self.user, name='salt')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Salad', time_minutes=5, price=3)
+
+        recipe.tags.set(self.tags[:2])
+        recipe.ingredients.set([salt])
+
+        job = Job.objects.get(kind=UPDATE_JOB)
+        self.assertEqual(job.user, self.user)
+        self.assertEqual(job.payload, {'recipes': [recipe.id]})
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from core.models import Recipe, StoredImage
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def create_recipe(user, **params):
+    defaults = {
+        'title': 'sample title',
+        'time_minutes': 10,
+        'price': 10.00
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class ContentAddressedImageTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+
+    def tearDown(self):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def upload(self, recipe, content=b'image content', name='image.jpg'):
+        recipe.image = SimpleUploadedFile(name, content)
+        recipe.save()
+        return recipe.image.name
+
+    def test_identical_uploads_share_file(self):
+        """Test that the same content uploaded twice is stored once"""
+        name1 = self.upload(create_recipe(self.user))
+        name2 = self.upload(create_recipe(self.user))
+
+        self.assertEqual(name1, name2)
+        directory = os.path.dirname(os.path.join(MEDIA_ROOT, name1))
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+    def test_replaced_image_deleted(self):
+        """Test that a replaced image without references is deleted"""
+        recipe = create_recipe(self.user)
+        old_name = self.upload(recipe, b'old content')
+        self.upload(recipe, b'new content')
+
+        self.assertFalse(recipe.image.storage.exists(old_name))
+        self.assertTrue(recipe.image.storage.exists(recipe.image.name))
+
+    def test_shared_image_kept_until_unreferenced(self):
+        """Test that an image is kept while another recipe uses it"""
+        recipe1 = create_recipe(self.user)
+        recipe2 = create_recipe(self.user)
+        name = self.upload(recipe1)
+        self.upload(recipe2)
+        storage = recipe1.image.storage
+
+        recipe1.delete()
+        self.assertTrue(storage.exists(name))
+
+        recipe2.delete()
+        self.assertFalse(storage.exists(name))
+
+    def test_deferred_image_released(self):
+        """Test that replacing an image loaded as deferred releases it"""
+        recipe = create_recipe(self.user)
+        old_name = self.upload(recipe, b'old content')
+
+        recipe = Recipe.objects.only('id').get(pk=recipe.pk)
+        recipe.image.save('new.jpg', ContentFile(b'new content'))
+
+        self.assertFalse(recipe.image.storage.exists(old_name))
+
+    def test_image_released_during_upload_stored_again(self):
+        """Test that an upload reusing a file that a concurrent release
+        deletes before the upload commits stores the file again"""
+        recipe1 = create_recipe(self.user)
+        name = self.upload(recipe1)
+        storage = recipe1.image.storage
+
+        recipe2 = create_recipe(self.user)
+        with transaction.atomic():
+            self.assertEqual(self.upload(recipe2), name)
+            # A release that checked the references before this commit
+            recipe1.delete()
+            storage.delete(name)
+
+        self.assertTrue(storage.exists(name))
+        with storage.open(name) as stored:
+            self.assertEqual(stored.read(), b'image content')
+
+    def test_released_image_lock_removed(self):
+        """Test that deleting an unreferenced image drops its lock row"""
+        recipe = create_recipe(self.user)
+        name = self.upload(recipe)
+        self.assertTrue(StoredImage.objects.filter(name=name).exists())
+
+        recipe.delete()
+
+        self.assertFalse(StoredImage.objects.filter(name=name).exists())
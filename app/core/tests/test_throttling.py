@@ -0,0 +1,120 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.throttling import CacheBucketStore, DatabaseBucketStore, \
+    LocalMemoryBucketStore, check_throttle_store, get_store, parse_rate, \
+    refill
+
+
+class TokenBucketTests(TestCase):
+
+    def test_parse_rate(self):
+        """Test that rates give the bucket size and refill per second"""
+        self.assertEqual(parse_rate('60/min'), (60, 1))
+        self.assertEqual(parse_rate('10/s'), (10, 10))
+
+    def test_refill(self):
+        """Test that buckets start full, empty and refill over time"""
+        tokens, wait = refill(None, 0, 2, 1, 100)
+        self.assertEqual((tokens, wait), (1, 0))
+        tokens, wait = refill(tokens, 100, 2, 1, 100)
+        self.assertEqual((tokens, wait), (0, 0))
+        tokens, wait = refill(tokens, 100, 2, 1, 100.5)
+        self.assertEqual((tokens, wait), (0.5, 0.5))
+        tokens, wait = refill(tokens, 100.5, 2, 1, 200)
+        self.assertEqual((tokens, wait), (1, 0))
+
+
+class ThrottleStoreCheckTests(TestCase):
+
+    def test_local_cache_warned(self):
+        """Test that the cache store on a process-local cache is warned
+        about"""
+        with self.settings(THROTTLE_STORE='core.throttling.CacheBucketStore'):
+            errors = check_throttle_store(None)
+
+        self.assertEqual([error.id for error in errors], ['core.W001'])
+
+    def test_database_store_not_warned(self):
+        """Test that stores shared through the database pass"""
+        with self.settings(
+                THROTTLE_STORE='core.throttling.DatabaseBucketStore'):
+            self.assertEqual(check_throttle_store(None), [])
+
+
+class StoreTestsMixin:
+
+    def setUp(self):
+        cache.clear()
+
+    def test_take(self):
+        """Test that tokens are taken until the bucket is empty"""
+        waits = [self.store.take('bucket', 2, 1, 100) for _ in range(3)]
+        self.assertEqual(waits, [0, 0, 1])
+        self.assertEqual(self.store.take('bucket', 2, 1, 101), 0)
+        self.assertEqual(self.store.take('other', 2, 1, 101), 0)
+
+    def test_acquire_release(self):
+        """Test that counters refuse slots over the limit until released"""
+        self.assertTrue(self.store.acquire('slots', 2, 60))
+        self.assertTrue(self.store.acquire('slots', 2, 60))
+        self.assertFalse(self.store.acquire('slots', 2, 60))
+        self.store.release('slots')
+        self.assertTrue(self.store.acquire('slots', 2, 60))
+
+
+class LocalMemoryBucketStoreTests(StoreTestsMixin, TestCase):
+    store = LocalMemoryBucketStore()
+
+
+class CacheBucketStoreTests(StoreTestsMixin, TestCase):
+    store = CacheBucketStore()
+
+
+class DatabaseBucketStoreTests(StoreTestsMixin, TestCase):
+    store = DatabaseBucketStore()
+
+
+class ThrottleApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@example.com', 'testpass')
+        self.client.force_authenticate(self.user)
+
+    @override_settings(THROTTLE_RATES={'write': '2/min'})
+    def test_write_throttled(self):
+        """Test that writes over the rate get 429 with Retry-After"""
+        url = reverse('recipe:tag-list')
+        for name in ('one', 'two'):
+            response = self.client.post(url, {'name': name})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.post(url, {'name': 'three'})
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(UPLOAD_CONCURRENCY_LIMIT=1)
+    def test_concurrent_uploads_limited(self):
+        """Test that uploads are refused while the user's slots are taken"""
+        url = reverse('recipe:recipe-upload-image', args=[1])
+        get_store().acquire(f'uploads:user-{self.user.pk}', 1, 60)
+
+        response = self.client.post(url, {}, format='multipart')
+        self.assertEqual(
+            response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        get_store().release(f'uploads:user-{self.user.pk}')
+        response = self.client.post(url, {}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+from django.test import TestCase, RequestFactory
+
+from core.views import serve_media
+
+
+class ServeMediaTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+
+    def create_file(self, path):
+        full_path = os.path.join(self.media_root.name, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as f:
+            f.write(b'content')
+
+    def test_recipe_image_cached_immutably(self):
+        """Test that uploaded recipe images get long-lived cache headers"""
+        path = 'uploads/recipe/image.jpg'
+        self.create_file(path)
+
+        response = serve_media(
+            self.factory.get('/'), path, document_root=self.media_root.name)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=', response['Cache-Control'])
+
+    def test_other_media_not_immutable(self):
+        """Test that other media files are served without cache headers"""
+        path = 'other/file.txt'
+        self.create_file(path)
+
+        response = serve_media(
+            self.factory.get('/'), path, document_root=self.media_root.name)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Cache-Control'))
@@ -0,0 +1,247 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.checks import Tags, Warning, register
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+from django.utils.translation import ugettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+
+RATE_PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+def parse_rate(rate):
+    """Return (bucket size, tokens added per second) of '<count>/<period>'
+
+    e.g. '60/min' allows bursts of 60 requests and one more each second.
+    """
+    count, period = rate.split('/')
+    return int(count), int(count) / RATE_PERIODS[period[0]]
+
+
+def refill(tokens, updated, capacity, rate, now):
+    """Take a token from a bucket, return (tokens left, seconds to wait)
+
+    The wait is 0 when a token was taken. A bucket seen for the first time
+    (tokens is None) starts full.
+    """
+    if tokens is None:
+        tokens = capacity
+    else:
+        # Clocks of different servers may disagree slightly
+        tokens = min(capacity, tokens + max(now - updated, 0) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0
+    return tokens, (1 - tokens) / rate
+
+
+class LocalMemoryBucketStore:
+    """Buckets and counters in process memory
+
+    Each process keeps its own state, so limits apply per worker process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.counters = {}
+
+    def take(self, key, capacity, rate, now):
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (None, now))
+            tokens, wait = refill(tokens, updated, capacity, rate, now)
+            self.buckets[key] = (tokens, now)
+        return wait
+
+    def acquire(self, key, limit, timeout):
+        with self.lock:
+            if self.counters.get(key, 0) >= limit:
+                return False
+            self.counters[key] = self.counters.get(key, 0) + 1
+        return True
+
+    def release(self, key):
+        with self.lock:
+            self.counters[key] = max(self.counters.get(key, 0) - 1, 0)
+
+
+class CacheBucketStore:
+    """Buckets and counters in the default cache
+
+    They are shared by the processes sharing the cache backend, e.g.
+    memcached; with the process-local LocMemCache (Django's default),
+    limits apply per worker process.
+
+    Counters use the cache's atomic incr/decr; buckets are updated under a
+    short-lived cache lock and let the request through if the lock can't
+    be had.
+    """
+    LOCK_ATTEMPTS = 20
+
+    def take(self, key, capacity, rate, now):
+        lock = f'{key}:lock'
+        for attempt in range(self.LOCK_ATTEMPTS):
+            if cache.add(lock, 1, timeout=1):
+                break
+            time.sleep(0.001)
+        else:
+            return 0
+
+        try:
+            tokens, updated = cache.get(key, (None, now))
+            tokens, wait = refill(tokens, updated, capacity, rate, now)
+            cache.set(key, (tokens, now), timeout=int(capacity / rate) + 1)
+        finally:
+            cache.delete(lock)
+        return wait
+
+    def acquire(self, key, limit, timeout):
+        cache.add(key, 0, timeout=timeout)
+        try:
+            count = cache.incr(key)
+        except ValueError:
+            # Expired since add()
+            cache.add(key, 1, timeout=timeout)
+            return True
+        if count > limit:
+            cache.decr(key)
+            return False
+        return True
+
+    def release(self, key):
+        try:
+            cache.decr(key)
+        except ValueError:
+            pass
+
+
+class DatabaseBucketStore:
+    """Buckets and counters in the core_throttlebucket table of the
+    default database, updated with row locks and conditional UPDATEs"""
+
+    @property
+    def buckets(self):
+        from core.models import ThrottleBucket
+        return ThrottleBucket.objects.using(DEFAULT_DB_ALIAS)
+
+    def take(self, key, capacity, rate, now):
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            bucket, created = self.buckets.select_for_update().get_or_create(
+                key=key, defaults={'value': capacity, 'updated': now})
+            bucket.value, wait = refill(
+                bucket.value, bucket.updated, capacity, rate, now)
+            bucket.updated = now
+            bucket.save()
+        return wait
+
+    def acquire(self, key, limit, timeout):
+        now = time.time()
+        self.buckets.get_or_create(
+            key=key, defaults={'value': 0, 'updated': now})
+        # Slots of requests that died without releasing them expire
+        self.buckets.filter(key=key, updated__lt=now - timeout).\
+            update(value=0)
+        return bool(
+            self.buckets.filter(key=key, value__lt=limit).
+            update(value=F('value') + 1, updated=now)
+        )
+
+    def release(self, key):
+        self.buckets.filter(key=key, value__gt=0).\
+            update(value=F('value') - 1)
+
+
+@lru_cache()
+def _load_store(path):
+    return import_string(path)()
+
+
+def get_store():
+    """Return the THROTTLE_STORE in use"""
+    return _load_store(settings.THROTTLE_STORE)
+
+
+# Cache backends whose entries live in one process only
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_throttle_store(app_configs, **kwargs):
+    """Warn when throttling state isn't shared by the worker processes"""
+    if import_string(settings.THROTTLE_STORE) is not CacheBucketStore:
+        return []
+    backend = type(caches['default'])
+    if f'{backend.__module__}.{backend.__name__}' not in \
+            LOCAL_CACHE_BACKENDS:
+        return []
+    return [Warning(
+        'THROTTLE_STORE keeps token buckets in a process-local cache, so '
+        'each worker process allows the full THROTTLE_RATES.',
+        hint='Configure a shared default cache (e.g. memcached), or set '
+             'THROTTLE_STORE to core.throttling.DatabaseBucketStore.',
+        id='core.W001',
+    )]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Token-bucket throttle per user (or client address) and scope
+
+    The scope is the view's `throttle_scope`, else 'read' for safe methods
+    and 'write' for the others; scopes without a THROTTLE_RATES entry are
+    not throttled.
+    """
+    wait_seconds = None
+
+    def get_scope(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope:
+            return scope
+        return 'read' if request.method in SAFE_METHODS else 'write'
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        rate = settings.THROTTLE_RATES.get(scope)
+        if rate is None:
+            return True
+
+        if request.user and request.user.is_authenticated:
+            ident = f'user-{request.user.pk}'
+        else:
+            ident = f'address-{self.get_ident(request)}'
+        capacity, refill_rate = parse_rate(rate)
+        self.wait_seconds = get_store().take(
+            f'throttle:{scope}:{ident}', capacity, refill_rate, time.time())
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+@contextmanager
+def upload_slot(user):
+    """Hold one of the user's UPLOAD_CONCURRENCY_LIMIT upload slots
+
+    Raises Throttled while every slot is in use.
+    """
+    store = get_store()
+    key = f'uploads:user-{user.pk}'
+    if not store.acquire(key, settings.UPLOAD_CONCURRENCY_LIMIT,
+                         settings.UPLOAD_SLOT_TIMEOUT):
+        raise exceptions.Throttled(
+            detail=_('Too many uploads in progress.'))
+    try:
+        yield
+    finally:
+        store.release(key)
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.utils.translation import ugettext_lazy as _
+from django.views import static
+
+from rest_framework import exceptions, mixins, viewsets
+from rest_framework.permissions import IsAuthenticated, SAFE_METHODS
+
+from core import serializers
+from core.db_routers import is_pinned, pin, set_read_replica
+from core.models import Job
+from core.sharding import set_current_shard, shard_entry, sharding_enabled
+from user.authentication import SignedTokenAuthentication
+
+
+IMMUTABLE_MEDIA_PREFIX = 'uploads/recipe/'
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """Serve a media file, marking uploaded recipe images as immutable"""
+    response = static.serve(request, path, document_root, show_indexes)
+    if path.startswith(IMMUTABLE_MEDIA_PREFIX):
+        patch_cache_control(
+            response,
+            public=True,
+            max_age=settings.MEDIA_IMMUTABLE_MAX_AGE,
+            immutable=True
+        )
+
+    return response
+
+
+class ReplicaReadMixin:
+    """API view mixin reading safe requests from replicas
+
+    A client that has written in the last REPLICA_PIN_SECONDS reads from the
+    primary so it sees its own writes despite replication lag.
+    """
+    read_from_replica = False
+
+    def initial(self, request, *args, **kwargs):
+        # Authentication reads the primary too
+        set_read_replica(False)
+        super().initial(request, *args, **kwargs)
+        self.read_from_replica = request.method in SAFE_METHODS and \
+            not is_pinned(request)
+        set_read_replica(self.read_from_replica)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        set_read_replica(False)
+        response = super().finalize_response(
+            request, response, *args, **kwargs)
+        if request.method not in SAFE_METHODS and \
+                response.status_code < 400:
+            pin(request, response)
+        return response
+
+
+class ShardMoving(exceptions.APIException):
+    status_code = 503
+    default_detail = _('Your data is being moved, please retry shortly.')
+    default_code = 'shard_moving'
+
+
+class ShardRoutingMixin:
+    """API view mixin routing the request to the user's shard
+
+    While the user is being moved between shards, reads are served from
+    the old shard and writes are refused with 503.
+    """
+    shard = None
+
+    def initial(self, request, *args, **kwargs):
+        set_current_shard(None)
+        super().initial(request, *args, **kwargs)
+        if not sharding_enabled() or not request.user.is_authenticated:
+            return
+
+        self.shard, moving = shard_entry(request.user.pk)
+        if moving and request.method not in SAFE_METHODS:
+            raise ShardMoving()
+        set_current_shard(self.shard)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        set_current_shard(None)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class JobViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """Status of the user's background jobs"""
+    serializer_class = serializers.JobSerializer
+    queryset = Job.objects.all()
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (SignedTokenAuthentication,)
+
+    def get_queryset(self):
+        return self.queryset.filter(user=self.request.user)
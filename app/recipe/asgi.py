@@ -0,0 +1,137 @@
+import asyncio
+
+from django.db.models import F
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from rest_framework.response import Response
+
+from core.asgi import EventStreamResponse, run_db
+from core.db_routers import set_read_replica
+from core.events import event_stream
+from core.models import ChangeLog
+from core.sharding import set_current_shard
+from recipe.views import RecipeEventsView, RecipeViewSet
+
+
+def _set_prefetched(instance, relation, objects):
+    """Populate a relation's prefetch cache as prefetch_related() would"""
+    queryset = getattr(instance, relation).all()
+    queryset._result_cache = objects
+    queryset._prefetch_done = True
+    instance.__dict__.setdefault('_prefetched_objects_cache', {})
+    instance._prefetched_objects_cache[relation] = queryset
+
+
+def _load_relation(queryset, recipe_ids):
+    """Return {recipe id: [related objects]} for the given recipes"""
+    related = {recipe_id: [] for recipe_id in recipe_ids}
+    rows = queryset.filter(recipe__in=recipe_ids).\
+        annotate(_recipe_id=F('recipe')).order_by('id')
+    for obj in rows:
+        related[obj._recipe_id].append(obj)
+    return related
+
+
+async def _load_relations(view, recipe_ids):
+    """Load the rendered relations of recipes concurrently"""
+    relations = view.rendered_relations()
+    results = await asyncio.gather(*(
+        run_db(_load_relation, queryset, recipe_ids)
+        for queryset in relations.values()
+    ))
+    return dict(zip(relations, results))
+
+
+async def _list(view):
+    queryset = view.filter_queryset(view.get_queryset())
+    recipes = await run_db(list, queryset.prefetch_related(None))
+
+    relations = await _load_relations(view, [r.pk for r in recipes])
+    for recipe in recipes:
+        for relation, related in relations.items():
+            _set_prefetched(recipe, relation, related[recipe.pk])
+
+    serializer = view.get_serializer(recipes, many=True)
+    return await run_db(lambda: Response(serializer.data))
+
+
+async def _retrieve(view, pk):
+    try:
+        pk = int(pk)
+    except ValueError:
+        raise Http404
+    queryset = view.filter_queryset(view.get_queryset())
+    # The relation queries don't depend on the recipe row, so they run
+    # alongside it and are discarded if the recipe isn't found.
+    recipe, relations = await asyncio.gather(
+        run_db(get_object_or_404, queryset.prefetch_related(None), pk=pk),
+        _load_relations(view, [pk]),
+    )
+    view.check_object_permissions(view.request, recipe)
+
+    timestamps = [recipe.updated_at]
+    for relation, related in relations.items():
+        _set_prefetched(recipe, relation, related[recipe.pk])
+        timestamps.extend(obj.updated_at for obj in related[recipe.pk])
+
+    return await run_db(view.detail_response, recipe, max(timestamps))
+
+
+async def _events(view):
+    return EventStreamResponse(event_stream(
+        view.request.user.pk,
+        ChangeLog.objects.all().db,
+        view.request.META.get('HTTP_LAST_EVENT_ID')
+    ))
+
+
+async def _serve(request, action, handler, view_class=RecipeViewSet,
+                 **kwargs):
+    """Run handler the way APIView.dispatch runs a viewset action"""
+    initkwargs = {'action_map': {'get': action}} if action else {}
+    view = view_class(
+        args=(),
+        kwargs=kwargs,
+        format_kwarg=None,
+        **initkwargs
+    )
+    view.request = view.initialize_request(request, **kwargs)
+    view.headers = view.default_response_headers
+    try:
+        await run_db(view.initial, view.request)
+        # initial() ran with a copy of this task's context
+        set_read_replica(getattr(view, 'read_from_replica', False))
+        set_current_shard(view.shard)
+        response = await handler(view, **kwargs)
+    except Exception as exc:
+        response = view.handle_exception(exc)
+
+    if isinstance(response, EventStreamResponse):
+        set_current_shard(None)
+        return response
+    response = view.finalize_response(view.request, response)
+    return await run_db(response.render)
+
+
+async def recipe_list(request):
+    """Async equivalent of RecipeViewSet.list"""
+    return await _serve(request, 'list', _list)
+
+
+async def recipe_detail(request, pk):
+    """Async equivalent of RecipeViewSet.retrieve"""
+    return await _serve(request, 'retrieve', _retrieve, pk=pk)
+
+
+async def recipe_events(request):
+    """Streaming equivalent of RecipeEventsView"""
+    return await _serve(
+        request, None, _events, view_class=RecipeEventsView)
+
+
+async_views = {
+    'recipe:recipe-list': recipe_list,
+    'recipe:recipe-detail': recipe_detail,
+    'recipe:events': recipe_events,
+}
@@ -0,0 +1,15 @@
+from django.utils.translation import ugettext_lazy as _
+
+from rest_framework import exceptions, status
+
+
+class PreconditionFailed(exceptions.APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = _('The recipe was changed by another request.')
+    default_code = 'precondition_failed'
+
+
+class PreconditionRequired(exceptions.APIException):
+    status_code = status.HTTP_428_PRECONDITION_REQUIRED
+    default_detail = _('Updates must send an If-Match header.')
+    default_code = 'precondition_required'
@@ -0,0 +1,230 @@
+import fcntl
+import hashlib
+import io
+import os
+import tempfile
+
+from PIL import Image
+
+from django.conf import settings
+
+
+# Output formats: Pillow format name and media type
+FORMATS = {
+    'avif': ('AVIF', 'image/avif'),
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+DEFAULT_FORMAT = 'jpeg'
+
+# Integer downscaling stops at twice the target size so the final
+# resample still has pixels to filter
+REDUCING_GAP = 2
+
+# Running size total of the derivative cache, in its root
+SIZE_FILE = '.size'
+
+
+def available_formats():
+    """Return the RECIPE_IMAGE_FORMATS this Pillow build can write, in
+    order of preference"""
+    Image.init()
+    return [
+        name for name in settings.RECIPE_IMAGE_FORMATS
+        if FORMATS[name][0] in Image.SAVE
+    ]
+
+
+def parse_accept(header):
+    """Return {media type: quality} of an Accept header"""
+    accepted = {}
+    for item in header.split(','):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type:
+            accepted[media_type.lower()] = quality
+    return accepted
+
+
+def negotiate(accept):
+    """Return the available format an Accept header rates highest,
+    preferring earlier formats on ties
+
+    Wildcards only stand for JPEG, as clients list the newer formats they
+    can decode explicitly; JPEG is also the fallback.
+    """
+    accepted = parse_accept(accept or '')
+    candidates = [
+        (accepted[FORMATS[name][1]], -rank, name)
+        for rank, name in enumerate(available_formats())
+        if accepted.get(FORMATS[name][1], 0) > 0
+    ]
+    return max(candidates)[2] if candidates else DEFAULT_FORMAT
+
+
+def render(source, width, format):
+    """Return source as format bytes, scaled down to at most width pixels
+    wide
+
+    JPEG sources are decoded at a reduced scale (Image.draft) and others
+    shrunk by an integer factor (Image.reduce) before the final resample,
+    so large originals are never filtered at full size.
+    """
+    image = Image.open(source)
+    height = None
+    if image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        image.draft('RGB', (width, height))
+
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA')
+    if format == 'jpeg' and image.mode == 'RGBA':
+        image = image.convert('RGB')
+
+    if height is not None:
+        factor = image.width // (width * REDUCING_GAP)
+        if factor > 1:
+            image = image.reduce(factor)
+        image = image.resize((width, height), Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(
+        output, FORMATS[format][0], quality=settings.RECIPE_IMAGE_QUALITY)
+    return output.getvalue()
+
+
+def cache_key(name, width, format):
+    return hashlib.sha256(f'{name}:{width}:{format}'.encode()).hexdigest()
+
+
+def cache_root():
+    return os.path.join(settings.MEDIA_ROOT, settings.RECIPE_IMAGE_CACHE_DIR)
+
+
+def cache_path(key, format):
+    return os.path.join(cache_root(), key[:2], f'{key}.{format}')
+
+
+def update_size(delta=0, total=None):
+    """Add delta to the running size total of the cache, or replace it
+    with total, and return the new total
+
+    The total lives in a file locked while it changes, so every process
+    serving images shares it.
+    """
+    fd = os.open(
+        os.path.join(cache_root(), SIZE_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    with os.fdopen(fd, 'r+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        if total is None:
+            try:
+                total = int(f.read() or 0) + delta
+            except ValueError:
+                total = delta
+        total = max(total, 0)
+        f.seek(0)
+        f.truncate()
+        f.write(str(total))
+    return total
+
+
+def store(key, format, content):
+    """Write a derivative to the cache atomically and return its path
+
+    The cache is only scanned for eviction once the running size total
+    says it outgrew RECIPE_IMAGE_CACHE_BYTES.
+    """
+    path = cache_path(key, format)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix='.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        os.chmod(temp_path, 0o644)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+    if update_size(len(content) - replaced) > \
+            settings.RECIPE_IMAGE_CACHE_BYTES:
+        evict()
+    return path
+
+
+def evict():
+    """Delete the least recently used derivatives once the cache outgrows
+    RECIPE_IMAGE_CACHE_BYTES, down to RECIPE_IMAGE_CACHE_LOW_WATER of it
+
+    Scans the whole cache and corrects the running size total, which
+    drifts when files are deleted behind the cache's back. Returns the
+    number of files deleted.
+    """
+    entries = []
+    for directory in os.scandir(cache_root()):
+        if not directory.is_dir():
+            continue
+        for entry in os.scandir(directory.path):
+            if entry.name.startswith('.'):
+                # Still being written
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    if total <= settings.RECIPE_IMAGE_CACHE_BYTES:
+        update_size(total=total)
+        return 0
+
+    target = settings.RECIPE_IMAGE_CACHE_BYTES * \
+        settings.RECIPE_IMAGE_CACHE_LOW_WATER
+    deleted = 0
+    for _, size, path in sorted(entries):
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        deleted += 1
+    update_size(total=total)
+    return deleted
+
+
+def derivative(image, width, format):
+    """Return a file of an image field's file scaled to width in format,
+    rendering and caching it on a miss
+
+    Hits refresh the cached file's modification time, which orders
+    eviction.
+    """
+    key = cache_key(image.name, width, format)
+    path = cache_path(key, format)
+    try:
+        cached = open(path, 'rb')
+    except FileNotFoundError:
+        pass
+    else:
+        os.utime(cached.fileno())
+        return cached
+
+    with image.storage.open(image.name) as source:
+        content = render(source, width, format)
+    store(key, format, content)
+    return io.BytesIO(content)
@@ -0,0 +1,43 @@
+from PIL import Image
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+from core.jobs import PermanentJobError, register
+from core.models import Recipe
+from core.similarity import UPDATE_JOB, update_recipes
+
+
+@register('recipe.process_image')
+def process_image(job):
+    """Attach an image uploaded with `Prefer: respond-async` to its recipe"""
+    payload = job.payload
+    name = payload['name']
+    recipe = Recipe.objects.filter(
+        pk=payload['recipe'], user_id=job.user_id).first()
+    if recipe is None or not default_storage.exists(name):
+        default_storage.delete(name)
+        raise PermanentJobError('The recipe or the upload no longer exists')
+
+    with default_storage.open(name) as upload:
+        try:
+            Image.open(upload).verify()
+        except Exception:
+            default_storage.delete(name)
+            raise PermanentJobError('The upload is not a valid image')
+        upload.seek(0)
+        # Assigned uncommitted, so the image is stored under the hash of
+        # its content like synchronous uploads
+        recipe.image = File(upload, name=name.rsplit('/', 1)[-1])
+        recipe.save()
+
+    default_storage.delete(name)
+    return {'recipe': recipe.pk, 'image': recipe.image.url}
+
+
+@register(UPDATE_JOB)
+def update_similarity(job):
+    """Refresh the neighbours of recipes whose tags or ingredients changed"""
+    recipe_ids = job.payload['recipes']
+    update_recipes(job.user_id, recipe_ids)
+    return {'recipes': len(recipe_ids)}
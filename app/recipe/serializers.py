@@ -1,6 +1,11 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed
+
 from rest_framework import serializers
 
-from core.models import Tag, Ingredient, Recipe
+from core.models import Tag, Ingredient, Recipe, RecipeStats
+from recipe.exceptions import PreconditionFailed
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -19,7 +24,75 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """Restrict output to the `fields` context and nest `expand` relations
+
+    `expandable_fields` maps relation field names to the serializer used
+    when the relation is listed in the `expand` context.
+    """
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields = self.context.get('fields')
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+        for name in self.context.get('expand', ()):
+            if name in self.fields and name in self.expandable_fields:
+                self.fields[name] = self.expandable_fields[name](
+                    many=True,
+                    read_only=True
+                )
+
+
+def write_links(recipe, name, objs, current=None):
+    """Link a recipe to exactly objs through its `name` relation
+
+    Unlike set(), only the link rows that change are deleted or bulk
+    inserted, and nothing is written when the links are unchanged.
+    m2m_changed is sent as add() and remove() would. current is the set of
+    ids linked now, looked up if not given.
+    """
+    field = Recipe._meta.get_field(name)
+    through = field.remote_field.through
+    column = f'{field.m2m_reverse_field_name()}_id'
+    using = recipe._state.db
+    links = through.objects.using(using).filter(recipe_id=recipe.pk)
+    if current is None:
+        current = set(links.values_list(column, flat=True))
+
+    wanted = {obj.pk for obj in objs}
+    removed, added = current - wanted, wanted - current
+    signal = {
+        'sender': through,
+        'instance': recipe,
+        'reverse': False,
+        'model': field.related_model,
+        'using': using,
+    }
+    if removed:
+        m2m_changed.send(action='pre_remove', pk_set=removed, **signal)
+        links.filter(**{f'{column}__in': removed}).delete()
+        m2m_changed.send(action='post_remove', pk_set=removed, **signal)
+    if added:
+        m2m_changed.send(action='pre_add', pk_set=added, **signal)
+        through.objects.using(using).bulk_create([
+            through(recipe_id=recipe.pk, **{column: pk})
+            for pk in sorted(added)
+        ])
+        m2m_changed.send(action='post_add', pk_set=added, **signal)
+
+    getattr(recipe, '_prefetched_objects_cache', {}).pop(name, None)
+
+
+class RecipeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {
+        'tags': TagSerializer,
+        'ingredients': IngredientSerializer,
+    }
+
     tags = serializers.PrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
@@ -33,8 +106,43 @@ class RecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = ('id', 'title', 'tags', 'ingredients',
-                  'time_minutes', 'price', 'link')
-        read_only_fields = ('id',)
+                  'time_minutes', 'price', 'link', 'version')
+        read_only_fields = ('id', 'version')
+
+    def _pop_relations(self, validated_data):
+        return {
+            name: validated_data.pop(name)
+            for name in ('tags', 'ingredients') if name in validated_data
+        }
+
+    def create(self, validated_data):
+        relations = self._pop_relations(validated_data)
+        recipe = super().create(validated_data)
+        for name, objs in relations.items():
+            write_links(recipe, name, objs, current=set())
+        return recipe
+
+    def update(self, instance, validated_data):
+        """Update a recipe and bump its version
+
+        The version is bumped with a conditional UPDATE, so of concurrent
+        updates of the same version only the first succeeds and the
+        others raise PreconditionFailed.
+        """
+        relations = self._pop_relations(validated_data)
+        using = instance._state.db
+        with transaction.atomic(using=using):
+            bumped = Recipe.objects.using(using).\
+                filter(pk=instance.pk, version=instance.version).\
+                update(version=F('version') + 1)
+            if not bumped:
+                raise PreconditionFailed()
+            instance.version += 1
+
+            instance = super().update(instance, validated_data)
+            for name, objs in relations.items():
+                write_links(instance, name, objs)
+        return instance
 
 
 class RecipeDetailSerializer(RecipeSerializer):
@@ -42,6 +150,27 @@ class RecipeDetailSerializer(RecipeSerializer):
     tags = TagSerializer(many=True, read_only=True)
 
 
+class SimilarRecipeSerializer(RecipeSerializer):
+    """Serializer for recipes similar to another, with their score"""
+    score = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('score',)
+
+
+class PantryRecipeSerializer(RecipeSerializer):
+    """Serializer for recipes found by ingredient coverage"""
+    coverage = serializers.FloatField(read_only=True)
+    missing = serializers.SerializerMethodField()
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('coverage', 'missing')
+
+    def get_missing(self, recipe):
+        """Return the number of ingredients not in the pantry"""
+        return recipe.total - recipe.covered
+
+
 class RecipeImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images to recipes"""
 
@@ -49,3 +178,36 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+
+class PendingImageSerializer(serializers.Serializer):
+    """Serializer for images uploaded for background processing"""
+    image = serializers.FileField()
+
+
+class UsageSerializer(serializers.Serializer):
+    """Serializer for the number of recipes using a tag or ingredient"""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    recipe_count = serializers.IntegerField()
+
+
+class RecipeStatsSerializer(serializers.ModelSerializer):
+    """Serializer for a user's recipe statistics"""
+    average_time_minutes = serializers.SerializerMethodField()
+    average_price = serializers.SerializerMethodField()
+    tags = UsageSerializer(many=True)
+    ingredients = UsageSerializer(many=True)
+
+    class Meta:
+        model = RecipeStats
+        fields = ('recipe_count', 'average_time_minutes', 'average_price',
+                  'tags', 'ingredients')
+
+    def get_average_time_minutes(self, stats):
+        if stats.recipe_count:
+            return stats.time_minutes_sum / stats.recipe_count
+
+    def get_average_price(self, stats):
+        if stats.recipe_count:
+            return '{:.2f}'.format(stats.price_sum / stats.recipe_count)
@@ -0,0 +1,328 @@
+import asyncio
+import json
+from concurrent.futures import Executor, Future
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.signals import request_finished, request_started
+from django.core.wsgi import get_wsgi_application
+from django.db import close_old_connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.asgi import AsgiHandler, run_db
+from core.changelog import make_cursor
+from core.events import RESYNC, Subscription, replay
+from core.models import Recipe, Tag
+from recipe.asgi import async_views
+from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from user.authentication import create_signed_token
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+ME_URL = reverse('user:me')
+EVENTS_URL = reverse('recipe:events')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+class InlineExecutor(Executor):
+    """Executor running calls in the calling thread, so they share the
+    test case's transaction
+
+    Like Django's test client, it keeps the request signals of WSGI calls
+    from closing the connections of that thread.
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            future = Future()
+            future.set_result(fn(*args, **kwargs))
+            return future
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+
+
+@patch('core.asgi.get_executor', return_value=InlineExecutor())
+class AsgiRecipeApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+        self.token = create_signed_token(self.user)
+        self.application = AsgiHandler(get_wsgi_application(), async_views)
+
+    def request(self, path, query_string=b'', token=None):
+        """Call the ASGI application and return status, headers, body"""
+        headers = [(b'host', b'testserver')]
+        if token:
+            headers.append((b'authorization', f'Token {token}'.encode()))
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': path,
+            'query_string': query_string,
+            'headers': headers,
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(self.application(scope, receive, send))
+        start, body = messages
+        return start['status'], dict(start['headers']), body['body']
+
+    def create_recipe(self, title='sample title'):
+        recipe = Recipe.objects.create(
+            user=self.user, title=title, time_minutes=10, price=10.00)
+        recipe.tags.add(Tag.objects.create(user=self.user, name=title))
+        return recipe
+
+    def test_login_required(self, get_executor):
+        """Test that the async path authenticates requests"""
+        status, headers, body = self.request(RECIPES_URL)
+
+        self.assertEqual(status, 401)
+
+    def test_list_recipes(self, get_executor):
+        """Test that the async list matches the WSGI serializer output"""
+        self.create_recipe('rec 1')
+        self.create_recipe('rec 2')
+
+        status, headers, body = self.request(RECIPES_URL, token=self.token)
+
+        serializer = RecipeSerializer(
+            Recipe.objects.order_by('id'), many=True)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), json.loads(
+            json.dumps(serializer.data)))
+
+    def test_list_sparse_fields(self, get_executor):
+        """Test that the async list honours fields and expand"""
+        recipe = self.create_recipe()
+
+        status, headers, body = self.request(
+            RECIPES_URL, b'fields=id,tags&expand=tags', token=self.token)
+
+        self.assertEqual(json.loads(body), [{
+            'id': recipe.id,
+            'tags': [{'id': recipe.tags.get().id, 'name': recipe.title}],
+        }])
+
+    def test_recipe_detail(self, get_executor):
+        """Test that the async detail matches RecipeDetailSerializer"""
+        recipe = self.create_recipe()
+
+        status, headers, body = self.request(
+            detail_url(recipe.id), token=self.token)
+
+        serializer = RecipeDetailSerializer(recipe)
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), json.loads(
+            json.dumps(serializer.data)))
+        self.assertIn(b'ETag', headers)
+
+    def test_other_users_recipe_not_found(self, get_executor):
+        """Test that the async detail enforces ownership"""
+        other = get_user_model().objects.create_user(
+            'other@example.com', 'testpass')
+        recipe = Recipe.objects.create(
+            user=other, title='title', time_minutes=10, price=10.00)
+
+        status, headers, body = self.request(
+            detail_url(recipe.id), token=self.token)
+
+        self.assertEqual(status, 404)
+
+    def test_other_views_served_by_wsgi(self, get_executor):
+        """Test that requests without an async view go through WSGI"""
+        status, headers, body = self.request(ME_URL, token=self.token)
+
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['email'], self.user.email)
+
+
+class EventStreamMixin:
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+        self.token = create_signed_token(self.user)
+        self.application = AsgiHandler(get_wsgi_application(), async_views)
+
+    def stream(self, count, on_chunk=None, last_event_id=None):
+        """Read count body chunks of the event stream, then disconnect"""
+        headers = [
+            (b'host', b'testserver'),
+            (b'authorization', f'Token {self.token}'.encode()),
+        ]
+        if last_event_id:
+            headers.append((b'last-event-id', last_event_id.encode()))
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': EVENTS_URL,
+            'query_string': b'',
+            'headers': headers,
+        }
+        messages, chunks = [], []
+
+        async def main():
+            enough = asyncio.Event()
+            requested = []
+
+            async def receive():
+                if not requested:
+                    requested.append(True)
+                    return {'type': 'http.request', 'body': b''}
+                await asyncio.wait_for(enough.wait(), 5)
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+                if message.get('body'):
+                    chunks.append(message['body'])
+                    if on_chunk:
+                        on_chunk(message['body'])
+                    if len(chunks) >= count:
+                        enough.set()
+
+            await self.application(scope, receive, send)
+
+        asyncio.run(main())
+        return messages[0], chunks
+
+
+@patch('core.asgi.get_executor', return_value=InlineExecutor())
+@override_settings(SYNC_SETTLE_SECONDS=0, SSE_POLL_INTERVAL=0.01)
+class AsgiEventStreamTests(EventStreamMixin, TestCase):
+
+    def test_live_changes(self, get_executor):
+        """Test that changes made while connected are pushed"""
+        def on_chunk(chunk):
+            if chunk.startswith(b'retry:'):
+                Tag.objects.create(user=self.user, name='Vegan')
+
+        start, chunks = self.stream(3, on_chunk)
+
+        self.assertEqual(start['status'], 200)
+        self.assertIn(
+            (b'Content-Type', b'text/event-stream'), start['headers'])
+        self.assertIn(b'event: ready', chunks[1])
+        self.assertIn(b'event: change', chunks[2])
+        self.assertIn(b'"kind": "tag"', chunks[2])
+
+    def test_replay_since_last_event_id(self, get_executor):
+        """Test that reconnecting clients get the events they missed"""
+        recipe = Recipe.objects.create(
+            user=self.user, title='title', time_minutes=10, price=10.00)
+
+        start, chunks = self.stream(
+            2, last_event_id=make_cursor(0, 'default'))
+
+        self.assertIn(b'event: change', chunks[1])
+        self.assertIn(f'"id": {recipe.id}'.encode(), chunks[1])
+
+    def test_invalid_last_event_id(self, get_executor):
+        """Test that clients that can't be caught up are told to resync"""
+        start, chunks = self.stream(2, last_event_id='garbage')
+
+        self.assertEqual(chunks[1], RESYNC)
+
+    def test_subscription_overflow(self, get_executor):
+        """Test that slow clients are told to resync instead of buffered"""
+        with self.settings(SSE_BUFFER_SIZE=2):
+            subscription = Subscription(self.user.pk)
+        for event in (b'1', b'2', b'3'):
+            subscription.put(event)
+
+        self.assertTrue(subscription.closed)
+        self.assertEqual(subscription.queue.qsize(), 1)
+        self.assertEqual(subscription.queue.get_nowait(), RESYNC)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0, SSE_POLL_INTERVAL=0.01)
+class AsgiEventStreamPoolTests(EventStreamMixin, TransactionTestCase):
+    """Event streams reading through the DB thread pool, as served"""
+
+    def test_live_changes(self):
+        """Test that changes committed while connected are pushed"""
+        def on_chunk(chunk):
+            if chunk.startswith(b'retry:'):
+                Tag.objects.create(user=self.user, name='Vegan')
+
+        start, chunks = self.stream(3, on_chunk)
+
+        self.assertEqual(start['status'], 200)
+        self.assertIn(b'event: ready', chunks[1])
+        self.assertIn(b'event: change', chunks[2])
+        self.assertIn(b'"kind": "tag"', chunks[2])
+
+
+@patch('core.asgi.close_old_connections')
+class RunDbTests(TestCase):
+
+    def test_pool_thread_closes_old_connections(self, close):
+        """Test that calls on the pool drop stale connections first"""
+        result = asyncio.run(run_db(lambda: close.call_count))
+
+        self.assertEqual(result, 1)
+
+    def test_inline_call_keeps_connections(self, close):
+        """Test that calls outside the pool leave the connections of the
+        calling thread alone"""
+        with patch('core.asgi.get_executor', return_value=InlineExecutor()):
+            asyncio.run(run_db(Tag.objects.count))
+
+        close.assert_not_called()
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class WsgiEventsTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'testemail@example.com', 'testpass')
+        self.client = APIClient()
+
+    def test_login_required(self):
+        """Test that events require authentication"""
+        response = self.client.get(EVENTS_URL)
+
+        self.assertEqual(response.status_code, 401)
+        self.assertTrue(response.content.startswith(b'event: error'))
+
+    @override_settings(SYNC_SETTLE_SECONDS=60)
+    def test_ready_cursor_settled(self):
+        """Test that new clients start behind entries that may not have
+        committed"""
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        event, = replay(self.user.pk, 'default')
+
+        self.assertTrue(event.startswith(b'id: 0.'))
+        self.assertIn(b'event: ready', event)
+
+    def test_events_since_last_event_id(self):
+        """Test that WSGI requests return the missed events and end"""
+        self.client.force_authenticate(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+
+        response = self.client.get(
+            EVENTS_URL, HTTP_LAST_EVENT_ID=make_cursor(0, 'default'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertTrue(response.content.startswith(b'retry: '))
+        self.assertIn(f'"id": {tag.id}'.encode(), response.content)
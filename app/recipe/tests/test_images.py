@@ -0,0 +1,161 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from recipe import images
+
+
+def image_url(recipe_id):
+    return reverse('recipe:recipe-image', args=[recipe_id])
+
+
+def image_bytes(size, format='JPEG', mode='RGB'):
+    output = io.BytesIO()
+    Image.new(mode, size).save(output, format)
+    return output.getvalue()
+
+
+class MediaRootMixin:
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+@override_settings(RECIPE_IMAGE_FORMATS=('webp', 'jpeg'))
+class ImageTests(MediaRootMixin, TestCase):
+
+    def test_negotiate(self):
+        """Test that the best explicitly accepted format is picked"""
+        self.assertEqual(images.negotiate('image/webp,*/*'), 'webp')
+        self.assertEqual(
+            images.negotiate('image/webp;q=0.5,image/jpeg'), 'jpeg')
+        self.assertEqual(images.negotiate('image/*,*/*;q=0.8'), 'jpeg')
+        self.assertEqual(images.negotiate('image/webp;q=0'), 'jpeg')
+        self.assertEqual(images.negotiate(None), 'jpeg')
+
+    def test_render_scales_down(self):
+        """Test that large images are scaled to the requested width"""
+        for format in ('JPEG', 'PNG'):
+            source = io.BytesIO(image_bytes((1600, 1200), format))
+
+            rendered = Image.open(io.BytesIO(
+                images.render(source, 320, 'webp')))
+
+            self.assertEqual(rendered.format, 'WEBP')
+            self.assertEqual(rendered.size, (320, 240))
+
+    def test_render_never_scales_up(self):
+        """Test that small images keep their size"""
+        source = io.BytesIO(image_bytes((100, 50), 'PNG', 'RGBA'))
+
+        rendered = Image.open(io.BytesIO(images.render(source, 320, 'jpeg')))
+
+        self.assertEqual(rendered.size, (100, 50))
+
+    @override_settings(
+        RECIPE_IMAGE_CACHE_BYTES=100, RECIPE_IMAGE_CACHE_LOW_WATER=0.7)
+    def test_evict_least_recently_used(self):
+        """Test that the oldest derivatives are evicted past the limit"""
+        paths = []
+        for i in range(3):
+            paths.append(images.store(f'{i:02}key', 'jpeg', b'x' * 30))
+            os.utime(paths[-1], (i, i))
+
+        self.assertEqual(images.evict(), 0)
+        os.utime(paths[0], (10, 10))
+        images.store('03key', 'jpeg', b'x' * 30)
+
+        self.assertEqual(
+            [os.path.exists(path) for path in paths], [True, False, False])
+
+    @override_settings(RECIPE_IMAGE_CACHE_BYTES=100)
+    def test_store_scans_only_over_limit(self):
+        """Test that the cache is scanned only once its total is too big"""
+        with patch.object(images, 'evict') as evict:
+            images.store('00key', 'jpeg', b'x' * 60)
+            images.store('00key', 'jpeg', b'x' * 90)
+            self.assertFalse(evict.called)
+
+            images.store('01key', 'jpeg', b'x' * 20)
+            self.assertTrue(evict.called)
+
+        self.assertEqual(images.update_size(), 110)
+
+
+@override_settings(RECIPE_IMAGE_FORMATS=('webp', 'jpeg'))
+class RecipeImageApiTests(MediaRootMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@example.com', 'testpass')
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Salad', time_minutes=5, price=1.00)
+        self.recipe.image.save(
+            'salad.jpg', ContentFile(image_bytes((1280, 960))))
+
+    def get(self, accept='image/jpeg', headers=None, **params):
+        return self.client.get(
+            image_url(self.recipe.id), params, HTTP_ACCEPT=accept,
+            **(headers or {}))
+
+    def test_image_width_and_accept(self):
+        """Test that the image is scaled and converted per the request"""
+        response = self.get(width=160, accept='image/webp,*/*')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('Accept', response['Vary'].split(', '))
+        image = Image.open(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(image.size, (160, 120))
+
+        response = self.get(width=160, format='jpeg', accept='image/webp')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    def test_image_cached(self):
+        """Test that derivatives are served from the cache and validate
+        with their ETag"""
+        response = self.get(width=320)
+        b''.join(response.streaming_content)
+        key = images.cache_key(self.recipe.image.name, 320, 'jpeg')
+        self.assertTrue(os.path.exists(images.cache_path(key, 'jpeg')))
+
+        response = self.get(
+            width=320, headers={'HTTP_IF_NONE_MATCH': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_image_params_whitelisted(self):
+        """Test that widths and formats outside the whitelist are refused"""
+        for params in ({'width': 100}, {'width': 'x'}, {'format': 'gif'}):
+            response = self.get(**params)
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_image_of_other_user(self):
+        """Test that other users' recipe images can't be fetched"""
+        other = get_user_model().objects.create_user(
+            'other@example.com', 'testpass')
+        self.client.force_authenticate(other)
+
+        response = self.get()
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -1,16 +1,22 @@
 import os
 import tempfile
+from io import StringIO
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.urls import reverse
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import Recipe, Ingredient, Tag
+from core.similarity import rebuild_user
+from recipe.exceptions import PreconditionFailed
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 
 
@@ -25,6 +31,13 @@ def detail_url(recipe_id):
     return reverse('recipe:recipe-detail', args=[recipe_id])
 
 
+PANTRY_URL = reverse('recipe:recipe-pantry')
+
+
+def similar_url(recipe_id):
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
 def create_tag(user, name='sample tag name'):
     return Tag.objects.create(user=user, name=name)
 
@@ -189,6 +202,410 @@ class PrivateRecipesApiTests(TestCase):
         tags = recipe.tags.all()
         self.assertEqual(tags.count(), 0)
 
+    def test_recipe_detail_validators(self):
+        """Test that recipe detail sends ETag and Last-Modified"""
+        recipe = create_recipe(user=self.user)
+
+        response = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    def test_recipe_detail_not_modified(self):
+        """Test that a matching If-None-Match returns 304"""
+        recipe = create_recipe(user=self.user)
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+
+        response = self.client.get(
+            detail_url(recipe.id),
+            HTTP_IF_NONE_MATCH=etag
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_recipe_detail_etag_changes_with_tag(self):
+        """Test that renaming an assigned tag changes the recipe ETag"""
+        recipe = create_recipe(user=self.user)
+        tag = create_tag(user=self.user)
+        recipe.tags.add(tag)
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+
+        tag.name = 'renamed tag'
+        tag.save()
+        response = self.client.get(
+            detail_url(recipe.id),
+            HTTP_IF_NONE_MATCH=etag
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['tags'][0]['name'], tag.name)
+
+    def test_recipe_detail_etag_changes_with_deleted_tag(self):
+        """Test that soft-deleting an assigned tag changes the recipe ETag"""
+        recipe = create_recipe(user=self.user)
+        tag = create_tag(user=self.user)
+        recipe.tags.add(tag)
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+
+        tag.soft_delete()
+        response = self.client.get(
+            detail_url(recipe.id),
+            HTTP_IF_NONE_MATCH=etag
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['tags'], [])
+
+    def test_update_if_match(self):
+        """Test that updates with the current ETag bump the version"""
+        recipe = create_recipe(user=self.user)
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+
+        response = self.client.patch(
+            detail_url(recipe.id), {'title': 'new'}, HTTP_IF_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], 2)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(
+            self.client.get(detail_url(recipe.id))['ETag'], response['ETag'])
+
+    def test_update_if_match_compressed(self):
+        """Test that the weak ETag of a compressed detail still matches"""
+        recipe = create_recipe(user=self.user)
+        for i in range(10):
+            recipe.tags.add(create_tag(self.user, f'{i} ' + 'x' * 100))
+        etag = self.client.get(
+            detail_url(recipe.id), HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        self.assertTrue(etag.startswith('W/'))
+
+        response = self.client.patch(
+            detail_url(recipe.id), {'title': 'new'}, HTTP_IF_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_update_stale_if_match(self):
+        """Test that updates based on an outdated ETag fail with 412"""
+        recipe = create_recipe(user=self.user)
+        etag = self.client.get(detail_url(recipe.id))['ETag']
+        self.client.patch(detail_url(recipe.id), {'title': 'first'})
+
+        response = self.client.patch(
+            detail_url(recipe.id), {'title': 'second'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(
+            response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        response = self.client.delete(
+            detail_url(recipe.id), HTTP_IF_MATCH=etag)
+        self.assertEqual(
+            response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'first')
+
+    def test_concurrent_update_conflict(self):
+        """Test that an update of a version already replaced fails"""
+        recipe = create_recipe(user=self.user)
+        stale = Recipe.objects.get(pk=recipe.pk)
+        first = RecipeSerializer(recipe, {'title': 'first'}, partial=True)
+        first.is_valid(raise_exception=True)
+        first.save()
+
+        second = RecipeSerializer(stale, {'title': 'second'}, partial=True)
+        second.is_valid(raise_exception=True)
+        with self.assertRaises(PreconditionFailed):
+            second.save()
+
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.title, recipe.version), ('first', 2))
+
+    def test_delete_recipe_soft(self):
+        """Test that deleting a recipe hides it and leaves the row to the
+        purge"""
+        recipe = create_recipe(user=self.user)
+        tag = create_tag(user=self.user)
+        recipe.tags.add(tag)
+
+        response = self.client.delete(detail_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Recipe.objects.filter(pk=recipe.pk).exists())
+        self.assertEqual(
+            list(Recipe.all_objects.get(pk=recipe.pk).tags.all()), [tag])
+        self.assertEqual(Tag.objects.get(pk=tag.pk).recipe_count, 0)
+        self.assertEqual(
+            self.client.get(RECIPES_URL, {'ids': recipe.id}).data, [])
+
+    @override_settings(RECIPE_REQUIRE_IF_MATCH=True)
+    def test_update_requires_if_match(self):
+        """Test that If-Match can be made mandatory"""
+        recipe = create_recipe(user=self.user)
+
+        response = self.client.patch(detail_url(recipe.id), {'title': 'new'})
+        self.assertEqual(
+            response.status_code, status.HTTP_428_PRECONDITION_REQUIRED)
+
+    def test_update_writes_changed_links_only(self):
+        """Test that updates insert and delete only the changed links"""
+        recipe = create_recipe(user=self.user)
+        kept = create_tag(user=self.user, name='kept')
+        dropped = create_tag(user=self.user, name='dropped')
+        added = create_tag(user=self.user, name='added')
+        recipe.tags.add(kept, dropped)
+        table = Recipe.tags.through._meta.db_table
+
+        def link_writes(tags):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.patch(
+                    detail_url(recipe.id), {'tags': tags}, format='json')
+            return [
+                query['sql'].split()[0] for query in queries
+                if table in query['sql'] and
+                not query['sql'].startswith('SELECT')
+            ]
+
+        self.assertEqual(link_writes([kept.id, dropped.id]), [])
+        self.assertEqual(
+            link_writes([kept.id, added.id]), ['DELETE', 'INSERT'])
+        self.assertEqual(
+            set(recipe.tags.values_list('id', flat=True)), {kept.id, added.id})
+        self.assertEqual(Tag.objects.get(pk=dropped.pk).recipe_count, 0)
+        self.assertEqual(Tag.objects.get(pk=added.pk).recipe_count, 1)
+
+
+class RecipeFieldsApiTests(TestCase):
+    """Test sparse fieldsets and expansions on the recipes API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+        self.tag = create_tag(user=self.user)
+        self.recipe.tags.add(self.tag)
+
+    def test_list_sparse_fields(self):
+        """Test that only requested fields are returned"""
+        response = self.client.get(RECIPES_URL, {'fields': 'id,title'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data,
+            [{'id': self.recipe.id, 'title': self.recipe.title}]
+        )
+
+    def test_list_expand_tags(self):
+        """Test that expanded relations are nested"""
+        response = self.client.get(RECIPES_URL, {'expand': 'tags'})
+
+        self.assertEqual(
+            response.data[0]['tags'],
+            [{'id': self.tag.id, 'name': self.tag.name}]
+        )
+        self.assertEqual(response.data[0]['ingredients'], [])
+
+    def test_list_constant_queries(self):
+        """Test that listing doesn't query relations per recipe"""
+        for i in range(5):
+            create_recipe(user=self.user).tags.add(self.tag)
+
+        with self.assertNumQueries(3):
+            self.client.get(RECIPES_URL, {'expand': 'tags,ingredients'})
+        with self.assertNumQueries(1):
+            self.client.get(RECIPES_URL, {'fields': 'id,title,price'})
+
+
+class RecipeMultiGetApiTests(TestCase):
+    """Test fetching the details of several recipes with ?ids="""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        self.tag = create_tag(user=self.user)
+
+    def create_recipes(self, count):
+        recipes = []
+        for i in range(count):
+            recipe = create_recipe(user=self.user, title=f'recipe {i}')
+            recipe.tags.add(self.tag)
+            recipes.append(recipe)
+        return recipes
+
+    def get(self, recipes):
+        ids = ','.join(str(recipe.id) for recipe in recipes)
+        return self.client.get(RECIPES_URL, {'ids': ids})
+
+    def test_multi_get_details(self):
+        """Test that the requested recipes are returned as details"""
+        recipes = self.create_recipes(3)
+
+        response = self.get(recipes[:2])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data,
+            RecipeDetailSerializer(recipes[:2], many=True).data
+        )
+
+    def test_multi_get_constant_queries(self):
+        """Test that the number of queries doesn't grow with the ids"""
+        recipes = self.create_recipes(2)
+        with CaptureQueriesContext(connection) as few:
+            self.get(recipes)
+
+        recipes += self.create_recipes(20)
+        with CaptureQueriesContext(connection) as many:
+            response = self.get(recipes)
+
+        self.assertEqual(len(response.data), 22)
+        self.assertEqual(len(few), len(many))
+
+    def test_multi_get_skips_other_users_recipes(self):
+        """Test that recipes of other users are left out"""
+        recipes = self.create_recipes(1)
+        other = create_recipe(user=create_user('other@example.com'))
+
+        response = self.get(recipes + [other])
+
+        self.assertEqual(
+            [item['id'] for item in response.data], [recipes[0].id])
+
+    def test_multi_get_invalid_ids(self):
+        """Test that non-integer ids are rejected"""
+        response = self.client.get(RECIPES_URL, {'ids': '1,x'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_multi_get_too_many_ids(self):
+        """Test that the number of ids is capped"""
+        ids = ','.join(str(i) for i in range(1, 202))
+        response = self.client.get(RECIPES_URL, {'ids': ids})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class SimilarRecipesApiTests(TestCase):
+    """Test the similar recipes endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def test_similar_recipes(self):
+        """Test that similar recipes are returned best first"""
+        vegan = create_tag(user=self.user, name='vegan')
+        quick = create_tag(user=self.user, name='quick')
+        recipe = create_recipe(user=self.user, title='Salad')
+        recipe.tags.add(vegan, quick)
+        closest = create_recipe(user=self.user, title='Wrap')
+        closest.tags.add(vegan, quick)
+        close = create_recipe(user=self.user, title='Curry')
+        close.tags.add(vegan)
+        create_recipe(user=self.user, title='Steak')
+        rebuild_user(self.user.id)
+
+        response = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(item['id'], item['score']) for item in response.data],
+            [(closest.id, 1.0), (close.id, 0.5)]
+        )
+        self.assertEqual(response.data[0]['tags'], [vegan.id, quick.id])
+
+    def test_similar_recipes_of_other_user(self):
+        """Test that other users' recipes can't be looked up"""
+        recipe = create_recipe(user=create_user('other@example.com'))
+
+        response = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class PantryApiTests(TestCase):
+    """Test searching recipes by ingredients at hand"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        self.ingredients = [
+            create_ingredient(user=self.user, name=name)
+            for name in ('rice', 'beans', 'salt', 'lime')
+        ]
+
+    def create_recipe(self, title, ingredients, user=None):
+        recipe = create_recipe(user=user or self.user, title=title)
+        recipe.ingredients.set(ingredients)
+        return recipe
+
+    def test_pantry_ranks_by_coverage(self):
+        """Test that recipes are ranked by the fraction covered"""
+        rice, beans, salt, lime = self.ingredients
+        full = self.create_recipe('Rice', [rice, salt])
+        half = self.create_recipe('Rice and beans', [rice, beans])
+        quarter = self.create_recipe('Burrito', [rice, beans, salt, lime])
+        self.create_recipe('Limeade', [lime])
+
+        response = self.client.get(
+            PANTRY_URL, {'ingredients': f'{rice.id},{salt.id}'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [
+                (item['id'], item['coverage'], item['missing'])
+                for item in response.data
+            ],
+            [(full.id, 1.0, 0), (quarter.id, 0.5, 2), (half.id, 0.5, 1)]
+        )
+
+    def test_pantry_ignores_deleted_ingredients(self):
+        """Test that soft-deleted ingredients don't count toward coverage"""
+        rice, beans, salt, lime = self.ingredients
+        recipe = self.create_recipe('Rice and beans', [rice, beans])
+        beans.soft_delete()
+
+        response = self.client.get(PANTRY_URL, {'ingredients': rice.id})
+
+        self.assertEqual(
+            [
+                (item['id'], item['coverage'], item['missing'])
+                for item in response.data
+            ],
+            [(recipe.id, 1.0, 0)]
+        )
+
+    def test_pantry_limited_to_user(self):
+        """Test that other users' recipes are not returned"""
+        other = create_user('other@example.com')
+        self.create_recipe('Rice', [self.ingredients[0]], user=other)
+
+        response = self.client.get(
+            PANTRY_URL, {'ingredients': self.ingredients[0].id})
+
+        self.assertEqual(response.data, [])
+
+    def test_pantry_constant_queries(self):
+        """Test that ranking takes one query however many recipes"""
+        for i in range(10):
+            self.create_recipe(f'recipe {i}', self.ingredients[:i % 4 + 1])
+
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                PANTRY_URL, {'ingredients': self.ingredients[0].id})
+        self.assertEqual(len(response.data), 10)
+
+    def test_pantry_requires_ingredients(self):
+        """Test that the ingredients param is required and validated"""
+        for params in ({}, {'ingredients': 'a,b'}):
+            response = self.client.get(PANTRY_URL, params)
+
+            self.assertEqual(
+                response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class RecipeImageTests(TestCase):
 
@@ -215,6 +632,72 @@ class RecipeImageTests(TestCase):
         self.assertIn('image', response.data)
         self.assertTrue(os.path.exists(self.recipe.image.path))
 
+    def test_upload_recipe_image_async(self):
+        """Test that uploads with Prefer: respond-async go through a job"""
+        upload_url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            img = Image.new('RGB', (10, 10))
+            img.save(ntf, format='JPEG')
+            ntf.seek(0)
+            response = self.client.post(
+                upload_url, {'image': ntf}, format='multipart',
+                HTTP_PREFER='respond-async')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response['Location'], response.data['url'])
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+        call_command('run_jobs', once=True, stdout=StringIO())
+        self.recipe.refresh_from_db()
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+
+        response = self.client.get(response.data['url'])
+        self.assertEqual(response.data['status'], 'succeeded')
+        self.assertEqual(response.data['result']['recipe'], self.recipe.id)
+
+    def test_upload_image_async_deduplicated(self):
+        """Test that async and sync uploads of the same image share one
+        content-addressed file"""
+        other = create_recipe(user=self.user, title='other')
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            img = Image.new('RGB', (10, 10))
+            img.save(ntf, format='JPEG')
+            ntf.seek(0)
+            self.client.post(
+                image_upload_url(self.recipe.id), {'image': ntf},
+                format='multipart')
+            ntf.seek(0)
+            self.client.post(
+                image_upload_url(other.id), {'image': ntf},
+                format='multipart', HTTP_PREFER='respond-async')
+
+        call_command('run_jobs', once=True, stdout=StringIO())
+        self.recipe.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(other.image.name, self.recipe.image.name)
+        self.assertEqual(
+            os.path.basename(os.path.dirname(other.image.name)),
+            os.path.basename(other.image.name)[:2])
+
+    def test_upload_invalid_image_async(self):
+        """Test that invalid async uploads fail their job"""
+        upload_url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            ntf.write(b'notimage')
+            ntf.seek(0)
+            response = self.client.post(
+                upload_url, {'image': ntf}, format='multipart',
+                HTTP_PREFER='respond-async')
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        call_command('run_jobs', once=True, stdout=StringIO())
+
+        response = self.client.get(response.data['url'])
+        self.assertEqual(response.data['status'], 'failed')
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
     def test_upload_invalid_image(self):
         upload_url = image_upload_url(self.recipe.id)
         response = self.client.post(
@@ -243,6 +726,18 @@ class RecipeImageTests(TestCase):
         self.assertIn(serializer2.data, response.data)
         self.assertNotIn(serializer3.data, response.data)
 
+    def test_filter_recipes_by_tags_distinct(self):
+        """Test that recipes matching several tags are listed once"""
+        recipe = create_recipe(user=self.user)
+        tag1 = create_tag(user=self.user, name='tag 1')
+        tag2 = create_tag(user=self.user, name='tag 2')
+        recipe.tags.add(tag1, tag2)
+
+        response = self.client.get(
+            RECIPES_URL, {'tags': f'{tag1.id},{tag2.id}'})
+
+        self.assertEqual([item['id'] for item in response.data], [recipe.id])
+
     def test_filter_recipes_by_ingredients(self):
         recipe1 = create_recipe(user=self.user, title='rec 1')
         recipe2 = create_recipe(user=self.user, title='rec 2')
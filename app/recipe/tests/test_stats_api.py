@@ -0,0 +1,118 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe, Tag
+
+
+STATS_URL = reverse('recipe:stats')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def create_user(email='testemail@example.com', password='testpass'):
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+def create_recipe(user, **params):
+    defaults = {
+        'title': 'sample title',
+        'time_minutes': 10,
+        'price': 10.00
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicStatsApiTests(TestCase):
+    """Test unauthenticated stats API access"""
+
+    def test_login_required(self):
+        response = APIClient().get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateStatsApiTests(TestCase):
+    """Test the recipe statistics API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.quick = Tag.objects.create(user=self.user, name='Quick')
+        self.salt = Ingredient.objects.create(user=self.user, name='Salt')
+
+    def test_empty_stats(self):
+        """Test the stats of a user without recipes"""
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'recipe_count': 0,
+            'average_time_minutes': None,
+            'average_price': None,
+            'tags': [],
+            'ingredients': [],
+        })
+
+    def test_stats_follow_changes(self):
+        """Test that creating, editing and deleting recipes and their
+        relations keeps the stats up to date"""
+        recipe1 = create_recipe(self.user, time_minutes=10, price=4)
+        recipe1.tags.add(self.vegan, self.quick)
+        recipe1.ingredients.add(self.salt)
+        recipe2 = create_recipe(self.user, time_minutes=30, price=5)
+        recipe2.tags.add(self.vegan)
+        self.client.patch(
+            detail_url(recipe2.id), {'price': '8.00', 'tags': []})
+        self.vegan.recipe_set.add(recipe2)
+        recipe3 = create_recipe(self.user, time_minutes=50, price=100)
+        recipe3.tags.add(self.quick)
+        recipe3.delete()
+        create_recipe(create_user('other@example.com'))
+
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.data['recipe_count'], 2)
+        self.assertEqual(response.data['average_time_minutes'], 20)
+        self.assertEqual(response.data['average_price'], '6.00')
+        self.assertEqual(
+            [
+                (item['name'], item['recipe_count'])
+                for item in response.data['tags']
+            ],
+            [('Vegan', 2), ('Quick', 1)]
+        )
+        self.assertEqual(
+            response.data['ingredients'],
+            [{'id': self.salt.id, 'name': 'Salt', 'recipe_count': 1}]
+        )
+
+    def test_removing_unlinked_tag(self):
+        """Test that removing a tag a recipe doesn't have changes nothing"""
+        recipe = create_recipe(self.user)
+        recipe.tags.add(self.vegan)
+        recipe.tags.remove(self.vegan, self.quick)
+        recipe.tags.remove(self.vegan)
+
+        self.vegan.refresh_from_db()
+        self.quick.refresh_from_db()
+        self.assertEqual(self.vegan.recipe_count, 0)
+        self.assertEqual(self.quick.recipe_count, 0)
+
+    def test_stats_constant_queries(self):
+        """Test that stats don't depend on the number of recipes"""
+        for i in range(5):
+            create_recipe(self.user).tags.add(self.vegan)
+
+        with self.assertNumQueries(3):
+            self.client.get(STATS_URL)
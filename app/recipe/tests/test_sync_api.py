@@ -0,0 +1,199 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.changelog import compact
+from core.models import ChangeLog, Ingredient, Recipe, Tag
+from core.normalization import merge_duplicates
+
+
+SYNC_URL = reverse('recipe:sync')
+
+
+def create_user(email='testemail@example.com', password='testpass'):
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+def create_recipe(user, **params):
+    defaults = {
+        'title': 'sample title',
+        'time_minutes': 10,
+        'price': 10.00
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicSyncApiTests(TestCase):
+    """Test unauthenticated sync API access"""
+
+    def test_login_required(self):
+        response = APIClient().get(SYNC_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class PrivateSyncApiTests(TestCase):
+    """Test the recipe sync API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe = create_recipe(self.user)
+        self.recipe.tags.add(self.tag)
+
+        other = create_user('other@example.com')
+        create_recipe(other, title='not synced')
+
+    def sync(self, cursor=None):
+        params = {'cursor': cursor} if cursor else {}
+        response = self.client.get(SYNC_URL, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_sync_from_scratch(self):
+        """Test that the first sync lists everything the user owns"""
+        data = self.sync()
+
+        self.assertTrue(data['reset'])
+        self.assertFalse(data['more'])
+        self.assertEqual(
+            [recipe['id'] for recipe in data['recipes']], [self.recipe.id])
+        self.assertEqual(data['recipes'][0]['tags'], [self.tag.id])
+        self.assertEqual(data['tags'], [{'id': self.tag.id, 'name': 'Vegan'}])
+        self.assertEqual(data['ingredients'], [])
+
+    def test_sync_changes_since_cursor(self):
+        """Test that later syncs return only changes and tombstones"""
+        cursor = self.sync()['cursor']
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        tag_id = self.tag.id
+        self.tag.delete()
+
+        data = self.sync(cursor)
+        self.assertFalse(data['reset'])
+        self.assertEqual(data['recipes'], [])
+        self.assertEqual(
+            data['ingredients'], [{'id': salt.id, 'name': 'Salt'}])
+        self.assertEqual(data['deleted']['tags'], [tag_id])
+
+        data = self.sync(data['cursor'])
+        self.assertEqual(data['ingredients'], [])
+        self.assertEqual(data['deleted']['tags'], [])
+
+    def test_sync_logs_link_changes(self):
+        """Test that relinking a recipe logs it"""
+        cursor = self.sync()['cursor']
+        self.recipe.tags.clear()
+
+        data = self.sync(cursor)
+        self.assertEqual(data['recipes'][0]['tags'], [])
+
+    def test_sync_after_merge(self):
+        """Test that merged duplicates sync as tombstones and their recipes
+        as changed"""
+        duplicate = Tag.objects.create(user=self.user, name='vegan!')
+        Tag.objects.filter(pk=duplicate.pk).update(name='vegan')
+        recipe = create_recipe(self.user, title='Stew')
+        recipe.tags.add(duplicate)
+        cursor = self.sync()['cursor']
+
+        merge_duplicates(Tag, [self.user.id])
+
+        data = self.sync(cursor)
+        self.assertEqual(data['deleted']['tags'], [duplicate.id])
+        self.assertEqual(
+            [(recipe['id'], recipe['tags']) for recipe in data['recipes']],
+            [(recipe.id, [self.tag.id])]
+        )
+
+    @override_settings(SYNC_PAGE_SIZE=2)
+    def test_sync_pages(self):
+        """Test that large deltas are returned a page at a time"""
+        data = self.sync()
+        self.assertTrue(data['more'])
+
+        data = self.sync(data['cursor'])
+        self.assertFalse(data['reset'])
+        self.assertFalse(data['more'])
+        self.assertEqual(data['recipes'][0]['id'], self.recipe.id)
+
+    @override_settings(SYNC_SETTLE_SECONDS=60)
+    def test_sync_waits_for_recent_entries(self):
+        """Test that entries which may not have committed are held back"""
+        data = self.sync()
+
+        self.assertEqual(data['recipes'], [])
+        self.assertEqual(data['cursor'].split('.')[0], '0')
+
+    def test_invalid_cursor(self):
+        """Test that malformed cursors are rejected"""
+        response = self.client.get(SYNC_URL, {'cursor': 'garbage'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(SYNC_TOMBSTONE_MAX_AGE=60)
+    def test_expired_cursor_resets(self):
+        """Test that cursors older than kept tombstones start over"""
+        change_id, issued, alias = self.sync()['cursor'].split('.', 2)
+
+        data = self.sync(f'{change_id}.{int(issued) - 120}.{alias}')
+        self.assertTrue(data['reset'])
+        self.assertEqual(len(data['recipes']), 1)
+
+    def test_compaction_keeps_sync_result(self):
+        """Test that compaction drops superseded entries only"""
+        for title in ('one', 'two', 'three'):
+            self.recipe.title = title
+            self.recipe.save()
+        before = self.sync()
+
+        self.assertGreater(compact(), 0)
+        self.assertEqual(
+            ChangeLog.objects.filter(
+                user=self.user, kind='recipe',
+                object_id=self.recipe.id).count(),
+            1
+        )
+        after = self.sync()
+        self.assertEqual(after['recipes'], before['recipes'])
+        self.assertEqual(after['tags'], before['tags'])
+
+
+class LateCommitSyncTests(TransactionTestCase):
+    """Resync markers are logged after commit, so these tests commit"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def sync_after_commit(self):
+        cursor = self.client.get(SYNC_URL).data['cursor']
+        with transaction.atomic():
+            Tag.objects.create(user=self.user, name='Vegan')
+        return self.client.get(SYNC_URL, {'cursor': cursor}).data
+
+    @override_settings(SYNC_SETTLE_SECONDS=0)
+    def test_late_commit_resets_cursors(self):
+        """Test that a commit after the settle window resets cursors"""
+        data = self.sync_after_commit()
+
+        self.assertTrue(data['reset'])
+        self.assertEqual(len(data['tags']), 1)
+
+    @override_settings(SYNC_SETTLE_SECONDS=60)
+    def test_commit_within_window_keeps_cursors(self):
+        """Test that commits within the settle window keep cursors"""
+        data = self.sync_after_commit()
+
+        self.assertFalse(data['reset'])
+        self.assertFalse(ChangeLog.objects.filter(kind='resync').exists())
@@ -80,6 +80,25 @@ class PrivateTagsApiTests(TestCase):
             user=self.user, name=payload['name']).exists()
         self.assertTrue(exists)
 
+    def test_create_existing_tag_returns_it(self):
+        """Test that creating a tag differing only in case and spacing
+        returns the existing tag"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+
+        response = self.client.post(TAGS_URL, {'name': ' vEGAN  '})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], tag.id)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    def test_create_tag_named_like_other_users_tag(self):
+        """Test that names are only unique per user"""
+        Tag.objects.create(user=create_user('other@example.com'), name='Vegan')
+
+        response = self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
     def create_invalid_tag(self):
         """Test creating a tag with invalid payload fails"""
         payload = {'name': ''}
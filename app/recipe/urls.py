@@ -12,5 +12,8 @@ router.register('recipes', views.RecipeViewSet)
 app_name = 'recipe'
 
 urlpatterns = [
+    path('stats/', views.RecipeStatsView.as_view(), name='stats'),
+    path('sync/', views.RecipeSyncView.as_view(), name='sync'),
+    path('events/', views.RecipeEventsView.as_view(), name='events'),
     path('', include(router.urls))
 ]
@@ -1,33 +1,76 @@
+import json
+import os
+import uuid
+from calendar import timegm
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count, DateTimeField, ExpressionWrapper, F, \
+    FloatField, Max, OuterRef, Prefetch, Q, Subquery
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, \
+    patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_etags, quote_etag
+
 from rest_framework.decorators import action
+from rest_framework.renderers import BaseRenderer
 from rest_framework.response import Response
-from rest_framework import viewsets, mixins, status
+from rest_framework.reverse import reverse
+from rest_framework import generics, viewsets, mixins, status
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.authentication import TokenAuthentication
 
-from core.models import Tag, Ingredient, Recipe
+from core.changelog import changes_since, make_cursor, read_cursor
+from core.events import replay
+from core.jobs import enqueue
+from core.models import ChangeLog, Tag, Ingredient, Recipe, \
+    RecipeSimilarity, RecipeStats
+from core.normalization import normalize_name
+from core.throttling import upload_slot
+from core.views import ReplicaReadMixin, ShardRoutingMixin
+from user.authentication import SignedTokenAuthentication
 
-from recipe import serializers
+from recipe import images, serializers
+from recipe.exceptions import PreconditionFailed, PreconditionRequired
 
 
-class BaseRecipeAttributeViewSet(viewsets.GenericViewSet,
+class BaseRecipeAttributeViewSet(ShardRoutingMixin,
+                                 ReplicaReadMixin,
+                                 viewsets.GenericViewSet,
                                  mixins.ListModelMixin,
                                  mixins.CreateModelMixin):
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (SignedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
         assigned_only = bool(self.request.query_params.get('assigned_only', 0))
         queryset = self.queryset
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            queryset = queryset.filter(
+                recipe__isnull=False, recipe__deleted_at__isnull=True)
 
         return queryset.\
             filter(user=self.request.user).\
             order_by('name').\
             distinct()
 
+    def create(self, request, *args, **kwargs):
+        """Create an object, or return the user's existing one with the
+        same normalized name"""
+        response = super().create(request, *args, **kwargs)
+        if not self.created:
+            response.status_code = status.HTTP_200_OK
+
+        return response
+
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        name = serializer.validated_data['name']
+        serializer.instance, self.created = self.queryset.get_or_create(
+            user=self.request.user,
+            normalized_name=normalize_name(name),
+            defaults={'name': name}
+        )
 
 
 class TagViewSet(BaseRecipeAttributeViewSet):
@@ -42,16 +85,91 @@ class IngredientViewSet(BaseRecipeAttributeViewSet):
     serializer_class = serializers.IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class ImageNegotiation(BaseContentNegotiation):
+    """Content negotiation of image responses, which pick their format
+    themselves; errors are rendered with the first renderer"""
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class RecipeViewSet(ShardRoutingMixin, ReplicaReadMixin,
+                    viewsets.ModelViewSet):
     serializer_class = serializers.RecipeSerializer
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthenticated,)
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (SignedTokenAuthentication,)
+    throttle_scope = None
+    expandable_relations = {'tags': Tag, 'ingredients': Ingredient}
+    pantry_limit = 50
+    pantry_max_limit = 200
+    multi_get_max_ids = 200
 
     def _csv_to_int_list(self, csv):
         """Convert comma serparated list to the corresponding int values"""
         return [int(str_value) for str_value in csv.split(',')]
 
+    def _csv_param(self, name):
+        """Return the non-empty values of a comma separated query param"""
+        csv = self.request.query_params.get(name, '')
+        return [value for value in csv.split(',') if value]
+
+    def _multi_get_ids(self):
+        """Return the ids of a `?ids=1,2,3` multi-get of details, or None
+        for a plain list"""
+        if self.action != 'list' or 'ids' not in self.request.query_params:
+            return None
+        try:
+            ids = {int(value) for value in self._csv_param('ids')}
+        except ValueError:
+            raise ValidationError('ids must be integers')
+        if len(ids) > self.multi_get_max_ids:
+            raise ValidationError(
+                f'At most {self.multi_get_max_ids} ids can be requested')
+        return ids
+
+    def _rendered_fields(self):
+        """Return the recipe fields the response will render"""
+        return self._csv_param('fields') or \
+            self.get_serializer_class().Meta.fields
+
+    def rendered_relations(self):
+        """Return {relation: queryset} for the relations to be rendered"""
+        fields = self._rendered_fields()
+        expand = self._csv_param('expand')
+        if self.action == 'retrieve' or self._multi_get_ids() is not None:
+            expand = self.expandable_relations
+
+        relations = {}
+        for relation, model in self.expandable_relations.items():
+            if relation not in fields:
+                continue
+            if relation in expand:
+                relations[relation] = model.objects.only(
+                    'id', 'name', 'updated_at')
+            else:
+                relations[relation] = model.objects.only('id')
+
+        return relations
+
+    def _sparse_queryset(self, queryset):
+        """Load only the columns and relations the response will render"""
+        fields = self._rendered_fields()
+        columns = [
+            field.name for field in Recipe._meta.concrete_fields
+            if field.name in fields
+        ]
+        queryset = queryset.only('id', 'updated_at', 'version', *columns)
+
+        for relation, related in self.rendered_relations().items():
+            queryset = queryset.prefetch_related(
+                Prefetch(relation, queryset=related))
+
+        return queryset
+
     def get_queryset(self):
         queryset = self.queryset
         tags = self.request.query_params.get('tags', None)
@@ -63,35 +181,420 @@ class RecipeViewSet(viewsets.ModelViewSet):
         if ingredients:
             ingredient_ids = self._csv_to_int_list(ingredients)
             queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+        if tags or ingredients:
+            # A recipe matching several of the ids is joined once per id
+            queryset = queryset.distinct()
+        ids = self._multi_get_ids()
+        if ids is not None:
+            # Other users' recipes are left out by the user filter below
+            queryset = queryset.filter(id__in=ids)
+
+        if self.action in ('list', 'retrieve'):
+            queryset = self._sparse_queryset(queryset)
 
         return queryset.filter(user=self.request.user).order_by('id')
 
+    def get_serializer_context(self):
+        """Pass requested sparse fields and expansions to the serializer"""
+        context = super().get_serializer_context()
+        if self.action in ('list', 'retrieve'):
+            context['fields'] = self._csv_param('fields')
+            context['expand'] = self._csv_param('expand')
+
+        return context
+
     def get_serializer_class(self):
-        if self.action == 'retrieve':
+        if self.action == 'retrieve' or self._multi_get_ids() is not None:
             return serializers.RecipeDetailSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'similar':
+            return serializers.SimilarRecipeSerializer
+        elif self.action == 'pantry':
+            return serializers.PantryRecipeSerializer
         return self.serializer_class
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-    @action(methods=['POST'], detail=True, url_path='upload-image')
-    def upload_image(self, request, pk=None):
+    def _last_modified(self, recipe):
+        """Return the latest modification time of a recipe and relations
+
+        Each relation's maximum is a subquery of its own, so the two link
+        tables are never joined into tags x ingredients rows.
+        """
+        related = Recipe.all_objects.filter(pk=recipe.pk).values(**{
+            name: Subquery(
+                model.all_objects.
+                filter(recipe=OuterRef('pk')).
+                order_by().
+                values('recipe').
+                annotate(latest=Max('updated_at')).
+                values('latest'),
+                output_field=DateTimeField()
+            )
+            for name, model in (
+                ('tags_updated_at', Tag),
+                ('ingredients_updated_at', Ingredient),
+            )
+        }).get()
+        return max(
+            timestamp for timestamp in (recipe.updated_at, *related.values())
+            if timestamp is not None
+        )
+
+    def _etag(self, recipe, last_modified):
+        return quote_etag(
+            f'{recipe.pk}-{recipe.version}-{last_modified.timestamp()}')
+
+    def retrieve(self, request, *args, **kwargs):
+        """Return a recipe detail, answering conditional requests early"""
+        recipe = self.get_object()
+        return self.detail_response(recipe, self._last_modified(recipe))
+
+    def check_preconditions(self, recipe):
+        """Refuse writes whose If-Match doesn't match the current ETag
+
+        Without If-Match, writes go through unless RECIPE_REQUIRE_IF_MATCH
+        is set. The ETag names the recipe's version rather than the bytes
+        of a response, so the weak form CompressionMiddleware turns it into
+        matches too.
+        """
+        if 'HTTP_IF_MATCH' not in self.request.META:
+            if settings.RECIPE_REQUIRE_IF_MATCH:
+                raise PreconditionRequired()
+            return
+
+        etags = [
+            etag[2:] if etag.startswith('W/') else etag
+            for etag in parse_etags(self.request.META['HTTP_IF_MATCH'])
+        ]
+        if etags == ['*']:
+            return
+        if self._etag(recipe, self._last_modified(recipe)) not in etags:
+            raise PreconditionFailed()
+
+    def update(self, request, *args, **kwargs):
+        """Update a recipe, answering with its new ETag
+
+        The serializer bumps the version the If-Match check was made
+        against, so a concurrent update in between still fails with 412.
+        """
         recipe = self.get_object()
+        self.check_preconditions(recipe)
+
         serializer = self.get_serializer(
             recipe,
-            data=request.data
+            data=request.data,
+            partial=kwargs.pop('partial', False)
         )
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+
+        recipe = serializer.instance
+        response = Response(serializer.data)
+        response['ETag'] = self._etag(recipe, self._last_modified(recipe))
+        return response
+
+    def perform_destroy(self, instance):
+        self.check_preconditions(instance)
+        # Links, neighbours and the row itself go with the next purge
+        instance.soft_delete()
+
+    def detail_response(self, recipe, last_modified):
+        """Return the detail response, or 304 if the client copy is fresh"""
+        etag = self._etag(recipe, last_modified)
+        last_modified = timegm(last_modified.utctimetuple())
+
+        response = get_conditional_response(
+            self.request,
+            etag=etag,
+            last_modified=last_modified
+        )
+        if response is None:
+            serializer = self.get_serializer(recipe)
+            response = Response(serializer.data)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """Return the recipes most similar to a recipe, best first"""
+        recipe = self.get_object()
+        neighbours = RecipeSimilarity.objects.\
+            filter(recipe=recipe, similar__deleted_at__isnull=True).\
+            select_related('similar').\
+            prefetch_related('similar__tags', 'similar__ingredients').\
+            order_by('-score', 'similar_id')
+
+        similar = []
+        for neighbour in neighbours:
+            neighbour.similar.score = neighbour.score
+            similar.append(neighbour.similar)
+
+        serializer = self.get_serializer(similar, many=True)
+        return Response(serializer.data)
+
+    def _image_width(self):
+        """Return the requested image width, the largest by default"""
+        widths = settings.RECIPE_IMAGE_WIDTHS
+        value = self.request.query_params.get('width')
+        if value is None:
+            return max(widths)
+        if not value.isdigit() or int(value) not in widths:
+            raise ValidationError(
+                f'width must be one of {", ".join(map(str, widths))}')
+        return int(value)
+
+    @action(methods=['GET'], detail=True,
+            content_negotiation_class=ImageNegotiation)
+    def image(self, request, pk=None):
+        """Serve the recipe image scaled down to `width`, in `format` or
+        else the best format the Accept header allows"""
+        recipe = self.get_object()
+        if not recipe.image:
+            raise NotFound('This recipe has no image')
+
+        width = self._image_width()
+        format = request.query_params.get('format')
+        if format is None:
+            format = images.negotiate(request.META.get('HTTP_ACCEPT'))
+        elif format not in images.available_formats():
+            raise ValidationError(
+                f'format must be one of '
+                f'{", ".join(images.available_formats())}')
+
+        etag = quote_etag(
+            images.cache_key(recipe.image.name, width, format))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            try:
+                derivative = images.derivative(recipe.image, width, format)
+            except FileNotFoundError:
+                raise NotFound('The recipe image is missing')
+            response = FileResponse(
+                derivative, content_type=images.FORMATS[format][1])
+            response['ETag'] = etag
+
+        if 'format' not in request.query_params:
+            patch_vary_headers(response, ['Accept'])
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def _pantry_params(self):
+        """Return the validated (ingredient ids, limit) of a pantry search"""
+        try:
+            ingredient_ids = [
+                int(value) for value in self._csv_param('ingredients')]
+            limit = int(self.request.query_params.get(
+                'limit', self.pantry_limit))
+        except ValueError:
+            raise ValidationError('ingredients and limit must be integers')
+        if not ingredient_ids:
+            raise ValidationError('ingredients is required')
+
+        return ingredient_ids, max(1, min(limit, self.pantry_max_limit))
+
+    @action(methods=['GET'], detail=False)
+    def pantry(self, request):
+        """Return recipes ranked by the fraction of their ingredients
+        found in the `ingredients` query param"""
+        ingredient_ids, limit = self._pantry_params()
+
+        # Only recipes using at least one pantry ingredient are grouped,
+        # found through the index on the link table's ingredient column
+        through = Recipe.ingredients.through
+        candidates = through.objects.\
+            filter(ingredient__in=ingredient_ids).\
+            values('recipe')
+        recipes = Recipe.objects.\
+            filter(user=request.user, id__in=candidates).\
+            annotate(
+                total=Count(
+                    'ingredients',
+                    filter=Q(ingredients__deleted_at__isnull=True)
+                ),
+                covered=Count(
+                    'ingredients',
+                    filter=Q(
+                        ingredients__in=ingredient_ids,
+                        ingredients__deleted_at__isnull=True
+                    )
+                ),
+            ).\
+            annotate(coverage=ExpressionWrapper(
+                F('covered') * 1.0 / F('total'),
+                output_field=FloatField()
+            )).\
+            order_by('-coverage', '-covered', 'id').\
+            prefetch_related('tags', 'ingredients')[:limit]
+
+        serializer = self.get_serializer(recipes, many=True)
+        return Response(serializer.data)
+
+    @action(methods=['POST'], detail=True, url_path='upload-image',
+            throttle_scope='upload')
+    def upload_image(self, request, pk=None):
+        with upload_slot(request.user):
+            recipe = self.get_object()
+            if 'respond-async' in request.META.get('HTTP_PREFER', ''):
+                return self.upload_image_async(request, recipe)
+
+            serializer = self.get_serializer(
+                recipe,
+                data=request.data
+            )
+
+            if serializer.is_valid():
+                serializer.save()
+                return Response(
+                    serializer.data,
+                    status=status.HTTP_200_OK
+                )
 
-        if serializer.is_valid():
-            serializer.save()
             return Response(
-                serializer.data,
-                status=status.HTTP_200_OK
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
             )
 
+    def upload_image_async(self, request, recipe):
+        """Store the upload and leave validating and attaching it to a job,
+        answering 202 with the job's status URL"""
+        serializer = serializers.PendingImageSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                serializer.errors,
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        image = serializer.validated_data['image']
+        extension = os.path.splitext(image.name)[1].lower()
+        name = default_storage.save(
+            f'uploads/pending/{uuid.uuid4()}{extension}', image)
+        job = enqueue(
+            'recipe.process_image',
+            {'recipe': recipe.pk, 'name': name},
+            user=request.user
+        )
+        url = reverse('core:job-detail', args=[job.pk], request=request)
         return Response(
-            serializer.errors,
-            status=status.HTTP_400_BAD_REQUEST
+            {'job': job.pk, 'status': job.status, 'url': url},
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': url}
+        )
+
+
+class RecipeStatsView(ShardRoutingMixin, ReplicaReadMixin,
+                      generics.GenericAPIView):
+    """Aggregate statistics of the user's recipes, read from rollups"""
+    serializer_class = serializers.RecipeStatsSerializer
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (SignedTokenAuthentication,)
+
+    def usage(self, model):
+        return model.objects.\
+            filter(user=self.request.user, recipe_count__gt=0).\
+            order_by('-recipe_count', 'name')
+
+    def get(self, request):
+        stats = RecipeStats.objects.filter(user=request.user).first() or \
+            RecipeStats(user=request.user)
+        stats.tags = self.usage(Tag)
+        stats.ingredients = self.usage(Ingredient)
+
+        serializer = self.get_serializer(stats)
+        return Response(serializer.data)
+
+
+class RecipeSyncView(ShardRoutingMixin, generics.GenericAPIView):
+    """Recipes, tags and ingredients changed or deleted since a cursor
+
+    Read from the change log on the primary database, since a replica
+    could hand out a cursor past entries it hasn't received yet. Without
+    a usable cursor, syncing starts from scratch and `reset` tells the
+    client to drop its copy first. Clients call again with the returned
+    cursor while `more` is set. A deleted tag or ingredient is gone from
+    the recipes that used it, too.
+    """
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (SignedTokenAuthentication,)
+    kinds = (
+        ('recipes', Recipe, serializers.RecipeSerializer),
+        ('tags', Tag, serializers.TagSerializer),
+        ('ingredients', Ingredient, serializers.IngredientSerializer),
+    )
+
+    def get(self, request):
+        alias = ChangeLog.objects.all().db
+        change_id = None
+        if request.query_params.get('cursor'):
+            try:
+                change_id = read_cursor(
+                    request.query_params['cursor'], alias, request.user.pk)
+            except ValueError:
+                raise ValidationError('Invalid cursor')
+
+        entries, more = changes_since(
+            request.user.pk, change_id or 0, settings.SYNC_PAGE_SIZE, alias)
+        latest = {(entry.kind, entry.object_id): entry for entry in entries}
+
+        data = {
+            'cursor': make_cursor(
+                entries[-1].id if entries else change_id or 0, alias),
+            'reset': change_id is None,
+            'more': more,
+            'deleted': {},
+        }
+        for name, model, serializer_class in self.kinds:
+            kind = model._meta.model_name
+            changed, deleted = [], []
+            for (entry_kind, pk), entry in latest.items():
+                if entry_kind == kind:
+                    (deleted if entry.deleted else changed).append(pk)
+
+            objects = model.objects.\
+                filter(user=request.user, pk__in=changed).\
+                order_by('id')
+            if model is Recipe:
+                objects = objects.prefetch_related('tags', 'ingredients')
+            data[name] = serializer_class(objects, many=True).data
+            data['deleted'][name] = sorted(deleted)
+
+        return Response(data)
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Renders server-sent events, and errors as an `error` event"""
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        return f'event: error\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+class RecipeEventsView(ShardRoutingMixin, generics.GenericAPIView):
+    """Server-sent events of changes to the user's recipes, tags and
+    ingredients
+
+    The ASGI application streams them (see recipe.asgi). Under WSGI, each
+    request returns the events missed since Last-Event-ID and ends, and
+    clients reconnect after the advertised retry interval.
+    """
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (SignedTokenAuthentication,)
+    renderer_classes = (EventStreamRenderer,)
+
+    def get(self, request):
+        events = replay(
+            request.user.pk,
+            ChangeLog.objects.all().db,
+            request.META.get('HTTP_LAST_EVENT_ID')
         )
+        retry = f'retry: {settings.SSE_RETRY_MILLISECONDS}\n\n'.encode()
+        return Response(b''.join([retry, *events]))
@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.utils.translation import ugettext_lazy as _
+
+from rest_framework import authentication, exceptions
+
+
+TOKEN_SALT = 'user.authentication.SignedTokenAuthentication'
+
+
+def create_signed_token(user):
+    """Create a signed token carrying the user id and token version"""
+    return signing.dumps([user.pk, user.token_version], salt=TOKEN_SALT)
+
+
+def read_signed_token(key):
+    """Verify signature and expiry of a signed token, return its payload"""
+    try:
+        user_id, version = signing.loads(
+            key,
+            salt=TOKEN_SALT,
+            max_age=settings.AUTH_TOKEN_MAX_AGE
+        )
+    except signing.SignatureExpired:
+        raise exceptions.AuthenticationFailed(_('Token has expired.'))
+    except (signing.BadSignature, TypeError, ValueError):
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+    return user_id, version
+
+
+class SignedTokenAuthentication(authentication.TokenAuthentication):
+    """Authenticate signed expiring tokens, falling back to legacy DB tokens
+
+    Signed tokens contain ':' separators which never appear in the hex keys
+    of rest_framework.authtoken tokens, so both can share the Token keyword.
+    """
+
+    def authenticate_credentials(self, key):
+        if ':' not in key:
+            return super().authenticate_credentials(key)
+
+        user_id, version = read_signed_token(key)
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is None or not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        if user.token_version != version:
+            raise exceptions.AuthenticationFailed(_('Token has been revoked.'))
+
+        return (user, key)
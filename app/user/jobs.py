@@ -0,0 +1,16 @@
+from collections import Counter
+
+from core.deletion import purge_user
+from core.jobs import register, set_result
+
+
+@register('user.delete_account')
+def delete_account(job):
+    """Purge a deactivated account, reporting the rows deleted so far"""
+    deleted = Counter(job.result.get('deleted', {}))
+
+    def progress(**counts):
+        deleted.update(counts)
+        set_result(job, deleted=dict(deleted))
+
+    purge_user(job.payload['user'], progress=progress)
@@ -24,6 +24,8 @@ class UserSerializer(serializers.ModelSerializer):
 
         if password:
             user.set_password(password)
+            # Revokes every signed token issued before the password change
+            user.token_version += 1
             user.save()
 
         return user
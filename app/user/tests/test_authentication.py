@@ -0,0 +1,90 @@
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from rest_framework import status
+
+from user.authentication import create_signed_token
+
+
+TOKEN_URL = reverse('user:token')
+ME_URL = reverse('user:me')
+
+
+def create_user(**params):
+    return get_user_model().objects.create_user(**params)
+
+
+class SignedTokenAuthenticationTests(TestCase):
+    """Test signed and legacy token authentication"""
+
+    def setUp(self):
+        self.payload = {'email': 'test@example.com', 'password': 'testpass'}
+        self.user = create_user(**self.payload)
+        self.client = APIClient()
+
+    def test_signed_token_issued_without_db_token(self):
+        """Test that logging in does not create an authtoken row"""
+        response = self.client.post(TOKEN_URL, self.payload)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(':', response.data['token'])
+        self.assertFalse(Token.objects.exists())
+
+    def test_signed_token_authenticates(self):
+        """Test that a signed token grants access to the me url"""
+        token = self.client.post(TOKEN_URL, self.payload).data['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], self.user.email)
+
+    def test_expired_signed_token_rejected(self):
+        """Test that a signed token older than the max age is rejected"""
+        with patch('time.time', return_value=0):
+            token = create_signed_token(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_tampered_signed_token_rejected(self):
+        """Test that a signed token with a bad signature is rejected"""
+        token = create_signed_token(self.user) + 'x'
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_revokes_signed_tokens(self):
+        """Test that changing the password invalidates older tokens"""
+        token = create_signed_token(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        response = self.client.patch(ME_URL, {'password': 'newpass'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_legacy_db_token_still_accepted(self):
+        """Test that existing authtoken tokens keep working"""
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(AUTH_TOKEN_SIGNED=False)
+    def test_legacy_token_mode(self):
+        """Test that legacy mode issues database tokens"""
+        response = self.client.post(TOKEN_URL, self.payload)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(
+            Token.objects.filter(key=response.data['token']).exists())
@@ -1,10 +1,15 @@
+from io import StringIO
+
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.urls import reverse
 
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from core.models import Job
+
 
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
@@ -141,3 +146,19 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
+
+    def test_delete_me(self):
+        """Test that deleting the account deactivates it and purges it in
+        the background"""
+        response = self.client.delete(ME_URL)
+        self.user.refresh_from_db()
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(self.user.is_active)
+        self.assertEqual(self.user.token_version, 1)
+
+        call_command('run_jobs', once=True, stdout=StringIO())
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists())
+        job = Job.objects.get(pk=response.data['job'])
+        self.assertEqual(job.status, Job.SUCCEEDED)
@@ -1,7 +1,13 @@
-from rest_framework import generics, authentication, permissions
+from django.conf import settings
+
+from rest_framework import generics, permissions, status
 from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.response import Response
 from rest_framework.settings import api_settings
 
+from core.jobs import enqueue
+from user.authentication import SignedTokenAuthentication, \
+    create_signed_token
 from user.serializers import UserSerializer, AuthTokenSerializer
 
 
@@ -13,15 +19,47 @@ class CreateUserView(generics.CreateAPIView):
 class CreateTokenView(ObtainAuthToken):
     """Create a new auth token for the user"""
     serializer_class = AuthTokenSerializer
+    throttle_scope = 'token'
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
+    def post(self, request, *args, **kwargs):
+        """Issue a signed token without writing to the database"""
+        if not settings.AUTH_TOKEN_SIGNED:
+            return super().post(request, *args, **kwargs)
+
+        serializer = self.serializer_class(
+            data=request.data,
+            context={'request': request}
+        )
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+
+        return Response({
+            'token': create_signed_token(user),
+            'expires_in': settings.AUTH_TOKEN_MAX_AGE
+        })
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """Manage an authenticated user"""
     serializer_class = UserSerializer
-    authentication_classes = (authentication.TokenAuthentication,)
+    authentication_classes = (SignedTokenAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get_object(self):
         """Return the authenticated user"""
         return self.request.user
+
+    def destroy(self, request, *args, **kwargs):
+        """Deactivate the user at once and purge their data in a job"""
+        user = self.get_object()
+        user.is_active = False
+        # Revokes every signed token
+        user.token_version += 1
+        user.save(update_fields=['is_active', 'token_version'])
+
+        job = enqueue('user.delete_account', {'user': user.pk})
+        return Response(
+            {'job': job.pk, 'status': job.status},
+            status=status.HTTP_202_ACCEPTED
+        )